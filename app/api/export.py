@@ -0,0 +1,42 @@
+from typing import AsyncIterator
+
+import orjson
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from app.services.database.repositories.base import BaseCrud
+from app.services.database.repositories.posts import LikeCrud, PostCrud
+from app.services.database.schemas.posts import LikeInDB, PostInDB
+from app.services.database.schemas.users import UserInDB
+from app.services.security.permissions import get_current_active_superuser
+
+router = APIRouter()
+
+NDJSON = 'application/x-ndjson'
+
+
+async def ndjson_lines(crud: BaseCrud, schema: type[BaseModel]) -> AsyncIterator[bytes]:
+    '''One json object per row and line, a chunk per fetched batch.'''
+    fields = tuple(schema.__fields__)
+    async for rows in crud.stream():
+        yield b''.join(
+            orjson.dumps({field: getattr(row, field) for field in fields}) + b'\n'
+            for row in rows
+        )
+
+
+@router.get('/export/posts', response_class=StreamingResponse)
+async def export_posts(
+    posts_crud: PostCrud = Depends(),
+    current_user: UserInDB = Depends(get_current_active_superuser),
+):
+    return StreamingResponse(ndjson_lines(posts_crud, PostInDB), media_type=NDJSON)
+
+
+@router.get('/export/likes', response_class=StreamingResponse)
+async def export_likes(
+    like_crud: LikeCrud = Depends(),
+    current_user: UserInDB = Depends(get_current_active_superuser),
+):
+    return StreamingResponse(ndjson_lines(like_crud, LikeInDB), media_type=NDJSON)
@@ -1,92 +1,274 @@
-import json
+import asyncio
 
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import ORJSONResponse
 from fastapi_cache.backends.redis import RedisCacheBackend
 from sqlalchemy.exc import IntegrityError
 
-from app.services.database.repositories.posts import LikeCrud, PostCrud
+from app.core.config import settings
+from app.services.database.repositories.posts import (LikeCrud, PostCrud,
+                                                      UpsertStatus)
+from app.services.database.schemas.pagination import Page
 from app.services.database.schemas.posts import (LikeCreate, LikeInDB,
-                                                 PostBase, PostCreate,
-                                                 PostInDB, PostInDBLikes,
-                                                 PostUpdate)
+                                                 PostBase, PostBatchCreate,
+                                                 PostCreate, PostInDB,
+                                                 PostInDBLikes, PostScore,
+                                                 PostSearchResult, PostUpdate,
+                                                 TopPost)
 from app.services.database.schemas.users import UserInDB
+from app.services.leaderboard import Leaderboard, Window, get_leaderboard
+from app.services.likes_buffer import (LikeFlusher, get_like_flusher,
+                                       merge_pending_likes)
+from app.services.query_counter import query_budget
+from app.services.rate_limit import limit_by_user
 from app.services.security.permissions import (get_current_active_user,
                                                is_post_author)
-from app.utils.cache import redis_cache
+from app.utils.cache import (LIKE_CACHE_KEY, POST_CACHE_KEY,
+                             POST_SUMMARY_CACHE_KEY, TaggedCache, get_or_load,
+                             post_tag, redis_cache, tagged_cache)
+from app.utils.pagination import Pagination, RankedPagination
 
 router = APIRouter()
 
 
-LIKE_CACHE_KEY = 'likes:{post_id}'
+@router.get(
+    '/posts',
+    response_model=Page[PostInDB],
+    dependencies=[Depends(query_budget(1))],
+)
+async def get_posts_list(
+    pagination: Pagination = Depends(),
+    ids: str | None = Query(
+        None,
+        regex=r'^\d+(,\d+)*$',
+        description='Comma separated ids, returns these posts instead of a page',
+    ),
+    posts_crud: PostCrud = Depends(),
+    cache: TaggedCache = Depends(tagged_cache),
+):
+    if ids is not None:
+        return await get_posts_by_ids(ids, posts_crud, cache)
+    posts = await posts_crud.get_list(
+        after_id=pagination.after_id,
+        limit=pagination.fetch_limit,
+    )
+    return pagination.page(posts)
 
 
-@router.get('/posts', response_model=list[PostInDB])
-async def get_posts_list(posts_crud: PostCrud = Depends()):
-    posts = await posts_crud.get_list()
-    return posts
+async def get_posts_by_ids(
+    ids: str,
+    posts_crud: PostCrud,
+    cache: TaggedCache,
+) -> Response:
+    post_ids = list(dict.fromkeys(int(post_id) for post_id in ids.split(',')))
+    if len(post_ids) > settings.MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'At most {settings.MAX_PAGE_SIZE} ids are allowed',
+        )
+    # Posts in the requested order, already serialized, missing ones skipped.
+    posts = await get_post_summaries(post_ids, posts_crud, cache)
+    items = ','.join(post for post in posts.values() if post is not None)
+    return Response(
+        f'{{"items":[{items}],"next_cursor":null}}',
+        media_type='application/json',
+    )
 
 
-@router.post('/posts', response_model=PostInDB, status_code=status.HTTP_201_CREATED)
+async def get_post_summaries(
+    post_ids: list[int],
+    posts_crud: PostCrud,
+    cache: TaggedCache,
+) -> dict[int, str | None]:
+    '''PostInDB json of every post, None for missing ones, in one query.'''
+    keys = {
+        POST_SUMMARY_CACHE_KEY.format(post_id=post_id): post_id
+        for post_id in post_ids
+    }
+
+    async def load(missing: list[str]) -> dict[str, str]:
+        posts = await posts_crud.get_many([keys[key] for key in missing])
+        return {
+            POST_SUMMARY_CACHE_KEY.format(post_id=post.id):
+                PostInDB.from_orm(post).json()
+            for post in posts
+        }
+
+    posts = await cache.get_or_set_many(
+        {key: [post_tag(post_id)] for key, post_id in keys.items()}, load
+    )
+    return {keys[key]: post for key, post in posts.items()}
+
+
+@router.get('/posts/top', response_model=list[TopPost])
+async def get_top_posts(
+    window: Window | None = Query(None, description='All time if not given'),
+    limit: int = Query(settings.PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    posts_crud: PostCrud = Depends(),
+    cache: TaggedCache = Depends(tagged_cache),
+    leaderboard: Leaderboard | None = Depends(get_leaderboard),
+):
+    if leaderboard is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Leaderboard is not available',
+        )
+    ranked = await leaderboard.top(window, limit)
+    posts = await get_post_summaries(
+        [post_id for post_id, _ in ranked], posts_crud, cache
+    )
+    top = []
+    for post_id, window_score in ranked:
+        # Deleted posts linger in the sorted sets until reconciled.
+        if posts[post_id] is not None:
+            post = orjson.loads(posts[post_id])
+            post['window_score'] = window_score
+            top.append(post)
+    return ORJSONResponse(top)
+
+
+@router.get('/posts/search', response_model=Page[PostSearchResult])
+async def search_posts(
+    q: str = Query(..., min_length=1, max_length=settings.SEARCH_QUERY_MAX_LENGTH),
+    pagination: RankedPagination = Depends(),
+    posts_crud: PostCrud = Depends(),
+):
+    posts = await posts_crud.search(
+        q,
+        after=pagination.after,
+        limit=pagination.fetch_limit,
+    )
+    return pagination.page(posts)
+
+
+# Budgets of authenticated routes count the user lookup on a cold cache.
+@router.post(
+    '/posts',
+    response_model=PostInDB,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(query_budget(2))],
+)
 async def create_post(
     data: PostCreate,
     posts_crud: PostCrud = Depends(),
     user: UserInDB = Depends(get_current_active_user),
+    cache: RedisCacheBackend = Depends(redis_cache),
 ):
     post = await posts_crud.create(
         PostBase(**data.dict(),
                  owner_id=user.id,)
     )
+    # The id may have been looked up recently and cached as missing.
+    await cache.delete(LIKE_CACHE_KEY.format(post_id=post.id))
     return post
 
 
-@router.patch('/posts/{post_id}', response_model=PostInDB)
+@router.post(
+    '/posts/batch',
+    response_model=list[PostInDB],
+    status_code=status.HTTP_201_CREATED,
+)
+async def create_posts_batch(
+    data: PostBatchCreate,
+    posts_crud: PostCrud = Depends(),
+    user: UserInDB = Depends(get_current_active_user),
+    cache: RedisCacheBackend = Depends(redis_cache),
+):
+    posts = await posts_crud.create_many(
+        [PostBase(**post.dict(), owner_id=user.id) for post in data]
+    )
+    await asyncio.gather(*(
+        cache.delete(LIKE_CACHE_KEY.format(post_id=post.id)) for post in posts
+    ))
+    return posts
+
+
+@router.patch(
+    '/posts/{post_id}',
+    response_model=PostInDB,
+    dependencies=[Depends(query_budget(3))],
+)
 async def update_post(
     data: PostUpdate,
     post_id: int,
     posts_crud: PostCrud = Depends(),
     user: UserInDB = Depends(is_post_author),
+    cache: TaggedCache = Depends(tagged_cache),
 ):
     post = await posts_crud.update(
         post_id=post_id,
         new_data=data
     )
+    await cache.invalidate(post_tag(post_id))
     return post
 
 
-@router.delete('/posts/{post_id}', response_model=PostInDB)
+@router.delete(
+    '/posts/{post_id}',
+    response_model=PostInDB,
+    dependencies=[Depends(query_budget(3))],
+)
 async def delete_post(
     post_id: int,
     posts_crud: PostCrud = Depends(),
     user: UserInDB = Depends(is_post_author),
+    cache: RedisCacheBackend = Depends(redis_cache),
+    post_cache: TaggedCache = Depends(tagged_cache),
+    leaderboard: Leaderboard | None = Depends(get_leaderboard),
 ):
-    post = await posts_crud.delete(post_id=post_id)
+    post = await posts_crud.delete(post_id)
+    # Cached likes have no TTL, the post would keep them for good.
+    await cache.delete(LIKE_CACHE_KEY.format(post_id=post_id))
+    await post_cache.invalidate(post_tag(post_id))
+    if leaderboard is not None:
+        await leaderboard.remove(post_id)
     return post
 
 
-@router.get('/posts/{post_id}', response_model=PostInDBLikes)
+@router.get(
+    '/posts/{post_id}',
+    response_model=PostInDBLikes,
+    dependencies=[Depends(query_budget(2))],
+)
 async def get_post(
     post_id: int,
-    posts_crud: PostCrud = Depends()
-) -> PostInDBLikes:
-    post = await posts_crud.get_with_likes(post_id)
+    posts_crud: PostCrud = Depends(),
+    cache: TaggedCache = Depends(tagged_cache),
+):
+    async def load() -> str | None:
+        post = await posts_crud.get_with_likes(post_id)
+        if post:
+            return PostInDBLikes.from_orm(post).json()
+
+    post = await cache.get_or_set(
+        POST_CACHE_KEY.format(post_id=post_id), [post_tag(post_id)], load
+    )
     if not post:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Post not found',
         )
-    return post
+    return Response(post, media_type='application/json')
+
 
+limit_likes = Depends(limit_by_user('likes', settings.RATE_LIMIT_LIKES))
+likes_budget = Depends(query_budget(3))
 
-@router.post('/posts/{post_id}/likes')
+
+@router.post('/posts/{post_id}/likes', dependencies=[limit_likes, likes_budget])
 async def add_like(
     post_id: int,
     data: LikeCreate,
     posts_crud: PostCrud = Depends(),
     like_crud: LikeCrud = Depends(),
     user: UserInDB = Depends(get_current_active_user),
-    cache: RedisCacheBackend = Depends(redis_cache)
+    cache: RedisCacheBackend = Depends(redis_cache),
+    post_cache: TaggedCache = Depends(tagged_cache),
+    flusher: LikeFlusher | None = Depends(get_like_flusher),
+    leaderboard: Leaderboard | None = Depends(get_leaderboard),
 ):
-    post = await posts_crud.get_by_id(post_id)
+    post = await posts_crud.get_by_id(post_id, primary=True)
     if not post:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -98,57 +280,97 @@ async def add_like(
             detail='you cant like your posts',
         )
 
-    like = await like_crud.update(user.id, post_id, data.value)
-    if not like:
-        await like_crud.create(user.id, post_id, data.value)
-    await cache.delete(LIKE_CACHE_KEY.format(post_id=post_id))
-    return {'message': 'Successfully like'}
+    if flusher:
+        await flusher.add(post_id, user.id, data.value)
+        return {'message': 'Successfully like', 'status': 'pending'}
+    result = await like_crud.upsert(user.id, post_id, data.value)
+    if result != UpsertStatus.UNCHANGED:
+        await cache.delete(LIKE_CACHE_KEY.format(post_id=post_id))
+        await post_cache.invalidate(post_tag(post_id))
+        if leaderboard is not None:
+            # An update flips the vote, taking back the old one as well.
+            delta = data.value if result == UpsertStatus.INSERTED else 2 * data.value
+            await leaderboard.incr(post_id, delta)
+    return {'message': 'Successfully like', 'status': result}
 
 
-@router.delete('/posts/{post_id}/likes', status_code=status.HTTP_204_NO_CONTENT)
+@router.delete(
+    '/posts/{post_id}/likes',
+    status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=[limit_likes, likes_budget],
+)
 async def delete_like(
     post_id: int,
     posts_crud: PostCrud = Depends(),
     like_crud: LikeCrud = Depends(),
     user: UserInDB = Depends(get_current_active_user),
     cache: RedisCacheBackend = Depends(redis_cache),
+    post_cache: TaggedCache = Depends(tagged_cache),
+    flusher: LikeFlusher | None = Depends(get_like_flusher),
+    leaderboard: Leaderboard | None = Depends(get_leaderboard),
 ):
-    post = await posts_crud.get_by_id(post_id)
+    post = await posts_crud.get_by_id(post_id, primary=True)
     if not post:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail='Post not found',
         )
-    is_deleted = await like_crud.delete(user.id, post_id)
-    if is_deleted:
+    if flusher:
+        await flusher.add(post_id, user.id, 0)
+        return {'message': 'Like deleted'}
+    removed = await like_crud.delete(user.id, post_id)
+    if removed is not None:
         await cache.delete(LIKE_CACHE_KEY.format(post_id=post_id))
+        await post_cache.invalidate(post_tag(post_id))
+        if leaderboard is not None:
+            await leaderboard.incr(post_id, -removed)
         return {'message': 'Like deleted'}
-    return Response(
-        {'message': 'you havent liked yet'},
-        status_code=status.HTTP_400_BAD_REQUEST
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail='you havent liked yet',
     )
 
 
-@router.get('/posts/{post_id}/likes')
+@router.get(
+    '/posts/{post_id}/likes',
+    response_model=list[LikeInDB],
+    dependencies=[Depends(query_budget(1))],
+)
 async def get_likes(
     post_id: int,
-    posts_crud: PostCrud = Depends(),
     like_crud: LikeCrud = Depends(),
-    cache: RedisCacheBackend = Depends(redis_cache)
+    cache: RedisCacheBackend = Depends(redis_cache),
+    flusher: LikeFlusher | None = Depends(get_like_flusher),
 ):
-    post = await posts_crud.get_by_id(post_id)
-    key = LIKE_CACHE_KEY.format(post_id=post_id)
-    in_cache = await cache.get(key)
-    if not in_cache:
-        if not post:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail='Post not found',
-            )
+    async def load() -> bytes | None:
         likes = await like_crud.get_posts_likes(post_id)
-        likes = [LikeInDB.from_orm(like).dict() for like in likes]
-        await cache.set(key, json.dumps(likes))
-        return likes
-    else:
-        in_cache = json.loads(in_cache)
-        return in_cache
+        if likes is not None:
+            return orjson.dumps(likes)
+
+    in_cache = await get_or_load(cache, LIKE_CACHE_KEY.format(post_id=post_id), load)
+    if in_cache is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Post not found',
+        )
+    if flusher:
+        pending = await flusher.buffer.get_pending(post_id)
+        if pending:
+            likes = merge_pending_likes(post_id, orjson.loads(in_cache), pending)
+            return ORJSONResponse(likes)
+    # Sent as cached, without parsing and validating it again.
+    return Response(in_cache, media_type='application/json')
+
+
+@router.get('/posts/{post_id}/score', response_model=PostScore)
+async def get_score(
+    post_id: int,
+    posts_crud: PostCrud = Depends(),
+):
+    score = await posts_crud.get_score(post_id)
+    if not score:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Post not found',
+        )
+    return score
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, Response
+
+from app.services.database.schemas.users import UserInDB
+from app.services.database.session import get_engine
+from app.services.metrics import render
+from app.services.security.permissions import get_current_active_superuser
+from app.utils.cache import redis_cache
+
+router = APIRouter()
+
+
+@router.get('/metrics', include_in_schema=False)
+def metrics():
+    # Sync, so reading the files of other workers runs in the threadpool.
+    body, content_type = render()
+    return Response(body, media_type=content_type)
+
+
+@router.get('/stats/db-pool')
+async def db_pool_stats(
+    current_user: UserInDB = Depends(get_current_active_superuser)
+):
+    return get_engine().pool.stats()
+
+
+@router.get('/stats/cache')
+async def cache_stats(
+    cache=Depends(redis_cache),
+    current_user: UserInDB = Depends(get_current_active_superuser),
+):
+    stats = getattr(cache, 'stats', None)
+    if stats is None:
+        return {}
+    return {**stats, 'hit_ratios': cache.hit_ratios()}
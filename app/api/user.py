@@ -1,20 +1,29 @@
-import asyncio
 from datetime import timedelta
 
 from fastapi import APIRouter, Depends, Form, HTTPException, Query, status
 
 from app.core.config import settings
 from app.services.database.repositories.users import UserCrud
+from app.services.database.schemas.pagination import Page
 from app.services.database.schemas.tokens import Token
 from app.services.database.schemas.users import User, UserCreate, UserInDB
+from app.services.email_verification import (EmailJob, EmailQueue,
+                                              get_email_queue)
+from app.services.rate_limit import limit_by_client
 from app.services.security.jwt import create_access_token
-from app.services.security.permissions import get_current_active_user
-from app.utils.check_email import check_email
+from app.services.security.permissions import (get_current_active_superuser,
+                                               get_current_active_user)
+from app.services.user_cache import user_cache
+from app.utils.pagination import Pagination
 
 router = APIRouter()
 
 
-@router.post('/token', response_model=Token)
+@router.post(
+    '/token',
+    response_model=Token,
+    dependencies=[Depends(limit_by_client('token', settings.RATE_LIMIT_TOKEN))],
+)
 async def login_for_access_token(
     username: str = Form(),
     password: str = Form(),
@@ -36,20 +45,38 @@ async def login_for_access_token(
     return {'access_token': access_token, 'token_type': 'bearer'}
 
 
-@router.post('/sign-up', response_model=User, status_code=status.HTTP_201_CREATED)
+@router.post(
+    '/sign-up',
+    response_model=User,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(limit_by_client('sign-up', settings.RATE_LIMIT_SIGN_UP))],
+)
 async def user_registration(
     user: UserCreate,
-    crud: UserCrud = Depends()
+    crud: UserCrud = Depends(),
+    email_queue: EmailQueue | None = Depends(get_email_queue),
 ):
     user = await crud.create_user(user)
-    asyncio.create_task(check_email(user.email, crud))
+    if email_queue:
+        await email_queue.put(EmailJob(email=user.email))
     return user
 
 
-@router.get('/users', response_model=list[User])
+@router.get('/users', response_model=Page[User])
 async def users_list(
+    pagination: Pagination = Depends(),
     crud: UserCrud = Depends(),
     current_user: UserInDB = Depends(get_current_active_user)
 ):
-    users = await crud.get_list()
-    return users
+    users = await crud.get_list(
+        after_id=pagination.after_id,
+        limit=pagination.fetch_limit,
+    )
+    return pagination.page(users)
+
+
+@router.get('/users/cache-stats')
+async def users_cache_stats(
+    current_user: UserInDB = Depends(get_current_active_superuser)
+):
+    return user_cache.stats
@@ -1,6 +1,7 @@
 import os
+import re
 import secrets
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Literal, Optional
 
 from pydantic import BaseSettings, PostgresDsn, RedisDsn, validator
 
@@ -12,13 +13,49 @@ class Settings(BaseSettings):
         )
     HOST: str = 'localhost'
     PORT: int = 80
+    # Server processes started by `python -m app.main`.
+    WORKERS: int = 1
+    # 'auto' uses uvloop and httptools when they are installed.
+    SERVER_LOOP: Literal['auto', 'asyncio', 'uvloop'] = 'auto'
+    SERVER_HTTP: Literal['auto', 'h11', 'httptools'] = 'auto'
+    # Above the 60 s idle timeout of most load balancers, so they never
+    # send a request on a connection we are closing.
+    SERVER_KEEP_ALIVE: int = 75
+    SERVER_BACKLOG: int = 2048
+    # Seconds in-flight requests get to finish after SIGTERM.
+    SERVER_GRACEFUL_TIMEOUT: int = 30
+    # Connections and tasks over this answer 503 instead of queueing.
+    SERVER_LIMIT_CONCURRENCY: Optional[int] = None
+    SERVER_ACCESS_LOG: bool = True
 
     SECRET_KEY: str = secrets.token_urlsafe(32)
 
     EMAIL_HUNTER_API_KEY: str
+    EMAIL_VERIFIER_URL: str = 'https://api.hunter.io/v2/email-verifier'
+    EMAIL_VERIFIER_TIMEOUT: float = 20
+    # Verification worker, fed from a Redis list.
+    EMAIL_VERIFICATION_WORKER: bool = True
+    EMAIL_VERIFICATION_CONCURRENCY: int = 4
+    EMAIL_VERIFICATION_MAX_ATTEMPTS: int = 5
+    EMAIL_VERIFICATION_BACKOFF: float = 2
+    EMAIL_VERIFICATION_MAX_BACKOFF: float = 600
 
     # 60 minutes * 24 hours * 8 days = 8 days
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8
+    TOKEN_CACHE_MAXSIZE: int = 10_000
+
+    # bcrypt runs in a process pool of this size, None is one per CPU
+    # and 0 hashes on the event loop.
+    PASSWORD_HASH_WORKERS: Optional[int] = None
+    BCRYPT_ROUNDS: int = 12
+
+    PAGE_SIZE: int = 50
+    MAX_PAGE_SIZE: int = 500
+    # Most posts created by one POST /posts/batch request.
+    POST_BATCH_MAX_SIZE: int = 500
+    SEARCH_QUERY_MAX_LENGTH: int = 200
+    # Rows fetched per round trip by the server-side cursor of /export.
+    EXPORT_FETCH_SIZE: int = 1_000
 
     POSTGRES_SERVER: str
     POSTGRES_USER: str
@@ -27,11 +64,68 @@ class Settings(BaseSettings):
     POSTGRES_PORT: str = 5432
     SQLALCHEMY_DATABASE_URI: Optional[PostgresDsn] = None
 
+    # Read-only CRUD methods are spread over these, round-robin.
+    DB_REPLICA_URIS: list[str] = []
+    # Seconds before a replica that failed to connect is tried again.
+    DB_REPLICA_RETRY_AFTER: float = 30
+
+    DB_ECHO: bool = False
+    DB_CONNECT_TIMEOUT: float = 10
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = False
+    # Connections opened at startup, so the first requests find them ready.
+    DB_POOL_WARMUP: int = 5
+    # Prepared statements kept per connection by asyncpg and SQLAlchemy.
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    # Turns prepared statements off for PgBouncer in transaction mode.
+    DB_PGBOUNCER: bool = False
+    # Per-request statement counts in X-DB-Queries and X-DB-Time-Ms.
+    # Strict mode raises when a route goes over its query budget.
+    DB_QUERY_COUNTER: bool = False
+    DB_QUERY_COUNTER_STRICT: bool = False
+    DB_N_PLUS_ONE_THRESHOLD: int = 3
+
     REDIS_PASSWORD: str
     REDIS_PORT: str
     REDIS_HOST: str
     REDIS_URI: Optional[RedisDsn] = None
 
+    # Authenticated users, cached in process and in Redis.
+    USER_CACHE_TTL: int = 300
+    USER_CACHE_LOCAL_TTL: int = 5
+    USER_CACHE_LOCAL_MAXSIZE: int = 10_000
+    POST_CACHE_TTL: int = 60
+    # Not found answers are cached too, but only briefly.
+    CACHE_NEGATIVE_TTL: int = 5
+    CACHE_LOCK_TIMEOUT: int = 5
+    CACHE_LOCK_POLL_INTERVAL: float = 0.05
+    # In-process tier in front of Redis, evicted over pub/sub on deletes.
+    CACHE_LOCAL_TTL: float = 5
+    CACHE_LOCAL_MAXSIZE: int = 10_000
+    CACHE_INVALIDATION_CHANNEL: str = 'cache:invalidate'
+
+    LEADERBOARD_WINDOW_CACHE_TTL: int = 30
+    LEADERBOARD_RECONCILE_INTERVAL: int = 3600
+    LEADERBOARD_RECONCILE_BATCH_SIZE: int = 10_000
+
+    # Sliding window limits, as (requests, seconds), per client address
+    # for /token and /sign-up and per user for likes.
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_TOKEN: tuple[int, float] = (10, 60)
+    RATE_LIMIT_SIGN_UP: tuple[int, float] = (5, 3600)
+    RATE_LIMIT_LIKES: tuple[int, float] = (60, 60)
+
+    # Accept likes into a Redis buffer and write them to Postgres in batches.
+    LIKES_WRITE_BEHIND: bool = False
+    LIKES_FLUSH_INTERVAL: float = 1.0
+    LIKES_FLUSH_BATCH_SIZE: int = 1000
+    # A drained batch older than this belongs to a worker that died and
+    # goes back to pending. Must be longer than any flush takes.
+    LIKES_FLUSH_LEASE: float = 300
+
     @validator('SQLALCHEMY_DATABASE_URI', pre=True)
     def assemble_db_connection(
         cls,
@@ -49,6 +143,10 @@ class Settings(BaseSettings):
             port=values.get('POSTGRES_PORT')
         )
 
+    @validator('DB_REPLICA_URIS', each_item=True)
+    def use_asyncpg_driver(cls, v: str) -> str:
+        return re.sub(r'^postgres(ql)?://', 'postgresql+asyncpg://', v)
+
     @validator('REDIS_URI', pre=True)
     def assemble_redis_connection(
         cls,
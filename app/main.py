@@ -1,25 +1,157 @@
-import uvicorn
+import inspect
+import logging
+import os
+import tempfile
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+
+import httpx
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi_cache import caches
 from fastapi_cache.backends.redis import CACHE_KEY, RedisCacheBackend
 
+from app.api.export import router as export_router
 from app.api.posts import router as posts_router
+from app.api.stats import router as stats_router
 from app.api.user import router as user_router
 from app.core.config import settings
+from app.services.database.session import (dispose_engines, get_engine,
+                                           warm_up_engines)
+from app.services.email_verification import (RedisEmailQueue,
+                                              start_email_verification,
+                                              stop_email_verification)
+from app.services.leaderboard import (RedisLeaderboard, start_leaderboard,
+                                      stop_leaderboard)
+from app.services.likes_buffer import (RedisLikeBuffer, start_like_flusher,
+                                       stop_like_flusher)
+from app.services.metrics import MetricsMiddleware, mark_process_dead
+from app.services.query_counter import QueryCounterMiddleware
+from app.services.rate_limit import (RedisRateLimiter, start_rate_limiter,
+                                     stop_rate_limiter)
+from app.services.security.password_security import \
+    shutdown_password_executor
+from app.utils.layered_cache import LayeredCacheBackend
+
+logger = logging.getLogger(__name__)
+
+
+async def start_cache() -> LayeredCacheBackend:
+    cache = LayeredCacheBackend(RedisCacheBackend(settings.REDIS_URI))
+    try:
+        await cache.ping()
+    except Exception:
+        # Requests still go to Redis, and fail there, until it is back.
+        logger.exception('Redis is unreachable at startup')
+    await cache.start(settings.REDIS_URI)
+    caches.set(CACHE_KEY, cache)
+    return cache
+
+
+async def stop_cache(cache: LayeredCacheBackend) -> None:
+    caches.remove(CACHE_KEY)
+    await cache.close()
+
 
-app = FastAPI()
-app.include_router(user_router)
-app.include_router(posts_router)
+async def run_cleanup(step, *args) -> None:
+    '''Run one shutdown step, a failure must not skip the next ones.'''
+    try:
+        result = step(*args)
+        if inspect.isawaitable(result):
+            await result
+    except Exception:
+        logger.exception('%s failed at shutdown', step.__qualname__)
 
 
-@app.on_event('startup')
-async def on_startup() -> None:
-    rc = RedisCacheBackend(settings.REDIS_URI)
-    caches.set(CACHE_KEY, rc)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    '''Connect everything before the first request, close it all after the last.
+
+    Every cleanup is registered once its service started, so they also
+    run, in reverse, when startup fails halfway.
+    '''
+    started = time.perf_counter()
+    async with AsyncExitStack() as stack:
+        def on_shutdown(step, *args) -> None:
+            stack.push_async_callback(run_cleanup, step, *args)
+
+        on_shutdown(mark_process_dead)
+        on_shutdown(shutdown_password_executor)
+        get_engine()
+        on_shutdown(dispose_engines)
+        try:
+            await warm_up_engines(settings.DB_POOL_WARMUP)
+        except Exception:
+            logger.exception('Could not warm up the database pool')
+        on_shutdown(stop_cache, await start_cache())
+        http_client = app.state.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=settings.EMAIL_VERIFICATION_CONCURRENCY),
+            timeout=settings.EMAIL_VERIFIER_TIMEOUT,
+        )
+        on_shutdown(http_client.aclose)
+        on_shutdown(stop_leaderboard)
+        await start_leaderboard(RedisLeaderboard(settings.REDIS_URI))
+        if settings.RATE_LIMIT_ENABLED:
+            on_shutdown(stop_rate_limiter)
+            await start_rate_limiter(RedisRateLimiter(settings.REDIS_URI))
+        if settings.LIKES_WRITE_BEHIND:
+            on_shutdown(stop_like_flusher)
+            await start_like_flusher(RedisLikeBuffer(settings.REDIS_URI))
+        on_shutdown(stop_email_verification)
+        await start_email_verification(
+            RedisEmailQueue(
+                settings.REDIS_URI,
+                pool_size=settings.EMAIL_VERIFICATION_CONCURRENCY + 2,
+            ),
+            run_worker=settings.EMAIL_VERIFICATION_WORKER,
+            client=http_client,
+        )
+        logger.info('Started in %.0f ms', (time.perf_counter() - started) * 1e3)
+        yield
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+    app.add_middleware(QueryCounterMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(user_router)
+    app.include_router(posts_router)
+    app.include_router(stats_router)
+    app.include_router(export_router)
+    return app
+
+
+app = create_app()
 
 
 def main():
-    uvicorn.run(app, host=settings.HOST, port=settings.PORT)
+    # Not imported with the app, which tests and tools load without serving.
+    import uvicorn
+
+    if settings.WORKERS > 1:
+        # Workers are new processes reading settings on their own, a
+        # generated secret would differ in each and reject the tokens of
+        # the others.
+        os.environ.setdefault('SECRET_KEY', settings.SECRET_KEY)
+        if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+            os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(
+                prefix='prometheus-'
+            )
+    # Workers import the app themselves, and its lifespan creates their
+    # engines and pools.
+    uvicorn.run(
+        'app.main:app',
+        host=settings.HOST,
+        port=settings.PORT,
+        workers=settings.WORKERS,
+        loop=settings.SERVER_LOOP,
+        http=settings.SERVER_HTTP,
+        timeout_keep_alive=settings.SERVER_KEEP_ALIVE,
+        backlog=settings.SERVER_BACKLOG,
+        timeout_graceful_shutdown=settings.SERVER_GRACEFUL_TIMEOUT,
+        limit_concurrency=settings.SERVER_LIMIT_CONCURRENCY,
+        access_log=settings.SERVER_ACCESS_LOG,
+    )
 
 
 if __name__ == '__main__':
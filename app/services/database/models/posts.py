@@ -1,20 +1,39 @@
 from enum import IntEnum
 
-from sqlalchemy import (Column, Enum, ForeignKey, Integer, String,
-                        UniqueConstraint)
-from sqlalchemy.orm import relationship
+from sqlalchemy import (Column, Computed, Enum, ForeignKey, Index, Integer,
+                        String, UniqueConstraint)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
 
 from app.services.database.models.base import Base
 
+# Text search configuration of Post.search_vector and of search queries.
+SEARCH_CONFIG = 'english'
+
 
 class Post(Base):
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
     text = Column(String, nullable=False)
-    owner_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    owner_id = Column(
+        Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    likes_count = Column(Integer, nullable=False, default=0, server_default='0')
+    dislikes_count = Column(Integer, nullable=False, default=0, server_default='0')
+    score = Column(Integer, nullable=False, default=0, server_default='0')
+    # Title matches rank above text matches. Deferred, it is only used
+    # inside queries.
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', title), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', text), 'B')",
+        persisted=True,
+    )))
     owner = relationship('User', back_populates='posts')
     likes = relationship('Like', back_populates='post')
 
+    __table_args__ = (
+        Index('ix_posts_search_vector', search_vector, postgresql_using='gin'),
+    )
+
 
 class Like(Base):
     class LikeValue(IntEnum):
@@ -24,7 +43,9 @@ class Like(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(
         Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
-    post_id = Column(Integer, ForeignKey('posts.id', ondelete='CASCADE'), nullable=False)
+    # user_id lookups use the unique_likes index, post_id needs its own.
+    post_id = Column(
+        Integer, ForeignKey('posts.id', ondelete='CASCADE'), nullable=False, index=True)
     value = Column(Enum(LikeValue))
     user = relationship('User', back_populates='likes')
     post = relationship('Post', back_populates='likes')
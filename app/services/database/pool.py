@@ -0,0 +1,68 @@
+import time
+from dataclasses import dataclass
+
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+@dataclass
+class PoolMetrics:
+    checkouts: int = 0
+    checkout_wait_seconds: float = 0
+    checkout_wait_max_seconds: float = 0
+    checkout_timeouts: int = 0
+    connects: int = 0
+    connect_seconds: float = 0
+
+    def observe(self, wait: float) -> None:
+        self.checkouts += 1
+        self.checkout_wait_seconds += wait
+        self.checkout_wait_max_seconds = max(self.checkout_wait_max_seconds, wait)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    '''Queue pool that records how long checkouts wait for a connection.
+
+    Opening a new connection happens within a checkout too, its time is
+    counted apart so that a cold pool does not look congested.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            self.metrics.checkout_timeouts += 1
+            raise
+        wait = time.perf_counter() - started
+        # Set on records this very checkout opened.
+        wait -= connection.__dict__.pop('_connect_seconds', 0)
+        self.metrics.observe(wait)
+        return connection
+
+    def _create_connection(self):
+        started = time.perf_counter()
+        record = super()._create_connection()
+        record._connect_seconds = time.perf_counter() - started
+        self.metrics.connects += 1
+        self.metrics.connect_seconds += record._connect_seconds
+        return record
+
+    def stats(self) -> dict:
+        return {
+            'size': self.size(),
+            'in_use': self.checkedout(),
+            'idle': self.checkedin(),
+            'overflow': max(self.overflow(), 0),
+            'max_overflow': self._max_overflow,
+            'checkouts': self.metrics.checkouts,
+            'checkout_wait_seconds': self.metrics.checkout_wait_seconds,
+            'checkout_wait_max_seconds': self.metrics.checkout_wait_max_seconds,
+            'checkout_timeouts': self.metrics.checkout_timeouts,
+            'connects': self.metrics.connects,
+            'connect_seconds': self.metrics.connect_seconds,
+        }
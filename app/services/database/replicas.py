@@ -0,0 +1,56 @@
+import itertools
+import logging
+import time
+
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the replica itself is unusable, not the query.
+CONNECTION_ERRORS = (OperationalError, InterfaceError, OSError)
+
+
+def is_connection_error(exc: Exception) -> bool:
+    if isinstance(exc, DBAPIError) and exc.connection_invalidated:
+        return True
+    return isinstance(exc, CONNECTION_ERRORS)
+
+
+class Replica:
+    def __init__(self, engine: AsyncEngine, retry_after: float):
+        self.engine = engine
+        self.session_maker = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False
+        )
+        self.retry_after = retry_after
+        self._unhealthy_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self._unhealthy_until
+
+    def mark_unhealthy(self) -> None:
+        logger.warning('Replica %s is unhealthy', self.engine.url)
+        self._unhealthy_until = time.monotonic() + self.retry_after
+
+
+class ReplicaSet:
+    '''Read replicas picked round-robin, skipping recently failed ones.'''
+
+    def __init__(self, engines: list[AsyncEngine], retry_after: float):
+        self.replicas = [Replica(engine, retry_after) for engine in engines]
+        self._counter = itertools.count()
+
+    def choose(self) -> Replica | None:
+        '''Next healthy replica, None means reads go to the primary.'''
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._counter) % len(self.replicas)]
+            if replica.healthy:
+                return replica
+        return None
+
+    async def dispose(self) -> None:
+        for replica in self.replicas:
+            await replica.engine.dispose()
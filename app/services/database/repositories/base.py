@@ -1,10 +1,12 @@
-from typing import ClassVar, Type, TypeVar
+from typing import AsyncIterator, ClassVar, Type, TypeVar
 
 from fastapi import Depends
 from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.services.database.session import get_session
+from app.core.config import settings
+from app.services.database.replicas import is_connection_error
+from app.services.database.session import get_replica_session, get_session
 
 Model = TypeVar('Model')
 
@@ -12,23 +14,71 @@ Model = TypeVar('Model')
 class BaseCrud:
     model: ClassVar[Type[Model]]
 
-    def __init__(self, db: AsyncSession = Depends(get_session)):
+    def __init__(
+        self,
+        db: AsyncSession = Depends(get_session),
+        replica_db: AsyncSession | None = Depends(get_replica_session),
+    ):
         self.session = db
+        # Outside of requests the default is the Depends marker itself.
+        if isinstance(replica_db, AsyncSession):
+            self.read_session = replica_db
+        else:
+            self.read_session = db
 
-    async def get_list(self) -> list[Model]:
-        stmt = select(self.model)
-        result = await self.session.scalars(stmt)
+    async def _read(self, method: str, stmt, primary: bool = False):
+        '''Run a read-only statement, on a replica unless `primary` is set.
+
+        Paths that must see their own writes pass `primary=True`. A replica
+        that fails to connect is skipped for a while and the statement is
+        repeated on the primary.
+        '''
+        if not primary and self.read_session is not self.session:
+            try:
+                return await getattr(self.read_session, method)(stmt)
+            except Exception as exc:
+                if not is_connection_error(exc):
+                    raise
+                self.read_session.info['replica'].mark_unhealthy()
+                self.read_session = self.session
+        return await getattr(self.session, method)(stmt)
+
+    async def get_list(
+        self,
+        after_id: int | None = None,
+        limit: int = settings.PAGE_SIZE,
+    ) -> list[Model]:
+        stmt = select(self.model).order_by(self.model.id).limit(limit)
+        if after_id is not None:
+            stmt = stmt.where(self.model.id > after_id)
+        result = await self._read('scalars', stmt)
         return result.all()
 
-    async def get_by_id(self, id: int) -> Model:
+    async def stream(
+        self,
+        fetch_size: int = settings.EXPORT_FETCH_SIZE,
+    ) -> AsyncIterator[list[Model]]:
+        '''Every row by id, in lists of up to `fetch_size`.
+
+        Rows come from a server-side cursor, so only one list is held
+        in memory at a time.
+        '''
+        stmt = (select(self.model)
+                .order_by(self.model.id)
+                .execution_options(yield_per=fetch_size))
+        result = await self._read('stream_scalars', stmt)
+        async for rows in result.partitions():
+            yield rows
+
+    async def get_by_id(self, id: int, primary: bool = False) -> Model:
         stmt = select(self.model).where(self.model.id == id)
-        result = await self.session.scalar(stmt)
+        result = await self._read('scalar', stmt, primary)
         return result
 
-    async def delete(self, id: int):
-        stmt = delete(self.model).where(self.model.id == id)
-        result = await self._session.execute(stmt)
+    async def delete(self, id: int) -> Model | None:
+        stmt = (delete(self.model)
+                .where(self.model.id == id)
+                .returning(self.model))
+        result = await self.session.execute(stmt)
         await self.session.commit()
-        if result.rowcount:
-            return True
-        return None
+        return result.scalar()
@@ -1,27 +1,61 @@
-from sqlalchemy import delete, func, select, update
-from sqlalchemy.orm import joinedload
+from collections import Counter
+from enum import Enum
 
+from sqlalchemy import (CTE, Boolean, Integer, Update, and_, any_, bindparam,
+                        case, cast, delete, func, literal_column, select,
+                        tuple_, update)
+from sqlalchemy.dialects.postgresql import ARRAY, REAL, insert
+from sqlalchemy.orm import defer, selectinload
+
+from app.core.config import settings
 from app.services.database.models import posts
 from app.services.database.repositories.base import BaseCrud
-from app.services.database.schemas.posts import (LikeInDB, PostBase, PostInDB,
-                                                 PostUpdate)
+from app.services.database.schemas.posts import (PostBase, PostInDB, PostScore,
+                                                 PostSearchResult, PostUpdate)
+
+
+class UpsertStatus(str, Enum):
+    INSERTED = 'inserted'
+    UPDATED = 'updated'
+    UNCHANGED = 'unchanged'
 
 
 class PostCrud(BaseCrud):
     model = posts.Post
 
     async def create(self, data: PostBase) -> PostInDB | None:
-        post = self.model(**data.dict())
-        self.session.add(post)
-        await self.session.commit()
-        await self.session.refresh(post)
+        [post] = await self.create_many([data])
         return post
 
+    async def create_many(self, data: list[PostBase]) -> list[PostInDB]:
+        '''Insert all posts with one multi-row INSERT ... RETURNING.
+
+        Postgres does not return the rows of a multi-row INSERT in any
+        particular order, SQLAlchemy sorts them back into `data` order.
+        '''
+        stmt = (insert(self.model)
+                .returning(self.model, sort_by_parameter_order=True)
+                .options(defer(self.model.search_vector)))
+        result = await self.session.scalars(stmt, [post.dict() for post in data])
+        created = result.all()
+        await self.session.commit()
+        return created
+
+    async def get_many(self, ids: list[int]) -> list[PostInDB]:
+        # One array parameter instead of one per id, so the statement
+        # is the same whatever the number of ids.
+        stmt = select(self.model).where(
+            self.model.id == any_(bindparam('ids', ids, type_=ARRAY(Integer)))
+        )
+        result = await self._read('scalars', stmt)
+        return result.all()
+
     async def update(self, post_id: int, new_data: PostUpdate) -> PostInDB:
         stmt = (update(self.model)
                 .where(self.model.id == post_id)
                 .values(**new_data.dict(exclude_none=True))
-                .returning(self.model))
+                .returning(self.model)
+                .options(defer(self.model.search_vector)))
         result = await self.session.execute(stmt)
         await self.session.commit()
         return result.scalar()
@@ -29,43 +63,210 @@ class PostCrud(BaseCrud):
     async def get_with_likes(self, post_id: int):
         stmt = (select(self.model)
                 .where(self.model.id == post_id)
-                .options(joinedload(self.model.likes))
+                # A separate query for likes, instead of a join that
+                # repeats the post row once per like.
+                .options(selectinload(self.model.likes))
                 )
-        result = await self.session.scalar(stmt)
+        result = await self._read('scalar', stmt)
         return result
 
+    async def search(
+        self,
+        query: str,
+        after: tuple[float, int] | None = None,
+        limit: int = settings.PAGE_SIZE,
+    ) -> list[PostSearchResult]:
+        '''Posts matching a web search style query, best matches first.
+
+        Matches are found through the GIN index on search_vector and
+        pages continue after the (rank, id) of the previous one.
+        '''
+        tsquery = func.websearch_to_tsquery(posts.SEARCH_CONFIG, query)
+        rank = func.ts_rank_cd(self.model.search_vector, tsquery)
+        stmt = (select(self.model, rank)
+                .where(self.model.search_vector.bool_op('@@')(tsquery))
+                .order_by(rank.desc(), self.model.id.desc())
+                .limit(limit))
+        if after is not None:
+            after_rank, after_id = after
+            # ts_rank_cd returns real, the cursor keeps its exact value.
+            stmt = stmt.where(
+                tuple_(rank, self.model.id) < tuple_(cast(after_rank, REAL), after_id)
+            )
+        result = await self._read('execute', stmt)
+        return [
+            PostSearchResult(**PostInDB.from_orm(post).dict(), rank=rank)
+            for post, rank in result
+        ]
+
+    async def get_last_id(self) -> int | None:
+        return await self._read('scalar', select(func.max(self.model.id)))
+
+    async def get_scores(self, after_id: int, until_id: int) -> list[tuple[int, int]]:
+        '''(id, score) of posts in (after_id, until_id] with a non-zero score.
+
+        Bounded by an id range rather than a row limit, so every call is a
+        short primary key range scan however few posts have votes.
+        '''
+        stmt = (select(self.model.id, self.model.score)
+                .where(self.model.id > after_id,
+                       self.model.id <= until_id,
+                       self.model.score != 0)
+                .order_by(self.model.id))
+        result = await self._read('execute', stmt)
+        return [tuple(row) for row in result]
+
+    async def get_score(self, post_id: int) -> PostScore | None:
+        stmt = (select(self.model.likes_count,
+                       self.model.dislikes_count,
+                       self.model.score)
+                .where(self.model.id == post_id))
+        result = await self._read('execute', stmt)
+        return result.one_or_none()
+
 
 class LikeCrud(BaseCrud):
     model = posts.Like
 
-    async def get_posts_likes(self, post_id: int):
-        stmt = select(self.model).where(post_id == post_id)
-        result = await self.session.scalars(stmt)
-        return result.all()
+    async def get_posts_likes(self, post_id: int) -> list[dict] | None:
+        '''Likes of the post as plain dicts, or None if there is no such post.
 
-    async def create(self, user_id: int, post_id: int, value: int) -> PostInDB:
-        like = self.model(user_id=user_id, post_id=post_id, value=value)
-        self.session.add(like)
-        await self.session.commit()
-        await self.session.refresh(like)
-        return like
+        Selects columns instead of entities, building ORM objects for
+        every like of a popular post costs more than the query.
+        '''
+        stmt = (select(posts.Post.id,
+                       self.model.user_id,
+                       self.model.post_id,
+                       self.model.value,
+                       self.model.id)
+                .outerjoin(self.model, self.model.post_id == posts.Post.id)
+                .where(posts.Post.id == post_id))
+        result = await self._read('execute', stmt)
+        rows = result.all()
+        if not rows:
+            return None
+        return [
+            {'user_id': user_id, 'post_id': like_post_id, 'value': value, 'id': id}
+            for _, user_id, like_post_id, value, id in rows if id is not None
+        ]
 
-    async def update(self, user_id: int, post_id: int, value: int) -> PostInDB:
-        stmt = (update(self.model)
-                .where(self.model.user_id == user_id, self.model.post_id == post_id)
-                .values(value=value)
-                .returning(self.model))
+    async def upsert(self, user_id: int, post_id: int, value: int) -> UpsertStatus:
+        '''Insert or change the vote and the post counters in one statement.
+
+        Relies on the unique_likes constraint instead of a read before
+        the write, so concurrent votes of the same user never race.
+        '''
+        stmt = self._upsert_stmt(
+            [{'user_id': user_id, 'post_id': post_id, 'value': value}]
+        )
         result = await self.session.execute(stmt)
+        changed = result.one_or_none()
         await self.session.commit()
-        return result.scalar()
+        if changed is None:
+            return UpsertStatus.UNCHANGED
+        return UpsertStatus.INSERTED if changed.votes else UpsertStatus.UPDATED
 
-    async def delete(self, user_id: int, post_id: int) -> bool | None:
-        stmt = delete(self.model).where(
+    async def delete(self, user_id: int, post_id: int) -> int | None:
+        '''Remove the vote, returns its value or None if there was none.'''
+        stmt = self._delete_stmt(
             self.model.user_id == user_id,
             self.model.post_id == post_id,
         )
         result = await self.session.execute(stmt)
+        removed = result.one_or_none()
+        await self.session.commit()
+        if removed is None:
+            return None
+        return -removed.score
+
+    async def apply_votes(self, votes: list[tuple[int, int, int]]) -> Counter[int]:
+        '''Write (user_id, post_id, value) votes in one transaction.
+
+        A value of 0 removes the vote. Every (user_id, post_id) pair may
+        appear only once per call. Votes on deleted posts are dropped.
+        Returns how much the score of every touched post changed.
+        '''
+        post = posts.Post
+        existing = set(await self.session.scalars(
+            select(post.id)
+            .where(post.id.in_({post_id for _, post_id, _ in votes}))
+        ))
+        votes = [vote for vote in votes if vote[1] in existing]
+        upserts = [
+            {'user_id': user_id, 'post_id': post_id, 'value': value}
+            for user_id, post_id, value in votes if value
+        ]
+        removals = [
+            (user_id, post_id) for user_id, post_id, value in votes if not value
+        ]
+        scores = Counter()
+        statements = []
+        if upserts:
+            statements.append(self._upsert_stmt(upserts))
+        if removals:
+            statements.append(self._delete_stmt(
+                tuple_(self.model.user_id, self.model.post_id).in_(removals)
+            ))
+        for stmt in statements:
+            for row in await self.session.execute(stmt):
+                scores[row.id] += row.score
         await self.session.commit()
-        if result.rowcount:
-            return True
-        return False
+        return scores
+
+    def _upsert_stmt(self, rows: list[dict]) -> Update:
+        stmt = insert(self.model).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            constraint='unique_likes',
+            set_={'value': stmt.excluded.value},
+            where=self.model.value.is_distinct_from(stmt.excluded.value),
+        )
+        changed = stmt.returning(
+            self.model.post_id,
+            self.model.value,
+            literal_column('xmax = 0', Boolean).label('inserted'),
+        ).cte('changed')
+        # Votes are either -1 or 1, so an update always flips the old value.
+        likes = (
+            case((changed.c.value == self.model.LikeValue.LIKE, 1), else_=0)
+            - case((and_(~changed.c.inserted,
+                         changed.c.value == self.model.LikeValue.DISLIKE), 1),
+                   else_=0)
+        )
+        dislikes = (
+            case((changed.c.value == self.model.LikeValue.DISLIKE, 1), else_=0)
+            - case((and_(~changed.c.inserted,
+                         changed.c.value == self.model.LikeValue.LIKE), 1),
+                   else_=0)
+        )
+        return self._update_counters(changed, likes, dislikes)
+
+    def _delete_stmt(self, *whereclause) -> Update:
+        removed = (delete(self.model)
+                   .where(*whereclause)
+                   .returning(self.model.post_id, self.model.value)
+                   .cte('removed'))
+        likes = -case((removed.c.value == self.model.LikeValue.LIKE, 1), else_=0)
+        dislikes = -case((removed.c.value == self.model.LikeValue.DISLIKE, 1), else_=0)
+        return self._update_counters(removed, likes, dislikes)
+
+    @staticmethod
+    def _update_counters(changed: CTE, likes, dislikes) -> Update:
+        '''Shift the denormalized counters of the posts touched by `changed`.
+
+        Returns the post id, the net change in the number of votes and
+        the change of the score for every updated post.
+        '''
+        deltas = (select(changed.c.post_id,
+                         func.sum(likes).label('likes'),
+                         func.sum(dislikes).label('dislikes'))
+                  .group_by(changed.c.post_id)
+                  .subquery('deltas'))
+        post = posts.Post.__table__
+        return (update(post)
+                .where(post.c.id == deltas.c.post_id)
+                .values(likes_count=post.c.likes_count + deltas.c.likes,
+                        dislikes_count=post.c.dislikes_count + deltas.c.dislikes,
+                        score=post.c.score + deltas.c.likes - deltas.c.dislikes)
+                .returning(post.c.id,
+                           (deltas.c.likes + deltas.c.dislikes).label('votes'),
+                           (deltas.c.likes - deltas.c.dislikes).label('score')))
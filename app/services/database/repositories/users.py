@@ -5,27 +5,28 @@ from sqlalchemy.exc import IntegrityError
 from app.services.database.models import user
 from app.services.database.repositories.base import BaseCrud
 from app.services.database.schemas.users import User, UserCreate
-from app.services.security.password_security import (get_password_hash,
-                                                     verify_password)
+from app.services.security.password_security import (
+    get_password_hash_async, verify_password_async)
+from app.services.user_cache import user_cache
 
 
 class UserCrud(BaseCrud):
     model = user.User
 
-    async def get_by_id(self, id: int):
+    async def get_by_id(self, id: int, primary: bool = False):
         stmt = (select(self.model).where(self.model.id == id))
-        result = await self.session.execute(stmt)
+        result = await self._read('execute', stmt, primary)
         return result.scalar_one_or_none()
 
-    async def get_by_username(self, username: str):
+    async def get_by_username(self, username: str, primary: bool = False):
         stmt = (select(self.model).where(self.model.username == username))
-        result = await self.session.execute(stmt)
+        result = await self._read('execute', stmt, primary)
         return result.scalar_one_or_none()
 
     async def create_user(self, user: UserCreate):
         new_user_data = user.dict()
         password = new_user_data.pop('password')
-        new_user_data['hashed_password'] = get_password_hash(password)
+        new_user_data['hashed_password'] = await get_password_hash_async(password)
         user = self.model(**new_user_data)
         self.session.add(user)
         try:
@@ -43,8 +44,9 @@ class UserCrud(BaseCrud):
         username: str,
         password: str,
     ) -> User:
-        user = await self.get_by_username(username)
-        if not user or not verify_password(password, user.hashed_password):
+        # Users log in right after signing up, replicas may lag behind.
+        user = await self.get_by_username(username, primary=True)
+        if not user or not await verify_password_async(password, user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='Incorrect username or password.'
@@ -56,6 +58,9 @@ class UserCrud(BaseCrud):
             update(self.model)
             .where(self.model.email == email)
             .values(is_active=True)
+            .returning(self.model.id)
         )
-        await self.session.execute(stmt)
+        result = await self.session.scalars(stmt)
         await self.session.commit()
+        for user_id in result.all():
+            await user_cache.invalidate(user_id)
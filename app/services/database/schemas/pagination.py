@@ -0,0 +1,10 @@
+from typing import Generic, Optional, TypeVar
+
+from pydantic.generics import GenericModel
+
+ItemT = TypeVar('ItemT')
+
+
+class Page(GenericModel, Generic[ItemT]):
+    items: list[ItemT]
+    next_cursor: Optional[str]
@@ -1,6 +1,8 @@
 from typing import Any, Optional
 
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, conlist, validator
+
+from app.core.config import settings
 
 
 class PostBase(BaseModel):
@@ -14,18 +16,44 @@ class PostCreate(BaseModel):
     text: str
 
 
+PostBatchCreate = conlist(
+    PostCreate, min_items=1, max_items=settings.POST_BATCH_MAX_SIZE
+)
+
+
 class PostUpdate(BaseModel):
     title: Optional[str]
     text: Optional[str]
 
 
+class PostScore(BaseModel):
+    likes_count: int
+    dislikes_count: int
+    score: int
+
+    class Config:
+        orm_mode = True
+
+
 class PostInDB(PostBase):
     id: int
+    likes_count: int
+    dislikes_count: int
+    score: int
 
     class Config:
         orm_mode = True
 
 
+class PostSearchResult(PostInDB):
+    rank: float
+
+
+class TopPost(PostInDB):
+    # Score gained within the requested window, `score` is the all time one.
+    window_score: int
+
+
 class LikeBase(BaseModel):
     user_id: int
     post_id: int
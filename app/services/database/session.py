@@ -1,16 +1,134 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+import asyncio
+import os
+from uuid import uuid4
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession,
+                                    create_async_engine)
 from sqlalchemy.orm import sessionmaker
 
 from app.core.config import settings
+from app.services.database.pool import InstrumentedPool
+from app.services.database.replicas import ReplicaSet
+from app.services.metrics import instrument_engine
+
+
+def create_engine(url: str = settings.SQLALCHEMY_DATABASE_URI) -> AsyncEngine:
+    if settings.DB_PGBOUNCER:
+        # PgBouncer in transaction mode may run every statement on another
+        # server connection, so nothing can stay prepared between them.
+        connect_args = {
+            'statement_cache_size': 0,
+            'prepared_statement_cache_size': 0,
+            'prepared_statement_name_func': lambda: f'__asyncpg_{uuid4()}__',
+        }
+    else:
+        connect_args = {
+            'statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE,
+            'prepared_statement_cache_size': settings.DB_STATEMENT_CACHE_SIZE,
+        }
+    connect_args['timeout'] = settings.DB_CONNECT_TIMEOUT
+    engine = create_async_engine(
+        url,
+        echo=settings.DB_ECHO,
+        poolclass=InstrumentedPool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+# Created by `get_engine`, in the process that serves requests, so
+# importing this module neither connects nor builds a pool that forked
+# workers would inherit.
+engine: AsyncEngine | None = None
+
+async_session = sessionmaker(class_=AsyncSession, expire_on_commit=False)
+
+replicas = ReplicaSet([], retry_after=settings.DB_REPLICA_RETRY_AFTER)
+
+
+def get_engine() -> AsyncEngine:
+    '''The primary engine, created with the replica ones on first use.'''
+    global engine, replicas
+    if engine is None:
+        engine = create_engine()
+        async_session.configure(bind=engine)
+        replicas = ReplicaSet(
+            [create_engine(url) for url in settings.DB_REPLICA_URIS],
+            retry_after=settings.DB_REPLICA_RETRY_AFTER,
+        )
+    return engine
+
 
-engine = create_async_engine(settings.SQLALCHEMY_DATABASE_URI, echo=True)
+def _forget_inherited_engines() -> None:
+    # A forked child must not touch the connections of its parent, it
+    # drops them unclosed and creates its own engines on first use.
+    global engine
+    if engine is not None:
+        engine.sync_engine.dispose(close=False)
+        engine = None
+    for replica in replicas.replicas:
+        replica.engine.sync_engine.dispose(close=False)
 
 
-async_session = sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False
-)
+os.register_at_fork(after_in_child=_forget_inherited_engines)
+
+
+async def warm_up_pool(engine: AsyncEngine, connections: int) -> None:
+    '''Open `connections` pool connections at once and give them back.
+
+    They are all held together, so the pool keeps that many distinct
+    connections instead of handing the same one out again.
+    '''
+    opened = await asyncio.gather(
+        *(engine.connect().start() for _ in range(connections)),
+        return_exceptions=True,
+    )
+    try:
+        for conn in opened:
+            if isinstance(conn, BaseException):
+                raise conn
+            await conn.execute(text('SELECT 1'))
+    finally:
+        for conn in opened:
+            if not isinstance(conn, BaseException):
+                await conn.close()
+
+
+async def warm_up_engines(connections: int) -> None:
+    connections = min(connections, settings.DB_POOL_SIZE)
+    if connections > 0:
+        await warm_up_pool(get_engine(), connections)
+        for replica in replicas.replicas:
+            await warm_up_pool(replica.engine, connections)
+
+
+async def dispose_engines() -> None:
+    '''Close every pooled connection, the next use creates new engines.'''
+    global engine
+    if engine is not None:
+        await engine.dispose()
+        engine = None
+    await replicas.dispose()
 
 
 async def get_session() -> AsyncSession:
+    get_engine()
     async with async_session() as session:
         yield session
+
+
+async def get_replica_session() -> AsyncSession | None:
+    replica = replicas.choose()
+    if replica is None:
+        yield None
+        return
+    async with replica.session_maker() as session:
+        session.info['replica'] = replica
+        yield session
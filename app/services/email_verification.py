@@ -0,0 +1,359 @@
+import asyncio
+import logging
+import time
+import uuid
+
+import aioredis
+import httpx
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.services.database.repositories.users import UserCrud
+from app.services.database.session import async_session
+from app.services.metrics import (EMAIL_CHECKS, EMAIL_CHECKS_IN_FLIGHT,
+                                  EMAIL_QUEUE_SIZE)
+from app.utils.check_email import check_email
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'email_verification'
+PROCESSING_KEY = 'email_verification:processing'
+DELAYED_KEY = 'email_verification:delayed'
+CONSUMERS_KEY = 'email_verification:consumers'
+HEARTBEAT_KEY = 'email_verification:heartbeat'
+
+
+def consumer_key(key: str, consumer: str) -> str:
+    '''PROCESSING_KEY or HEARTBEAT_KEY of one consumer.'''
+    return f'{key}:{consumer}'
+
+# Moves retries whose backoff is over to the queue.
+# KEYS: delayed set, queue. ARGV: now.
+PROMOTE_SCRIPT = '''
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, job in ipairs(due) do
+    redis.call('ZREM', KEYS[1], job)
+    redis.call('LPUSH', KEYS[2], job)
+end
+return #due
+'''
+
+# Puts jobs taken by a consumer that stopped beating back to the queue,
+# and forgets the consumer.
+# KEYS: consumers set, heartbeat, processing list, queue. ARGV: consumer.
+REQUEUE_SCRIPT = '''
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+local count = 0
+while redis.call('RPOPLPUSH', KEYS[3], KEYS[4]) do
+    count = count + 1
+end
+redis.call('SREM', KEYS[1], ARGV[1])
+return count
+'''
+
+
+class EmailJob(BaseModel):
+    email: str
+    attempt: int = 0
+
+
+class EmailQueue:
+    '''Pending email checks. In-memory, for tests and single-process runs.
+
+    `get` hands out a receipt that must be passed to `ack` once the job
+    is handled. Jobs that were never acked are lost here, but survive a
+    restart in the Redis implementation. Consumers call `heartbeat`
+    regularly while they take jobs and `release` once they stopped.
+    '''
+
+    def __init__(self):
+        self._queue: asyncio.Queue[EmailJob] = asyncio.Queue()
+
+    async def put(self, job: EmailJob, delay: float = 0) -> None:
+        if delay:
+            asyncio.get_running_loop().call_later(
+                delay, self._queue.put_nowait, job
+            )
+        else:
+            self._queue.put_nowait(job)
+
+    async def get(self, timeout: float) -> tuple[EmailJob, object] | None:
+        try:
+            job = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return job, job
+
+    async def ack(self, receipt) -> None:
+        return None
+
+    async def promote_due(self) -> None:
+        return None
+
+    async def heartbeat(self) -> None:
+        return None
+
+    async def requeue_unacked(self) -> None:
+        return None
+
+    async def release(self) -> None:
+        return None
+
+    async def size(self) -> int:
+        return self._queue.qsize()
+
+    async def close(self) -> None:
+        return None
+
+
+class RedisEmailQueue(EmailQueue):
+    '''Reliable queue on a Redis list.
+
+    Taken jobs are atomically moved to a processing list of this consumer
+    and stay there until acked. A consumer whose heartbeat expired is dead
+    and its jobs go back to the queue. Retries wait in a sorted set scored
+    by their due time.
+    '''
+
+    heartbeat_ttl = 30
+
+    def __init__(self, address: str, pool_size: int):
+        self._address = address
+        self._pool_size = pool_size
+        self._pool: aioredis.Redis | None = None
+        self.consumer = uuid.uuid4().hex
+        self._processing_key = consumer_key(PROCESSING_KEY, self.consumer)
+
+    async def _client(self) -> aioredis.Redis:
+        if self._pool is None:
+            # Every consumer blocks one connection while waiting for jobs.
+            self._pool = await aioredis.create_redis_pool(
+                self._address, maxsize=self._pool_size
+            )
+        return self._pool
+
+    async def put(self, job: EmailJob, delay: float = 0) -> None:
+        client = await self._client()
+        if delay:
+            await client.zadd(DELAYED_KEY, time.time() + delay, job.json())
+        else:
+            await client.lpush(QUEUE_KEY, job.json())
+
+    async def get(self, timeout: float) -> tuple[EmailJob, object] | None:
+        client = await self._client()
+        raw = await client.brpoplpush(
+            QUEUE_KEY, self._processing_key, timeout=max(1, int(timeout))
+        )
+        if raw is None:
+            return None
+        return EmailJob.parse_raw(raw), raw
+
+    async def ack(self, receipt) -> None:
+        client = await self._client()
+        await client.lrem(self._processing_key, 1, receipt)
+
+    async def promote_due(self) -> None:
+        client = await self._client()
+        await client.eval(
+            PROMOTE_SCRIPT, keys=[DELAYED_KEY, QUEUE_KEY], args=[time.time()]
+        )
+
+    async def heartbeat(self) -> None:
+        client = await self._client()
+        # Not in MULTI, aioredis swallows cancelling a transaction, which
+        # would keep the promote task of a stopped worker running. The
+        # heartbeat comes first, so a registered consumer is never dead.
+        await client.set(
+            consumer_key(HEARTBEAT_KEY, self.consumer), 1,
+            expire=self.heartbeat_ttl,
+        )
+        await client.sadd(CONSUMERS_KEY, self.consumer)
+
+    async def requeue_unacked(self) -> None:
+        '''Put back the jobs of consumers that stopped beating.'''
+        client = await self._client()
+        consumers = await client.smembers(CONSUMERS_KEY, encoding='utf-8')
+        for consumer in consumers:
+            await self._requeue(consumer)
+
+    async def release(self) -> None:
+        '''Put back the jobs this consumer never acked.'''
+        client = await self._client()
+        await client.delete(consumer_key(HEARTBEAT_KEY, self.consumer))
+        await self._requeue(self.consumer)
+
+    async def _requeue(self, consumer: str) -> None:
+        client = await self._client()
+        requeued = await client.eval(
+            REQUEUE_SCRIPT,
+            keys=[
+                CONSUMERS_KEY,
+                consumer_key(HEARTBEAT_KEY, consumer),
+                consumer_key(PROCESSING_KEY, consumer),
+                QUEUE_KEY,
+            ],
+            args=[consumer],
+        )
+        if requeued:
+            logger.warning('Requeued %s unfinished email checks', requeued)
+
+    async def size(self) -> int:
+        client = await self._client()
+        return await client.llen(QUEUE_KEY)
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+
+class EmailVerificationWorker:
+    '''Consumes the email queue with a bounded number of concurrent checks.
+
+    Checks without a definite answer are retried with exponential backoff
+    up to `max_attempts` times. Every check runs in its own DB session
+    and all of them share one pooled HTTP client.
+    '''
+
+    poll_timeout = 1
+
+    def __init__(
+        self,
+        queue: EmailQueue,
+        concurrency: int = settings.EMAIL_VERIFICATION_CONCURRENCY,
+        max_attempts: int = settings.EMAIL_VERIFICATION_MAX_ATTEMPTS,
+        backoff: float = settings.EMAIL_VERIFICATION_BACKOFF,
+        max_backoff: float = settings.EMAIL_VERIFICATION_MAX_BACKOFF,
+        session_maker=async_session,
+        client: httpx.AsyncClient | None = None,
+    ):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._session_maker = session_maker
+        self._client = client
+        self._owns_client = client is None
+        self._tasks: list[asyncio.Task] = []
+        self._busy: set[asyncio.Task] = set()
+        self._stopping = False
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._busy)
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.concurrency),
+                timeout=settings.EMAIL_VERIFIER_TIMEOUT,
+            )
+        await self.queue.heartbeat()
+        await self.queue.requeue_unacked()
+        self._stopping = False
+        self._tasks = [
+            asyncio.create_task(self._consume())
+            for _ in range(self.concurrency)
+        ]
+        self._tasks.append(asyncio.create_task(self._promote()))
+
+    async def stop(self) -> None:
+        '''Let running checks finish, unstarted jobs stay queued.'''
+        self._stopping = True
+        for task in self._tasks:
+            if task not in self._busy:
+                task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.queue.release()
+        if self._owns_client:
+            await self._client.aclose()
+            self._client = None
+
+    def retry_delay(self, attempt: int) -> float:
+        return min(self.backoff * 2 ** attempt, self.max_backoff)
+
+    async def handle(self, job: EmailJob) -> None:
+        try:
+            async with self._session_maker() as session:
+                done = await check_email(job.email, UserCrud(session), self._client)
+        except httpx.HTTPError as exc:
+            logger.info('Email check for %s failed: %r', job.email, exc)
+            done = False
+        except Exception:
+            logger.exception('Email check for %s crashed', job.email)
+            done = False
+        if done:
+            EMAIL_CHECKS.labels('done').inc()
+            return
+        if job.attempt + 1 >= self.max_attempts:
+            EMAIL_CHECKS.labels('given_up').inc()
+            logger.warning('Giving up email check for %s', job.email)
+            return
+        EMAIL_CHECKS.labels('retried').inc()
+        await self.queue.put(
+            EmailJob(email=job.email, attempt=job.attempt + 1),
+            delay=self.retry_delay(job.attempt),
+        )
+
+    async def _consume(self) -> None:
+        task = asyncio.current_task()
+        while not self._stopping:
+            item = await self.queue.get(self.poll_timeout)
+            if item is None:
+                continue
+            job, receipt = item
+            self._busy.add(task)
+            EMAIL_CHECKS_IN_FLIGHT.inc()
+            try:
+                await self.handle(job)
+                await self.queue.ack(receipt)
+            except Exception:
+                logger.exception('Failed to finish email check for %s', job.email)
+            finally:
+                self._busy.discard(task)
+                EMAIL_CHECKS_IN_FLIGHT.dec()
+
+    async def _promote(self) -> None:
+        while True:
+            try:
+                await self.queue.heartbeat()
+                await self.queue.requeue_unacked()
+                await self.queue.promote_due()
+                EMAIL_QUEUE_SIZE.set(await self.queue.size())
+            except Exception:
+                logger.exception('Failed to promote delayed email checks')
+            await asyncio.sleep(self.poll_timeout)
+
+
+email_queue: EmailQueue | None = None
+email_worker: EmailVerificationWorker | None = None
+
+
+def get_email_queue() -> EmailQueue | None:
+    return email_queue
+
+
+async def start_email_verification(
+    queue: EmailQueue,
+    run_worker: bool,
+    client: httpx.AsyncClient | None = None,
+) -> None:
+    global email_queue, email_worker
+    email_queue = queue
+    if run_worker:
+        email_worker = EmailVerificationWorker(queue, client=client)
+        await email_worker.start()
+
+
+async def stop_email_verification() -> None:
+    global email_queue, email_worker
+    if email_worker is not None:
+        await email_worker.stop()
+        email_worker = None
+    if email_queue is not None:
+        await email_queue.close()
+        email_queue = None
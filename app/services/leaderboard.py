@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import Counter
+from typing import AsyncIterator, Literal
+
+import aioredis
+
+from app.core.config import settings
+from app.services.database.repositories.posts import PostCrud
+from app.services.database.session import async_session
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_KEY = 'leaderboard'
+BUCKET_KEY = 'leaderboard:hour:{hour}'
+WINDOW_KEY = 'leaderboard:{window}:{hour}'
+REBUILD_KEY = 'leaderboard:rebuild:{run}'
+# A rebuild left behind by a worker that died goes away on its own.
+REBUILD_TTL = 3600
+RECONCILED_KEY = 'leaderboard:reconciled'
+
+Window = Literal['hour', 'day', 'week']
+# Hours summed up by every window.
+WINDOWS: dict[str, int] = {'hour': 1, 'day': 24, 'week': 168}
+BUCKET_TTL = (WINDOWS['week'] + 1) * 3600
+
+# Drops a post from every set it may be in.
+# KEYS: all time set, hour buckets and window unions. ARGV: post id.
+REMOVE_SCRIPT = '''
+for _, key in ipairs(KEYS) do
+    redis.call('ZREM', key, ARGV[1])
+end
+'''
+
+
+class Leaderboard:
+    '''Post scores kept outside of Postgres, for GET /posts/top.
+
+    Every vote adds its score delta to the all time ranking and to the
+    bucket of the current hour, windows sum up the latest buckets. Likes
+    have no timestamps, so only the all time ranking can be rebuilt from
+    Postgres. This in-memory implementation is used by tests and
+    single-process runs.
+    '''
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._scores: Counter[int] = Counter()
+        self._buckets: dict[int, Counter[int]] = {}
+        self._claimed_until = 0.0
+
+    def _hour(self) -> int:
+        return int(self.clock() // 3600)
+
+    async def incr(self, post_id: int, delta: int) -> None:
+        if not delta:
+            return
+        self._scores[post_id] += delta
+        self._buckets.setdefault(self._hour(), Counter())[post_id] += delta
+
+    async def remove(self, post_id: int) -> None:
+        self._scores.pop(post_id, None)
+        for bucket in self._buckets.values():
+            bucket.pop(post_id, None)
+
+    async def top(self, window: Window | None, limit: int) -> list[tuple[int, int]]:
+        if window is None:
+            scores = self._scores
+        else:
+            hour = self._hour()
+            scores = Counter()
+            for bucket_hour in range(hour - WINDOWS[window] + 1, hour + 1):
+                scores.update(self._buckets.get(bucket_hour, {}))
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return ranked[:limit]
+
+    async def claim_reconcile(self, ttl: int) -> bool:
+        '''Whether this caller runs the reconciliation of the next `ttl` seconds.'''
+        now = self.clock()
+        if now < self._claimed_until:
+            return False
+        self._claimed_until = now + ttl
+        return True
+
+    async def rebuild(self, batches: AsyncIterator[list[tuple[int, int]]]) -> None:
+        scores = Counter()
+        async for batch in batches:
+            scores.update(dict(batch))
+        self._scores = scores
+
+    async def close(self) -> None:
+        return None
+
+
+class RedisLeaderboard(Leaderboard):
+    '''Sorted sets shared by every uvicorn worker.
+
+    Hour buckets expire once no window needs them anymore. Window sums
+    are cached for `window_ttl` seconds.
+    '''
+
+    def __init__(
+        self,
+        address: str,
+        window_ttl: int = settings.LEADERBOARD_WINDOW_CACHE_TTL,
+        clock=time.time,
+    ):
+        self.clock = clock
+        self.window_ttl = window_ttl
+        self._address = address
+        self._pool: aioredis.Redis | None = None
+
+    async def _client(self) -> aioredis.Redis:
+        if self._pool is None:
+            self._pool = await aioredis.create_redis_pool(self._address)
+        return self._pool
+
+    async def incr(self, post_id: int, delta: int) -> None:
+        if not delta:
+            return
+        client = await self._client()
+        bucket = BUCKET_KEY.format(hour=self._hour())
+        transaction = client.multi_exec()
+        transaction.zincrby(LEADERBOARD_KEY, delta, post_id)
+        transaction.zincrby(bucket, delta, post_id)
+        transaction.expire(bucket, BUCKET_TTL)
+        await transaction.execute()
+
+    async def remove(self, post_id: int) -> None:
+        client = await self._client()
+        hour = self._hour()
+        keys = [LEADERBOARD_KEY]
+        keys.extend(
+            BUCKET_KEY.format(hour=bucket_hour)
+            for bucket_hour in range(hour - WINDOWS['week'], hour + 1)
+        )
+        keys.extend(WINDOW_KEY.format(window=window, hour=hour) for window in WINDOWS)
+        await client.eval(REMOVE_SCRIPT, keys=keys, args=[post_id])
+
+    async def top(self, window: Window | None, limit: int) -> list[tuple[int, int]]:
+        client = await self._client()
+        key = LEADERBOARD_KEY
+        if window is not None:
+            hour = self._hour()
+            key = WINDOW_KEY.format(window=window, hour=hour)
+            if not await client.exists(key):
+                buckets = [
+                    BUCKET_KEY.format(hour=bucket_hour)
+                    for bucket_hour in range(hour - WINDOWS[window] + 1, hour + 1)
+                ]
+                transaction = client.multi_exec()
+                transaction.zunionstore(key, *buckets)
+                transaction.expire(key, self.window_ttl)
+                await transaction.execute()
+        ranked = await client.zrevrange(key, 0, limit - 1, withscores=True)
+        return [(int(post_id), int(score)) for post_id, score in ranked]
+
+    async def claim_reconcile(self, ttl: int) -> bool:
+        client = await self._client()
+        return await client.set(
+            RECONCILED_KEY, '1', expire=ttl, exist=client.SET_IF_NOT_EXIST
+        )
+
+    async def rebuild(self, batches: AsyncIterator[list[tuple[int, int]]]) -> None:
+        '''Replace the all time ranking at once, when it is fully built.
+
+        Every run builds its own set, so concurrent runs cannot mix.
+        '''
+        client = await self._client()
+        key = REBUILD_KEY.format(run=uuid.uuid4().hex)
+        try:
+            async for batch in batches:
+                pairs = [item for post_id, score in batch for item in (score, post_id)]
+                if pairs:
+                    transaction = client.multi_exec()
+                    transaction.zadd(key, *pairs)
+                    transaction.expire(key, REBUILD_TTL)
+                    await transaction.execute()
+            if await client.exists(key):
+                transaction = client.multi_exec()
+                transaction.rename(key, LEADERBOARD_KEY)
+                # RENAME carries the TTL of the rebuild over.
+                transaction.persist(LEADERBOARD_KEY)
+                await transaction.execute()
+            else:
+                await client.delete(LEADERBOARD_KEY)
+        finally:
+            await client.delete(key)
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+
+async def post_scores(
+    session_maker=async_session,
+    batch_size: int = settings.LEADERBOARD_RECONCILE_BATCH_SIZE,
+) -> AsyncIterator[list[tuple[int, int]]]:
+    '''Scores of every post with votes, in batches of `batch_size` ids.'''
+    async with session_maker() as session:
+        last_id = await PostCrud(session).get_last_id()
+    after_id = 0
+    while last_id is not None and after_id < last_id:
+        async with session_maker() as session:
+            batch = await PostCrud(session).get_scores(after_id, after_id + batch_size)
+        if batch:
+            yield batch
+        after_id += batch_size
+
+
+async def reconcile_leaderboard(leaderboard: Leaderboard, session_maker=async_session) -> None:
+    await leaderboard.rebuild(post_scores(session_maker))
+
+
+class LeaderboardReconciler:
+    '''Rebuilds the all time ranking from Postgres every `interval` seconds.
+
+    Votes lost by a failed ZINCRBY, or counted twice by a retry, are only
+    wrong until the next run. The first worker to claim an interval runs
+    it, the others skip it.
+    '''
+
+    def __init__(
+        self,
+        leaderboard: Leaderboard,
+        interval: float = settings.LEADERBOARD_RECONCILE_INTERVAL,
+        session_maker=async_session,
+    ):
+        self.leaderboard = leaderboard
+        self.interval = interval
+        self._session_maker = session_maker
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self.leaderboard.claim_reconcile(int(self.interval)):
+                    await reconcile_leaderboard(self.leaderboard, self._session_maker)
+            except Exception:
+                logger.exception('Failed to reconcile the leaderboard')
+            await asyncio.sleep(self.interval)
+
+
+leaderboard: Leaderboard | None = None
+reconciler: LeaderboardReconciler | None = None
+
+
+def get_leaderboard() -> Leaderboard | None:
+    return leaderboard
+
+
+async def start_leaderboard(board: Leaderboard) -> None:
+    global leaderboard, reconciler
+    leaderboard = board
+    reconciler = LeaderboardReconciler(board)
+    reconciler.start()
+
+
+async def stop_leaderboard() -> None:
+    global leaderboard, reconciler
+    if reconciler is not None:
+        await reconciler.stop()
+        reconciler = None
+    if leaderboard is not None:
+        await leaderboard.close()
+        leaderboard = None
@@ -0,0 +1,404 @@
+import asyncio
+import logging
+import time
+
+import aioredis
+
+from app.core.config import settings
+from app.services.database.repositories.posts import LikeCrud
+from app.services.database.session import async_session
+from app.services.leaderboard import get_leaderboard
+from app.utils.cache import (LIKE_CACHE_KEY, TaggedCache, post_tag,
+                             redis_cache)
+
+logger = logging.getLogger(__name__)
+
+# Every key shares the {likes} hash tag, so that on Redis Cluster the
+# scripts, which touch several of them, run within a single slot.
+PENDING_KEY = '{likes}:pending'
+# Sorted set of the posts being flushed, scored by when they were drained.
+FLUSHING_KEY = '{likes}:flushing'
+
+
+def votes_key(key: str, post_id) -> str:
+    '''Hash of user id to vote, for one post in PENDING_KEY or FLUSHING_KEY.'''
+    return f'{key}:{post_id}'
+
+
+# KEYS: pending post ids set, pending votes of the post.
+# ARGV: post id, user id, value.
+ADD_SCRIPT = '''
+redis.call('HSET', KEYS[2], ARGV[2], ARGV[3])
+redis.call('SADD', KEYS[1], ARGV[1])
+'''
+
+# Moves whole posts from pending to flushing until `limit` votes are taken.
+# Posts that are still being flushed by someone else stay pending, so two
+# flushers never write votes of the same post out of order.
+# KEYS: pending set, flushing set, then the pending and flushing votes of
+# every candidate post. ARGV: limit, now, then the candidate post ids.
+DRAIN_SCRIPT = '''
+local votes = {}
+local taken = 0
+for i = 3, #ARGV do
+    if taken >= tonumber(ARGV[1]) then
+        break
+    end
+    local post_id = ARGV[i]
+    if not redis.call('ZSCORE', KEYS[2], post_id)
+            and redis.call('SREM', KEYS[1], post_id) == 1 then
+        local fields = redis.call('HGETALL', KEYS[2 * i - 3])
+        if #fields > 0 then
+            redis.call('RENAME', KEYS[2 * i - 3], KEYS[2 * i - 2])
+            redis.call('ZADD', KEYS[2], ARGV[2], post_id)
+            for j = 1, #fields, 2 do
+                table.insert(votes, post_id)
+                table.insert(votes, fields[j])
+                table.insert(votes, fields[j + 1])
+            end
+            taken = taken + #fields / 2
+        end
+    end
+end
+return votes
+'''
+
+# Puts votes of an interrupted flush back to pending without overwriting
+# votes that were made after it. With a cutoff, only posts drained before
+# it, so a batch that was acked and drained again meanwhile stays.
+# KEYS: pending set, flushing set, then the flushing and pending votes of
+# every post. ARGV: cutoff or an empty string, then post ids.
+REQUEUE_SCRIPT = '''
+local cutoff = tonumber(ARGV[1])
+local requeued = 0
+for i = 2, #ARGV do
+    local post_id = ARGV[i]
+    local drained = redis.call('ZSCORE', KEYS[2], post_id)
+    if drained and (not cutoff or tonumber(drained) <= cutoff) then
+        local flushing = KEYS[2 * i - 1]
+        local fields = redis.call('HGETALL', flushing)
+        for j = 1, #fields, 2 do
+            redis.call('HSETNX', KEYS[2 * i], fields[j], fields[j + 1])
+        end
+        if #fields > 0 then
+            redis.call('SADD', KEYS[1], post_id)
+        end
+        redis.call('DEL', flushing)
+        redis.call('ZREM', KEYS[2], post_id)
+        requeued = requeued + 1
+    end
+end
+return requeued
+'''
+
+
+class LikeBuffer:
+    '''Votes accepted by the API but not written to Postgres yet.
+
+    Every vote is the latest state of a (post_id, user_id) pair, where
+    0 means the like was removed, so replaying a vote is idempotent.
+    This in-memory implementation is used by tests and single-process runs.
+    '''
+
+    def __init__(self):
+        self._pending: dict[int, dict[int, int]] = {}
+        self._flushing: dict[int, dict[int, int]] = {}
+
+    async def add(self, post_id: int, user_id: int, value: int) -> None:
+        self._pending.setdefault(post_id, {})[user_id] = value
+
+    async def get_pending(self, post_id: int) -> dict[int, int]:
+        votes = dict(self._flushing.get(post_id, {}))
+        votes.update(self._pending.get(post_id, {}))
+        return votes
+
+    async def drain(self, limit: int) -> list[tuple[int, int, int]]:
+        votes = []
+        for post_id in list(self._pending):
+            if len(votes) >= limit:
+                break
+            if post_id in self._flushing:
+                continue
+            post_votes = self._pending.pop(post_id)
+            self._flushing[post_id] = post_votes
+            votes.extend(
+                (post_id, user_id, value) for user_id, value in post_votes.items()
+            )
+        return votes
+
+    async def pending_posts(self) -> int:
+        return len(self._pending)
+
+    async def ack(self, post_ids: set[int]) -> None:
+        for post_id in post_ids:
+            self._flushing.pop(post_id, None)
+
+    async def requeue(self, post_ids: set[int]) -> None:
+        for post_id in post_ids:
+            votes = self._flushing.pop(post_id, {})
+            pending = self._pending.setdefault(post_id, {})
+            for user_id, value in votes.items():
+                pending.setdefault(user_id, value)
+
+    async def recover(self, lease: float) -> None:
+        '''Requeue posts drained more than `lease` seconds ago by any worker.
+
+        Nothing to do in memory, the posts die with their flusher.
+        '''
+        return None
+
+    async def close(self) -> None:
+        return None
+
+
+class RedisLikeBuffer(LikeBuffer):
+    '''Shared buffer, so every uvicorn worker sees the same pending votes.'''
+
+    def __init__(self, address: str):
+        self._address = address
+        self._pool: aioredis.Redis | None = None
+
+    async def _client(self) -> aioredis.Redis:
+        if self._pool is None:
+            self._pool = await aioredis.create_redis_pool(self._address)
+        return self._pool
+
+    async def add(self, post_id: int, user_id: int, value: int) -> None:
+        client = await self._client()
+        await client.eval(
+            ADD_SCRIPT,
+            keys=[PENDING_KEY, votes_key(PENDING_KEY, post_id)],
+            args=[post_id, user_id, value],
+        )
+
+    async def get_pending(self, post_id: int) -> dict[int, int]:
+        client = await self._client()
+        flushing, pending = await asyncio.gather(
+            client.hgetall(votes_key(FLUSHING_KEY, post_id)),
+            client.hgetall(votes_key(PENDING_KEY, post_id)),
+        )
+        votes = {int(user_id): int(value) for user_id, value in flushing.items()}
+        votes.update(
+            {int(user_id): int(value) for user_id, value in pending.items()}
+        )
+        return votes
+
+    async def drain(self, limit: int) -> list[tuple[int, int, int]]:
+        client = await self._client()
+        votes = []
+        cursor = 0
+        # Every post has a vote at least, so `limit` posts per page. The
+        # script skips posts still being flushed, the scan goes on past them.
+        while True:
+            cursor, post_ids = await client.sscan(PENDING_KEY, cursor, count=limit)
+            if post_ids:
+                post_ids = [post_id.decode() for post_id in post_ids]
+                keys = [PENDING_KEY, FLUSHING_KEY]
+                for post_id in post_ids:
+                    keys += [
+                        votes_key(PENDING_KEY, post_id),
+                        votes_key(FLUSHING_KEY, post_id),
+                    ]
+                result = await client.eval(
+                    DRAIN_SCRIPT,
+                    keys=keys,
+                    args=[limit - len(votes), time.time(), *post_ids],
+                )
+                votes += [
+                    (int(result[i]), int(result[i + 1]), int(result[i + 2]))
+                    for i in range(0, len(result), 3)
+                ]
+            if cursor == 0 or len(votes) >= limit:
+                return votes
+
+    async def pending_posts(self) -> int:
+        client = await self._client()
+        return await client.scard(PENDING_KEY)
+
+    async def ack(self, post_ids: set[int]) -> None:
+        if not post_ids:
+            return
+        client = await self._client()
+        transaction = client.multi_exec()
+        transaction.delete(
+            *(votes_key(FLUSHING_KEY, post_id) for post_id in post_ids)
+        )
+        transaction.zrem(FLUSHING_KEY, *post_ids)
+        await transaction.execute()
+
+    async def requeue(self, post_ids: set[int]) -> None:
+        await self._requeue(post_ids, '')
+
+    async def recover(self, lease: float) -> None:
+        client = await self._client()
+        cutoff = time.time() - lease
+        post_ids = await client.zrangebyscore(
+            FLUSHING_KEY, max=cutoff, encoding='utf-8'
+        )
+        requeued = await self._requeue(post_ids, cutoff)
+        if requeued:
+            logger.warning('Requeued buffered likes of %s posts', requeued)
+
+    async def _requeue(self, post_ids, cutoff: float | str) -> int:
+        if not post_ids:
+            return 0
+        client = await self._client()
+        keys = [PENDING_KEY, FLUSHING_KEY]
+        for post_id in post_ids:
+            keys += [votes_key(FLUSHING_KEY, post_id), votes_key(PENDING_KEY, post_id)]
+        return await client.eval(
+            REQUEUE_SCRIPT, keys=keys, args=[cutoff, *post_ids]
+        )
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+
+class LikeFlusher:
+    '''Background task that drains a LikeBuffer into the likes table.
+
+    Flushes every `interval` seconds, or sooner once `batch_size` votes
+    were buffered by this process, and requeues batches of dead workers
+    once their `lease` is over. `stop` lets a running flush finish,
+    then flushes whatever is left, waiting up to `drain_timeout` seconds
+    for posts that other workers are flushing.
+    '''
+
+    drain_timeout = 10
+
+    def __init__(
+        self,
+        buffer: LikeBuffer,
+        interval: float = settings.LIKES_FLUSH_INTERVAL,
+        batch_size: int = settings.LIKES_FLUSH_BATCH_SIZE,
+        lease: float = settings.LIKES_FLUSH_LEASE,
+        session_maker=async_session,
+        cache=None,
+        leaderboard=None,
+    ):
+        self.buffer = buffer
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lease = lease
+        self._session_maker = session_maker
+        self._cache = cache
+        self._leaderboard = leaderboard
+        self._added = 0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+    async def add(self, post_id: int, user_id: int, value: int) -> None:
+        await self.buffer.add(post_id, user_id, value)
+        self._added += 1
+        if self._added >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            # Not cancelled, a drained batch must reach the database or
+            # go back to pending.
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        deadline = asyncio.get_running_loop().time() + self.drain_timeout
+        while pending := await self.buffer.pending_posts():
+            if await self.flush():
+                continue
+            if asyncio.get_running_loop().time() >= deadline:
+                logger.warning('Left buffered likes of %s posts to other workers', pending)
+                return
+            await asyncio.sleep(0.1)
+
+    async def flush(self) -> int:
+        '''Write one batch of pending votes, returns the number written.'''
+        self._added = 0
+        self._wakeup.clear()
+        votes = await self.buffer.drain(self.batch_size)
+        if not votes:
+            return 0
+        post_ids = {post_id for post_id, _, _ in votes}
+        try:
+            async with self._session_maker() as session:
+                scores = await LikeCrud(session).apply_votes(
+                    [(user_id, post_id, value) for post_id, user_id, value in votes]
+                )
+        except BaseException:
+            # Cancellation too, or the posts would stay flushing for good.
+            await self.buffer.requeue(post_ids)
+            raise
+        await self.buffer.ack(post_ids)
+        cache = self._cache or redis_cache()
+        for post_id in post_ids:
+            await cache.delete(LIKE_CACHE_KEY.format(post_id=post_id))
+        await TaggedCache(cache).invalidate(*map(post_tag, post_ids))
+        leaderboard = self._leaderboard or get_leaderboard()
+        if leaderboard is not None:
+            for post_id, delta in scores.items():
+                await leaderboard.incr(post_id, delta)
+        return len(votes)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                return
+            try:
+                await self.buffer.recover(self.lease)
+                while (await self.flush() >= self.batch_size
+                       and not self._stopping):
+                    pass
+            except Exception:
+                logger.exception('Failed to flush buffered likes')
+
+
+def merge_pending_likes(
+    post_id: int,
+    likes: list[dict],
+    pending: dict[int, int],
+) -> list[dict]:
+    '''Overlay buffered votes on stored likes, so users see their own votes.'''
+    if not pending:
+        return likes
+    merged = [like for like in likes if like['user_id'] not in pending]
+    merged.extend(
+        {'user_id': user_id, 'post_id': post_id, 'value': value, 'id': None}
+        for user_id, value in pending.items() if value
+    )
+    return merged
+
+
+like_flusher: LikeFlusher | None = None
+
+
+def get_like_flusher() -> LikeFlusher | None:
+    return like_flusher
+
+
+async def start_like_flusher(buffer: LikeBuffer) -> LikeFlusher:
+    global like_flusher
+    like_flusher = LikeFlusher(buffer)
+    # Votes left over from a worker that died mid-flush. Batches other
+    # workers are flushing right now are younger than the lease.
+    await buffer.recover(like_flusher.lease)
+    like_flusher.start()
+    return like_flusher
+
+
+async def stop_like_flusher() -> None:
+    global like_flusher
+    if like_flusher is None:
+        return
+    await like_flusher.stop()
+    await like_flusher.buffer.close()
+    like_flusher = None
@@ -0,0 +1,164 @@
+'''Prometheus metrics, served by GET /metrics.
+
+With several uvicorn workers, point PROMETHEUS_MULTIPROC_DIR at an empty
+directory before they start. Every worker then writes its samples there
+and whichever worker answers the scrape sums all of them up.
+'''
+import os
+import time
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+UNMATCHED = 'unmatched'
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Time to answer a request, by route template.',
+    ['method', 'route', 'status'],
+)
+SQL_LATENCY = Histogram(
+    'db_statement_duration_seconds',
+    'Time spent in the database driver per statement.',
+    ['operation'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5),
+)
+SQL_ERRORS = Counter(
+    'db_statement_errors_total',
+    'Statements that raised.',
+    ['operation'],
+)
+CACHE_REQUESTS = Counter(
+    'cache_requests_total',
+    'Read-through cache lookups, by key prefix.',
+    ['cache', 'result'],
+)
+CACHE_LATENCY = Histogram(
+    'cache_lookup_duration_seconds',
+    'Time to read from the cache, misses not included.',
+    ['cache'],
+    buckets=(.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1),
+)
+EMAIL_CHECKS_IN_FLIGHT = Gauge(
+    'email_checks_in_flight',
+    'Email checks running right now.',
+    multiprocess_mode='livesum',
+)
+EMAIL_QUEUE_SIZE = Gauge(
+    'email_checks_queued',
+    'Email checks waiting in the queue.',
+    multiprocess_mode='livemax',
+)
+EMAIL_CHECKS = Counter(
+    'email_checks_total',
+    'Finished email checks.',
+    ['result'],
+)
+
+
+def render() -> tuple[bytes, str]:
+    '''The exposition of this process, or of every worker.'''
+    registry = REGISTRY
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    '''Drop the live gauges of this worker, other samples are kept.'''
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def cache_name(key: str) -> str:
+    return key.split(':', 1)[0]
+
+
+def observe_cache(name: str, hits: int, misses: int, started: float) -> None:
+    if hits:
+        CACHE_REQUESTS.labels(name, 'hit').inc(hits)
+        CACHE_LATENCY.labels(name).observe(time.perf_counter() - started)
+    if misses:
+        CACHE_REQUESTS.labels(name, 'miss').inc(misses)
+
+
+def _operation(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement else ''
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    SQL_LATENCY.labels(_operation(statement)).observe(time.perf_counter() - started)
+
+
+def _handle_error(context) -> None:
+    started = context.connection.info.get('query_started')
+    if started:
+        started.pop()
+    SQL_ERRORS.labels(_operation(context.statement)).inc()
+
+
+def instrument_engine(engine: Engine) -> None:
+    '''Time every statement the engine runs.'''
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+class MetricsMiddleware:
+    '''Observes the latency of every HTTP request.
+
+    Requests are labelled with the path template of the route they
+    matched, so `/posts/1` and `/posts/2` share one series.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        self._templates: dict = {}
+        # labels() costs more than the observation itself.
+        self._series: dict[tuple, Histogram] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            labels = (scope['method'], self._route(scope), status_code)
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = REQUEST_LATENCY.labels(*labels)
+            series.observe(time.perf_counter() - started)
+
+    def _route(self, scope) -> str:
+        # The router adds the matched endpoint to the scope.
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return UNMATCHED
+        template = self._templates.get(endpoint)
+        if template is None:
+            template = next(
+                (route.path for route in scope['app'].routes
+                 if getattr(route, 'endpoint', None) is endpoint),
+                UNMATCHED,
+            )
+            self._templates[endpoint] = template
+        return template
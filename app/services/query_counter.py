@@ -0,0 +1,130 @@
+'''Statements sent to the database per request, for debugging and tests.
+
+With DB_QUERY_COUNTER on, every response carries X-DB-Queries and
+X-DB-Time-Ms, and statements repeated DB_N_PLUS_ONE_THRESHOLD times or
+more within one request are logged as N+1 suspects. Routes declare what
+they may send with `query_budget`. Going over it is logged, or raised
+with DB_QUERY_COUNTER_STRICT, which makes the test client fail the test.
+'''
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryLog:
+    def __init__(self):
+        self.statements: Counter[str] = Counter()
+        self.seconds = 0.0
+        self.budget: int | None = None
+
+    @property
+    def count(self) -> int:
+        return sum(self.statements.values())
+
+    def n_plus_one_suspects(self, threshold: int) -> dict[str, int]:
+        return {
+            statement: count
+            for statement, count in self.statements.items() if count >= threshold
+        }
+
+
+_query_log: ContextVar[QueryLog | None] = ContextVar('query_log', default=None)
+
+
+def current_query_log() -> QueryLog | None:
+    return _query_log.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _query_log.get() is not None:
+        conn.info.setdefault('query_counter_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    log = _query_log.get()
+    if log is not None:
+        started = conn.info['query_counter_started'].pop()
+        log.seconds += time.perf_counter() - started
+        log.statements[statement] += 1
+
+
+def _handle_error(context) -> None:
+    started = context.connection.info.get('query_counter_started')
+    if _query_log.get() is not None and started:
+        started.pop()
+
+
+def listen() -> None:
+    '''Watch the statements of every engine, test ones included.'''
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+
+def query_budget(limit: int):
+    '''Route dependency declaring the most statements a request may send.'''
+    # Async, FastAPI would run a sync one in the threadpool on every request.
+    async def dependency() -> None:
+        log = _query_log.get()
+        if log is not None:
+            log.budget = limit
+    return dependency
+
+
+class QueryCounterMiddleware:
+    '''Gives every request its own QueryLog when DB_QUERY_COUNTER is on.
+
+    Headers are written when the response starts, statements sent while
+    streaming the body are only in the logs.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        listen()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not settings.DB_QUERY_COUNTER:
+            return await self.app(scope, receive, send)
+        log = QueryLog()
+        token = _query_log.set(log)
+
+        async def send_with_counts(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = [
+                    *message.get('headers', ()),
+                    (b'x-db-queries', str(log.count).encode()),
+                    (b'x-db-time-ms', f'{log.seconds * 1e3:.2f}'.encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_counts)
+        finally:
+            _query_log.reset(token)
+        self.report(scope, log)
+
+    def report(self, scope, log: QueryLog) -> None:
+        request = f'{scope["method"]} {scope["path"]}'
+        suspects = log.n_plus_one_suspects(settings.DB_N_PLUS_ONE_THRESHOLD)
+        for statement, count in suspects.items():
+            logger.warning('N+1 suspect in %s, sent %s times: %s',
+                           request, count, statement)
+        if log.budget is not None and log.count > log.budget:
+            message = (f'{request} sent {log.count} statements, '
+                       f'its budget is {log.budget}')
+            if settings.DB_QUERY_COUNTER_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
@@ -0,0 +1,170 @@
+import logging
+import math
+import secrets
+import time
+from collections import deque
+
+import aioredis
+from fastapi import Depends, HTTPException, Request, status
+
+from app.services.database.schemas.users import UserInDB
+from app.services.security.permissions import get_current_active_user
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_KEY = 'rate_limit:{scope}:{client}'
+
+# Sliding window log: a sorted set of request times within the window.
+# KEYS: log. ARGV: now, window, limit, member, all in milliseconds but
+# the last two. Returns 0 if the request is allowed, otherwise the
+# milliseconds until the oldest request leaves the window.
+SLIDING_WINDOW_SCRIPT = '''
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], window)
+    return 0
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return math.max(tonumber(oldest[2]) + window - now, 1)
+'''
+
+
+class RateLimiter:
+    '''Sliding window request counter. In-memory, for tests and single-process runs.
+
+    `hit` counts a request against `limit` requests per `window` seconds
+    and returns None, or the seconds to wait when it is over the limit.
+    Rejected requests are not counted.
+    '''
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        # Window and request times of every key, least recently hit first.
+        self._log: dict[str, tuple[float, deque[float]]] = {}
+
+    async def hit(self, key: str, limit: int, window: float) -> float | None:
+        now = self.clock()
+        self._drop_idle(now)
+        _, log = self._log.pop(key, (window, deque()))
+        while log and log[0] <= now - window:
+            log.popleft()
+        allowed = len(log) < limit
+        if allowed:
+            log.append(now)
+        if log:
+            self._log[key] = (window, log)
+        return None if allowed else log[0] + window - now
+
+    def _drop_idle(self, now: float) -> None:
+        # Clients that made no request within their window are forgotten,
+        # starting from the one that was seen the longest ago.
+        while self._log:
+            key = next(iter(self._log))
+            window, log = self._log[key]
+            if log[-1] > now - window:
+                break
+            del self._log[key]
+
+    async def close(self) -> None:
+        return None
+
+
+class RedisRateLimiter(RateLimiter):
+    '''Counters shared by every uvicorn worker, one script call per request.'''
+
+    def __init__(self, address: str, clock=time.time):
+        self.clock = clock
+        self._address = address
+        self._pool: aioredis.Redis | None = None
+
+    async def _client(self) -> aioredis.Redis:
+        if self._pool is None:
+            self._pool = await aioredis.create_redis_pool(self._address)
+        return self._pool
+
+    async def hit(self, key: str, limit: int, window: float) -> float | None:
+        client = await self._client()
+        now = int(self.clock() * 1000)
+        wait = await client.eval(
+            SLIDING_WINDOW_SCRIPT,
+            keys=[key],
+            # Requests within the same millisecond need distinct members.
+            args=[now, int(window * 1000), limit, f'{now}:{secrets.token_hex(4)}'],
+        )
+        return wait / 1000 if wait else None
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+
+async def check_rate_limit(
+    limiter: RateLimiter | None,
+    scope: str,
+    client: str,
+    rate: tuple[int, float],
+) -> None:
+    '''Raise 429 once `client` made more than `rate` requests to `scope`.
+
+    An unreachable limiter lets requests through rather than failing them.
+    '''
+    if limiter is None:
+        return
+    limit, window = rate
+    try:
+        wait = await limiter.hit(
+            RATE_LIMIT_KEY.format(scope=scope, client=client), limit, window
+        )
+    except Exception:
+        logger.exception('Rate limiter is unavailable')
+        return
+    if wait is not None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail='Too many requests',
+            headers={'Retry-After': str(math.ceil(wait))},
+        )
+
+
+rate_limiter: RateLimiter | None = None
+
+
+def get_rate_limiter() -> RateLimiter | None:
+    return rate_limiter
+
+
+def limit_by_client(scope: str, rate: tuple[int, float]):
+    '''Dependency limiting requests per client address.'''
+    async def dependency(
+        request: Request,
+        limiter: RateLimiter | None = Depends(get_rate_limiter),
+    ) -> None:
+        client = request.client.host if request.client else 'unknown'
+        await check_rate_limit(limiter, scope, client, rate)
+    return dependency
+
+
+def limit_by_user(scope: str, rate: tuple[int, float]):
+    '''Dependency limiting requests per authenticated user.'''
+    async def dependency(
+        user: UserInDB = Depends(get_current_active_user),
+        limiter: RateLimiter | None = Depends(get_rate_limiter),
+    ) -> None:
+        await check_rate_limit(limiter, scope, str(user.id), rate)
+    return dependency
+
+
+async def start_rate_limiter(limiter: RateLimiter) -> None:
+    global rate_limiter
+    rate_limiter = limiter
+
+
+async def stop_rate_limiter() -> None:
+    global rate_limiter
+    if rate_limiter is not None:
+        await rate_limiter.close()
+        rate_limiter = None
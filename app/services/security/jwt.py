@@ -1,13 +1,20 @@
+import hashlib
+import time
 from datetime import datetime, timedelta
 from typing import Dict, Union
 
 from jose import jwt
 
 from app.core.config import settings
+from app.services.database.schemas.tokens import TokenPayload
+from app.utils.lru import LRUCache
 
 ALGORITHM = 'HS256'
 access_token_jwt_subject = 'access'
 
+# Digests of tokens that passed verification, each kept until its own exp.
+verified_tokens = LRUCache(settings.TOKEN_CACHE_MAXSIZE)
+
 
 def create_access_token(
         data: dict,
@@ -24,3 +31,32 @@ def create_access_token(
                              settings.SECRET_KEY,
                              algorithm=ALGORITHM)
     return encoded_jwt
+
+
+def _token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+def decode_access_token(token: str) -> TokenPayload:
+    '''Verify the token, skipping the signature check for known tokens.
+
+    Raises JWTError for invalid or expired tokens.
+    '''
+    digest = _token_digest(token)
+    token_data = verified_tokens.get(digest)
+    if token_data is not None:
+        return token_data
+    payload = jwt.decode(token,
+                         settings.SECRET_KEY,
+                         algorithms=[ALGORITHM])
+    token_data = TokenPayload(**payload)
+    if 'exp' in payload:
+        ttl = payload['exp'] - time.time()
+        if ttl > 0:
+            verified_tokens.set(digest, token_data, ttl)
+    return token_data
+
+
+def revoke_token(token: str) -> None:
+    '''Drop the token from the verified cache, so it is checked again.'''
+    verified_tokens.delete(_token_digest(token))
@@ -1,6 +1,18 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+from app.core.config import settings
+
+pwd_context = CryptContext(
+    schemes=['bcrypt'],
+    deprecated='auto',
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+)
+
+_executor: Executor | None = None
 
 
 def verify_password(
@@ -12,3 +24,44 @@ def verify_password(
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+def get_password_executor() -> Executor | None:
+    '''Process pool for bcrypt, None when hashing runs on the event loop.'''
+    global _executor
+    if _executor is None and settings.PASSWORD_HASH_WORKERS != 0:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS
+        )
+    return _executor
+
+
+async def shutdown_password_executor() -> None:
+    '''Let running hashes finish, off the event loop, and drop queued ones.'''
+    global _executor
+    if _executor is not None:
+        executor, _executor = _executor, None
+        await asyncio.get_running_loop().run_in_executor(
+            None, partial(executor.shutdown, cancel_futures=True)
+        )
+
+
+async def verify_password_async(
+        plain_password: str,
+        hashed_password: str
+) -> bool:
+    executor = get_password_executor()
+    if executor is None:
+        return verify_password(plain_password, hashed_password)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, verify_password, plain_password, hashed_password
+    )
+
+
+async def get_password_hash_async(password: str) -> str:
+    executor = get_password_executor()
+    if executor is None:
+        return get_password_hash(password)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, get_password_hash, password)
@@ -1,13 +1,12 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+from jose import JWTError
 
-from app.core.config import settings
 from app.services.database.repositories.posts import PostCrud
 from app.services.database.repositories.users import UserCrud
-from app.services.database.schemas.tokens import TokenPayload
 from app.services.database.schemas.users import UserInDB
-from app.services.security.jwt import ALGORITHM
+from app.services.security.jwt import decode_access_token
+from app.services.user_cache import user_cache
 
 reusable_oauth2 = OAuth2PasswordBearer(tokenUrl='token')
 
@@ -17,19 +16,20 @@ async def get_current_user(
         token: str = Depends(reusable_oauth2),
 ) -> UserInDB:
     try:
-        payload = jwt.decode(token,
-                             settings.SECRET_KEY,
-                             algorithms=[ALGORITHM])
-        token_data = TokenPayload(**payload)
+        token_data = decode_access_token(token)
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Could not validate credentials'
         )
-    user = await crud.get_by_id(token_data.user_id)
+    user = await user_cache.get(token_data.user_id)
+    if user is not None:
+        return user
+    # The row is cached, a lagging replica would keep a stale user there.
+    user = await crud.get_by_id(token_data.user_id, primary=True)
     if not user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='Bad token')
-    return user
+    return await user_cache.set(user)
 
 
 async def get_current_active_user(
@@ -58,7 +58,7 @@ async def is_post_author(
         post_crud: PostCrud = Depends(),
         current_user=Depends(get_current_active_user)
 ) -> UserInDB:
-    post = await post_crud.get_by_id(post_id)
+    post = await post_crud.get_by_id(post_id, primary=True)
     if not post:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
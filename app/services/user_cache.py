@@ -0,0 +1,59 @@
+from collections import Counter
+
+from app.core.config import settings
+from app.services.database.schemas.users import User
+from app.utils.cache import redis_cache, set_with_ttl
+from app.utils.lru import LRUCache
+
+USER_CACHE_KEY = 'user:{user_id}'
+
+
+class UserCache:
+    '''Users by id, in an in-process LRU in front of the shared Redis cache.
+
+    Only the public `User` fields are cached, never the password hash.
+    The local tier has a short TTL because invalidation only reaches the
+    process that made the change, the Redis tier is cleared explicitly.
+    '''
+
+    def __init__(
+        self,
+        ttl: int = settings.USER_CACHE_TTL,
+        local_ttl: int = settings.USER_CACHE_LOCAL_TTL,
+        local_maxsize: int = settings.USER_CACHE_LOCAL_MAXSIZE,
+    ):
+        self.ttl = ttl
+        self._local = LRUCache(local_maxsize, local_ttl)
+        self.stats = Counter(local_hits=0, redis_hits=0, misses=0)
+
+    async def get(self, user_id: int) -> User | None:
+        user = self._local.get(user_id)
+        if user is not None:
+            self.stats['local_hits'] += 1
+            return user
+        in_cache = await redis_cache().get(USER_CACHE_KEY.format(user_id=user_id))
+        if in_cache is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['redis_hits'] += 1
+        user = User.parse_raw(in_cache)
+        self._local.set(user_id, user)
+        return user
+
+    async def set(self, user) -> User:
+        user = User.from_orm(user)
+        self._local.set(user.id, user)
+        await set_with_ttl(
+            redis_cache(),
+            USER_CACHE_KEY.format(user_id=user.id),
+            user.json(),
+            self.ttl,
+        )
+        return user
+
+    async def invalidate(self, user_id: int) -> None:
+        self._local.delete(user_id)
+        await redis_cache().delete(USER_CACHE_KEY.format(user_id=user_id))
+
+
+user_cache = UserCache()
@@ -1,6 +1,306 @@
+import asyncio
+import json
+import secrets
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Iterable
+
+from fastapi import Depends
 from fastapi_cache import caches
-from fastapi_cache.backends.redis import CACHE_KEY
+from fastapi_cache.backends.redis import CACHE_KEY, RedisCacheBackend
+
+from app.core.config import settings
+from app.services.metrics import cache_name, observe_cache
+
+LIKE_CACHE_KEY = 'likes:{post_id}'
+POST_CACHE_KEY = 'post:{post_id}'
+# The post without its likes, for feeds.
+POST_SUMMARY_CACHE_KEY = 'post_summary:{post_id}'
+TAG_KEY = 'tag:{tag}'
+LOCK_KEY = 'lock:{key}'
+
+# Stored for keys whose source row does not exist.
+MISSING = b'!missing'
+
+# KEYS: lock. ARGV: token of the owner.
+RELEASE_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
 
 
 def redis_cache():
     return caches.get(CACHE_KEY)
+
+
+def _ttl_kwargs(cache, ttl: int) -> dict:
+    # aioredis takes `expire`, while the in-memory backend used by tests
+    # takes `ttl`.
+    if isinstance(cache, RedisCacheBackend):
+        return {'expire': ttl}
+    return {'ttl': ttl}
+
+
+async def set_with_ttl(cache, key: str, value, ttl: int) -> bool:
+    '''Set a value that expires, whatever backend is registered.'''
+    return await cache.set(key, value, **_ttl_kwargs(cache, ttl))
+
+
+async def add_with_ttl(cache, key: str, value, ttl: int) -> bool:
+    return await cache.add(key, value, **_ttl_kwargs(cache, ttl))
+
+
+async def get_many(cache, keys: list[str]) -> list:
+    '''Values of all keys in one round trip where the backend allows it.'''
+    if not keys:
+        return []
+    if hasattr(cache, 'get_many'):
+        return await cache.get_many(keys)
+    if isinstance(cache, RedisCacheBackend):
+        client = await cache._client
+        return await client.mget(*keys, encoding=cache._encoding)
+    return await asyncio.gather(*(cache.get(key) for key in keys))
+
+
+_in_flight: dict[str, asyncio.Future] = {}
+
+
+async def single_flight(key: str, load: Callable[[], Awaitable]):
+    '''Run `load` once for all concurrent callers of this process.'''
+    while key in _in_flight:
+        future = _in_flight[key]
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Only the caller that was loading got cancelled, take over.
+            if not future.cancelled():
+                raise
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    try:
+        result = await load()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except BaseException as exc:
+        future.set_exception(exc)
+        # Nobody may be waiting, don't log it as never retrieved.
+        future.exception()
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        del _in_flight[key]
+
+
+@asynccontextmanager
+async def cache_lock(cache, key: str, timeout: int) -> AsyncIterator[bool]:
+    '''Try to take a lock shared by every worker, yields whether it was taken.
+
+    The lock expires after `timeout` seconds in case its owner dies.
+    '''
+    # Locks must never be served from an in-process tier.
+    cache = getattr(cache, 'remote', cache)
+    lock = LOCK_KEY.format(key=key)
+    token = secrets.token_hex(8)
+    if isinstance(cache, RedisCacheBackend):
+        # The backend's `add` is a GET and a SET, which is no lock at all.
+        client = await cache._client
+        acquired = await client.set(
+            lock, token, expire=timeout, exist=client.SET_IF_NOT_EXIST
+        )
+    else:
+        # Reading first drops an expired lock, `add` alone would not.
+        acquired = (await cache.get(lock) is None
+                    and await add_with_ttl(cache, lock, token, timeout))
+    try:
+        yield acquired
+    finally:
+        if not acquired:
+            pass
+        elif isinstance(cache, RedisCacheBackend):
+            await client.eval(RELEASE_SCRIPT, keys=[lock], args=[token])
+        elif await cache.get(lock) == token:
+            await cache.delete(lock)
+
+
+async def get_or_load(
+    cache,
+    key: str,
+    load: Callable[[], Awaitable[bytes | None]],
+    negative_ttl: int = settings.CACHE_NEGATIVE_TTL,
+    lock_timeout: int = settings.CACHE_LOCK_TIMEOUT,
+) -> bytes | None:
+    '''Read-through cache that recomputes a missing key only once.
+
+    Concurrent misses in this process share one `load`, and across
+    workers only the holder of the key's lock runs it while the others
+    poll the cache. `load` returns None when the source row does not
+    exist, that answer is cached for `negative_ttl` seconds.
+
+    Values are bytes, ready to be sent as they are.
+    '''
+    started = time.perf_counter()
+    value = await cache.get(key, encoding=None)
+    observe_cache(cache_name(key), value is not None, value is None, started)
+    if value is None:
+        value = await single_flight(
+            key, lambda: _load_locked(cache, key, load, negative_ttl, lock_timeout)
+        )
+    return None if value == MISSING else value
+
+
+async def _load_locked(cache, key, load, negative_ttl, lock_timeout) -> bytes:
+    deadline = time.monotonic() + lock_timeout
+    while True:
+        async with cache_lock(cache, key, lock_timeout) as acquired:
+            # The previous holder may have just filled it.
+            value = await cache.get(key, encoding=None)
+            if value is not None:
+                return value
+            if acquired or time.monotonic() > deadline:
+                value = await load()
+                if value is None:
+                    await set_with_ttl(cache, key, MISSING, negative_ttl)
+                    return MISSING
+                await cache.set(key, value)
+                return value
+        await asyncio.sleep(settings.CACHE_LOCK_POLL_INTERVAL)
+
+
+def post_tag(post_id: int) -> str:
+    return f'post:{post_id}'
+
+
+class TaggedCache:
+    '''Read-through cache whose entries are invalidated by tags.
+
+    Every tag has a random version stored under its own key. An entry
+    remembers the versions of its tags when it was written and is a miss
+    once any of them changed, so `invalidate` is a single delete per tag
+    no matter how many entries carry it.
+    '''
+
+    def __init__(self, cache, ttl: int = settings.POST_CACHE_TTL):
+        self.cache = cache
+        self.ttl = ttl
+
+    async def _versions(self, tags: Iterable[str]) -> dict[str, str | None]:
+        tags = list(tags)
+        versions = await get_many(
+            self.cache, [TAG_KEY.format(tag=tag) for tag in tags]
+        )
+        return dict(zip(tags, versions))
+
+    async def _ensure_versions(self, tags: Iterable[str]) -> dict[str, str]:
+        versions = await self._versions(tags)
+        missing = [tag for tag, version in versions.items() if version is None]
+        if missing:
+            # Tags outlive their entries, a lost race only costs a miss.
+            await asyncio.gather(*(
+                add_with_ttl(self.cache, TAG_KEY.format(tag=tag),
+                             secrets.token_hex(8), self.ttl * 2)
+                for tag in missing
+            ))
+            versions.update(await self._versions(missing))
+        return versions
+
+    async def get(self, key: str) -> str | None:
+        raw = await self.cache.get(key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        if await self._versions(entry['tags']) != entry['tags']:
+            return None
+        return entry['value']
+
+    async def get_many(self, keys: list[str]) -> list[str | None]:
+        '''Like `get` for many keys, in two round trips whatever their number.'''
+        entries = [
+            json.loads(raw) if raw is not None else None
+            for raw in await get_many(self.cache, keys)
+        ]
+        tags = {tag for entry in entries if entry for tag in entry['tags']}
+        versions = await self._versions(tags)
+        return [
+            entry['value']
+            if entry and all(versions[tag] == version
+                             for tag, version in entry['tags'].items())
+            else None
+            for entry in entries
+        ]
+
+    async def set(self, key: str, value: str, tags: Iterable[str]) -> None:
+        await self._write(key, value, await self._ensure_versions(tags))
+
+    async def _write(self, key: str, value: str, versions: dict[str, str]) -> None:
+        entry = {'tags': versions, 'value': value}
+        await set_with_ttl(self.cache, key, json.dumps(entry), self.ttl)
+
+    async def get_or_set(
+        self,
+        key: str,
+        tags: Iterable[str],
+        load: Callable[[], Awaitable[str | None]],
+    ) -> str | None:
+        '''Return the cached value, or the result of `load` after caching it.
+
+        Tag versions are taken before loading, so an invalidation that
+        happens while `load` runs turns the stored entry into a miss.
+        '''
+        started = time.perf_counter()
+        value = await self.get(key)
+        observe_cache(cache_name(key), value is not None, value is None, started)
+        if value is not None:
+            return value
+        return await single_flight(key, lambda: self._load(key, tags, load))
+
+    async def _load(self, key, tags, load) -> str | None:
+        versions = await self._ensure_versions(tags)
+        value = await load()
+        if value is not None:
+            await self._write(key, value, versions)
+        return value
+
+    async def get_or_set_many(
+        self,
+        tags_by_key: dict[str, Iterable[str]],
+        load: Callable[[list[str]], Awaitable[dict[str, str]]],
+    ) -> dict[str, str | None]:
+        '''Like `get_or_set` for many keys, `load` gets all the missing ones.
+
+        Keys that `load` leaves out are returned as None and not cached.
+        '''
+        keys = list(tags_by_key)
+        started = time.perf_counter()
+        values = dict(zip(keys, await self.get_many(keys)))
+        missing = [key for key, value in values.items() if value is None]
+        if keys:
+            observe_cache(
+                cache_name(keys[0]), len(keys) - len(missing), len(missing), started
+            )
+        if missing:
+            versions = await self._ensure_versions(
+                {tag for key in missing for tag in tags_by_key[key]}
+            )
+            loaded = await load(missing)
+            await asyncio.gather(*(
+                self._write(
+                    key, value, {tag: versions[tag] for tag in tags_by_key[key]}
+                )
+                for key, value in loaded.items()
+            ))
+            values.update(loaded)
+        return values
+
+    async def invalidate(self, *tags: str) -> None:
+        await asyncio.gather(
+            *(self.cache.delete(TAG_KEY.format(tag=tag)) for tag in tags)
+        )
+
+
+def tagged_cache(cache=Depends(redis_cache)) -> TaggedCache:
+    return TaggedCache(cache)
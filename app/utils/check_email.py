@@ -1,30 +1,43 @@
-import asyncio
-
 import httpx
 from fastapi import status
 
 from app.core.config import settings
 from app.services.database.repositories.users import UserCrud
 
-API_ENDPOINT = 'https://api.hunter.io/v2/email-verifier'
+# Statuses the verifier may resolve on a later attempt.
+RETRY_STATUSES = {'unknown'}
 
 
 async def check_email(
         email: str,
         user_crud: UserCrud,
-        second_check: bool = False,
-):
-    async with httpx.AsyncClient() as client:
-        params = {
-            'email': email,
-            'api_key': settings.EMAIL_HUNTER_API_KEY,
-        }
-        response = await client.get(API_ENDPOINT, params=params, timeout=20)
-    if response.status_code == status.HTTP_200_OK:
-        response_json = response.json()
-        email_status = response_json['data'].get('status')
-        if email_status == 'valid':
-            await user_crud.activate_user(email)
-            return
-    if not second_check:
-        asyncio.create_task(check_email(email, user_crud, second_check=True))
+        client: httpx.AsyncClient | None = None,
+) -> bool:
+    '''Run one verification attempt and activate the user if the email is valid.
+
+    Returns False if the verifier gave no definite answer and the check
+    should be retried later.
+    '''
+    params = {
+        'email': email,
+        'api_key': settings.EMAIL_HUNTER_API_KEY,
+    }
+    if client is None:
+        async with httpx.AsyncClient() as client:
+            response = await client.get(
+                settings.EMAIL_VERIFIER_URL,
+                params=params,
+                timeout=settings.EMAIL_VERIFIER_TIMEOUT,
+            )
+    else:
+        response = await client.get(
+            settings.EMAIL_VERIFIER_URL,
+            params=params,
+            timeout=settings.EMAIL_VERIFIER_TIMEOUT,
+        )
+    if response.status_code != status.HTTP_200_OK:
+        return False
+    email_status = response.json()['data'].get('status')
+    if email_status == 'valid':
+        await user_crud.activate_user(email)
+    return email_status not in RETRY_STATUSES
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from collections import Counter
+
+import aioredis
+from fastapi_cache.backends.base import BaseCacheBackend
+from fastapi_cache.backends.redis import RedisCacheBackend
+
+from app.core.config import settings
+from app.utils.cache import add_with_ttl, get_many, set_with_ttl
+from app.utils.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Published instead of a key when the whole cache was flushed.
+FLUSH_ALL = '*'
+
+
+class LayeredCacheBackend(BaseCacheBackend):
+    '''A bounded in-process LRU in front of a shared backend.
+
+    Reads are served locally for up to `local_ttl` seconds. Deletes are
+    published on `channel`, so once `start` subscribed to it every worker
+    evicts its own copy. A worker that lost the subscription only serves
+    stale entries until they expire locally.
+    '''
+
+    def __init__(
+        self,
+        remote: BaseCacheBackend,
+        local_ttl: float = settings.CACHE_LOCAL_TTL,
+        local_maxsize: int = settings.CACHE_LOCAL_MAXSIZE,
+        channel: str = settings.CACHE_INVALIDATION_CHANNEL,
+    ):
+        self.remote = remote
+        self.local_ttl = local_ttl
+        self.channel = channel
+        self._local = LRUCache(local_maxsize, local_ttl)
+        self._listener: asyncio.Task | None = None
+        self.stats = Counter(
+            local_hits=0, local_misses=0, remote_hits=0, remote_misses=0
+        )
+
+    def hit_ratios(self) -> dict[str, float | None]:
+        ratios = {}
+        for tier in ('local', 'remote'):
+            hits = self.stats[f'{tier}_hits']
+            lookups = hits + self.stats[f'{tier}_misses']
+            ratios[tier] = hits / lookups if lookups else None
+        return ratios
+
+    async def get(self, key, default=None, **kwargs):
+        value = self._local.get(key)
+        if value is not None:
+            self.stats['local_hits'] += 1
+            return value
+        self.stats['local_misses'] += 1
+        value = await self.remote.get(key, **kwargs)
+        if value is None:
+            self.stats['remote_misses'] += 1
+            return default
+        self.stats['remote_hits'] += 1
+        # The remote TTL is unknown here, a deleted key is evicted anyway.
+        self._local.set(key, value)
+        return value
+
+    async def get_many(self, keys: list) -> list:
+        values = [self._local.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        self.stats['local_hits'] += len(keys) - len(missing)
+        self.stats['local_misses'] += len(missing)
+        if not missing:
+            return values
+        remote = await get_many(self.remote, [keys[i] for i in missing])
+        for i, value in zip(missing, remote):
+            if value is None:
+                self.stats['remote_misses'] += 1
+            else:
+                self.stats['remote_hits'] += 1
+                self._local.set(keys[i], value)
+                values[i] = value
+        return values
+
+    async def set(self, key, value, ttl: int | None = None, **kwargs) -> bool:
+        if ttl is None:
+            result = await self.remote.set(key, value, **kwargs)
+        else:
+            result = await set_with_ttl(self.remote, key, value, ttl)
+        self._local.set(key, value, min(ttl or self.local_ttl, self.local_ttl))
+        return result
+
+    async def add(self, key, value, ttl: int | None = None, **kwargs) -> bool:
+        if ttl is None:
+            return await self.remote.add(key, value, **kwargs)
+        return await add_with_ttl(self.remote, key, value, ttl)
+
+    async def expire(self, key, ttl: int) -> bool:
+        return await self.remote.expire(key, ttl)
+
+    async def exists(self, *keys) -> bool:
+        return await self.remote.exists(*keys)
+
+    async def delete(self, key) -> bool:
+        self._local.delete(key)
+        result = await self.remote.delete(key)
+        await self._publish(key)
+        return result
+
+    async def flush(self) -> None:
+        self._local.clear()
+        await self.remote.flush()
+        await self._publish(FLUSH_ALL)
+
+    def evict(self, key: str) -> None:
+        if key == FLUSH_ALL:
+            self._local.clear()
+        else:
+            self._local.delete(key)
+
+    async def _publish(self, key) -> None:
+        if isinstance(self.remote, RedisCacheBackend):
+            client = await self.remote._client
+            await client.publish(self.channel, key)
+
+    async def ping(self) -> None:
+        '''Open the Redis pool now, raising if it is unreachable.'''
+        if isinstance(self.remote, RedisCacheBackend):
+            client = await self.remote._client
+            await client.ping()
+
+    async def start(self, address: str) -> None:
+        '''Evict keys deleted by other workers.'''
+        self._listener = asyncio.create_task(self._listen(address))
+
+    async def _listen(self, address: str) -> None:
+        while True:
+            try:
+                subscriber = await aioredis.create_redis(address)
+                try:
+                    channel, = await subscriber.subscribe(self.channel)
+                    # Whatever was deleted while we were not listening.
+                    self._local.clear()
+                    async for key in channel.iter(encoding='utf-8'):
+                        self.evict(key)
+                finally:
+                    subscriber.close()
+                    await subscriber.wait_closed()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Lost cache invalidation channel')
+            await asyncio.sleep(1)
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        self._local.clear()
+        await self.remote.close()
@@ -0,0 +1,43 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    '''Bounded in-process cache with optional per-entry expiry.
+
+    Not thread-safe, meant to be used from a single event loop.
+    '''
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float | None, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            expires_at, value = self._data[key]
+        except KeyError:
+            return default
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> bool:
+        return self._data.pop(key, None) is not None
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,72 @@
+import base64
+import binascii
+
+from fastapi import HTTPException, Query, status
+
+from app.core.config import settings
+
+
+def encode_cursor(*keys) -> str:
+    raw = ':'.join(repr(key) for key in keys)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, types: tuple[type, ...] = (int,)) -> tuple:
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        keys = base64.urlsafe_b64decode(padded).decode().split(':')
+        if len(keys) != len(types):
+            raise ValueError
+        return tuple(type_(key) for type_, key in zip(types, keys))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Invalid cursor',
+        )
+
+
+class Pagination:
+    '''Keyset pagination by primary key.
+
+    The client gets an opaque `next_cursor` with every page and passes it
+    back as `after`, so every page is an index range scan on `id`.
+    '''
+
+    def __init__(
+        self,
+        after: str | None = Query(None),
+        limit: int = Query(settings.PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    ):
+        self.after_id = decode_cursor(after)[0] if after else None
+        self.limit = limit
+
+    @property
+    def fetch_limit(self) -> int:
+        # One extra row tells us whether there is a next page.
+        return self.limit + 1
+
+    def page(self, rows: list) -> dict:
+        items = rows[:self.limit]
+        next_cursor = None
+        if len(rows) > self.limit:
+            next_cursor = encode_cursor(items[-1].id)
+        return {'items': items, 'next_cursor': next_cursor}
+
+
+class RankedPagination(Pagination):
+    '''Keyset pagination by (rank, id), both descending.'''
+
+    def __init__(
+        self,
+        after: str | None = Query(None),
+        limit: int = Query(settings.PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    ):
+        self.after = decode_cursor(after, (float, int)) if after else None
+        self.limit = limit
+
+    def page(self, rows: list) -> dict:
+        items = rows[:self.limit]
+        next_cursor = None
+        if len(rows) > self.limit:
+            next_cursor = encode_cursor(items[-1].rank, items[-1].id)
+        return {'items': items, 'next_cursor': next_cursor}
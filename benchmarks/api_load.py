@@ -0,0 +1,299 @@
+'''Load test of the API hot paths, in process, through the ASGI transport.
+
+Seeds the database from settings (POSTGRES_DB and friends) with bench_*
+users, their posts and likes, then runs every scenario with a number of
+concurrent clients and prints throughput and latency percentiles as
+JSON. The cache is in memory unless --redis is given. Rate limits and
+the email queue are off, as in tests.
+
+    POSTGRES_DB=bench python -m benchmarks.api_load --seed \\
+        --users 10000 --posts 100000 --likes 2000000 --output before.json
+    python -m benchmarks.api_load --scenarios post_detail likes --output after.json
+'''
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from datetime import timedelta
+
+from fastapi_cache import caches
+from fastapi_cache.backends.memory import InMemoryCacheBackend
+from fastapi_cache.backends.redis import CACHE_KEY, RedisCacheBackend
+from httpx import AsyncClient
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.main import app
+from app.services.database.session import dispose_engines, get_engine
+from app.services.leaderboard import Leaderboard, get_leaderboard
+from app.services.security.jwt import create_access_token
+from app.services.security.password_security import (
+    get_password_hash, shutdown_password_executor)
+from app.utils.layered_cache import LayeredCacheBackend
+from app.utils.pagination import encode_cursor
+
+PASSWORD = 'bench-password'
+
+SEED = (
+    '''
+    INSERT INTO users (username, hashed_password, email, is_active, is_superuser)
+    SELECT 'bench_' || g, :password, 'bench_' || g || '@example.com', true, false
+    FROM generate_series(1, :users) AS g
+    ''',
+    '''
+    INSERT INTO posts (title, text, owner_id)
+    SELECT 'bench title ' || g, 'bench text ' || md5(g::text), first.id + g % :users
+    FROM generate_series(1, :posts) AS g,
+         (SELECT min(id) AS id FROM users WHERE username LIKE 'bench\\_%') AS first
+    ''',
+    # Every post gets the same number of likes from distinct users, none
+    # of them its owner.
+    '''
+    INSERT INTO likes (user_id, post_id, value)
+    SELECT first.id + (posts.owner_id - first.id + 1 + shift) % :users, posts.id,
+           CASE WHEN (posts.id + shift) % 4 = 0 THEN 'DISLIKE' ELSE 'LIKE' END::likevalue
+    FROM posts, generate_series(0, :likes_per_post - 1) AS shift,
+         (SELECT min(id) AS id FROM users WHERE username LIKE 'bench\\_%') AS first
+    WHERE posts.title LIKE 'bench title %'
+    ''',
+    '''
+    UPDATE posts
+    SET likes_count = counts.likes,
+        dislikes_count = counts.dislikes,
+        score = counts.likes - counts.dislikes
+    FROM (SELECT post_id,
+                 count(*) FILTER (WHERE value = 'LIKE') AS likes,
+                 count(*) FILTER (WHERE value = 'DISLIKE') AS dislikes
+          FROM likes GROUP BY post_id) AS counts
+    WHERE posts.id = counts.post_id AND posts.title LIKE 'bench title %'
+    ''',
+    'ANALYZE users, posts, likes',
+)
+
+
+async def seed(users: int, posts: int, likes: int) -> None:
+    likes_per_post = likes // posts
+    if not 0 <= likes_per_post < users:
+        raise SystemExit('--likes / --posts must be below --users')
+    async with get_engine().begin() as conn:
+        if await conn.scalar(text("SELECT count(*) FROM users WHERE username LIKE 'bench\\_%'")):
+            raise SystemExit('The database is already seeded')
+        params = {
+            'password': get_password_hash(PASSWORD), 'users': users,
+            'posts': posts, 'likes_per_post': likes_per_post,
+        }
+        for statement in SEED:
+            started = time.perf_counter()
+            await conn.execute(text(statement), params)
+            print(f'{statement.split()[0]}: {time.perf_counter() - started:.1f}s')
+
+
+async def load_dataset() -> dict:
+    async with get_engine().connect() as conn:
+        users = (await conn.execute(text(
+            "SELECT id, username FROM users WHERE username LIKE 'bench\\_%' ORDER BY id"
+        ))).all()
+        posts = (await conn.execute(text(
+            "SELECT id, owner_id FROM posts WHERE title LIKE 'bench title %' ORDER BY id"
+        ))).all()
+    if not users or not posts:
+        raise SystemExit('Nothing to run against, seed the database with --seed')
+    return {'users': users, 'posts': posts}
+
+
+class Context:
+    '''What scenarios pick their requests from.'''
+
+    def __init__(self, dataset: dict, hot_posts: int, seed: int):
+        self.random = random.Random(seed)
+        self.users = dataset['users']
+        self.posts = dataset['posts']
+        self.hot = self.posts[:hot_posts]
+        self.headers = {}
+        self.liked: set[tuple[int, int]] = set()
+
+    def user(self):
+        return self.random.choice(self.users)
+
+    def post(self):
+        # Most reads go to a small set of popular posts.
+        if self.random.random() < 0.8:
+            return self.random.choice(self.hot)
+        return self.random.choice(self.posts)
+
+    def auth(self, user_id: int) -> dict:
+        headers = self.headers.get(user_id)
+        if headers is None:
+            token = create_access_token(
+                data={'user_id': user_id},
+                expires_delta=timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+            )
+            headers = self.headers[user_id] = {'Authorization': f'Bearer {token}'}
+        return headers
+
+
+async def token(client: AsyncClient, ctx: Context):
+    user = ctx.user()
+    return await client.post(
+        '/token', data={'username': user.username, 'password': PASSWORD}
+    )
+
+
+async def posts_list(client: AsyncClient, ctx: Context):
+    post = ctx.random.choice(ctx.posts)
+    return await client.get('/posts', params={'after': encode_cursor(post.id)})
+
+
+async def post_detail(client: AsyncClient, ctx: Context):
+    return await client.get(f'/posts/{ctx.post().id}')
+
+
+async def likes(client: AsyncClient, ctx: Context):
+    return await client.get(f'/posts/{ctx.post().id}/likes')
+
+
+async def like_toggle(client: AsyncClient, ctx: Context):
+    post = ctx.post()
+    user = ctx.user()
+    while user.id == post.owner_id:
+        user = ctx.user()
+    url = f'/posts/{post.id}/likes'
+    if (user.id, post.id) in ctx.liked:
+        ctx.liked.discard((user.id, post.id))
+        return await client.delete(url, headers=ctx.auth(user.id))
+    ctx.liked.add((user.id, post.id))
+    return await client.post(url, json={'value': 1}, headers=ctx.auth(user.id))
+
+
+SCENARIOS = {
+    'token': token,
+    'posts_list': posts_list,
+    'post_detail': post_detail,
+    'likes': likes,
+    'like_toggle': like_toggle,
+}
+
+
+def percentile(latencies: list[float], q: float) -> float:
+    return latencies[min(int(len(latencies) * q), len(latencies) - 1)]
+
+
+async def run_scenario(client, ctx, scenario, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            response = await scenario(client, ctx)
+            latencies.append(time.perf_counter() - started)
+            # Deleting a like that a previous run left behind answers 400.
+            if response.status_code >= 500 or response.status_code in (401, 403, 404):
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        **{
+            f'p{int(q * 100)}_ms': round(percentile(latencies, q) * 1e3, 2)
+            for q in (0.5, 0.95, 0.99)
+        },
+        'max_ms': round(latencies[-1] * 1e3, 2),
+    }
+
+
+async def setup_cache(use_redis: bool):
+    if use_redis:
+        cache = LayeredCacheBackend(RedisCacheBackend(settings.REDIS_URI))
+        await cache.start(settings.REDIS_URI)
+    else:
+        cache = InMemoryCacheBackend()
+    caches.set(CACHE_KEY, cache)
+    return cache
+
+
+async def run(args) -> dict:
+    if args.seed:
+        await seed(args.users, args.posts, args.likes)
+    dataset = await load_dataset()
+    cache = await setup_cache(args.redis)
+    # Votes feed an in-memory leaderboard, without reconciliation runs.
+    board = Leaderboard()
+    app.dependency_overrides[get_leaderboard] = lambda: board
+
+    results = {}
+    try:
+        async with AsyncClient(app=app, base_url='http://bench') as client:
+            for name in args.scenarios:
+                ctx = Context(dataset, args.hot_posts, args.random_seed)
+                requests = args.token_requests if name == 'token' else args.requests
+                await run_scenario(client, ctx, SCENARIOS[name],
+                                   min(args.warmup, requests), args.concurrency)
+                results[name] = await run_scenario(
+                    client, ctx, SCENARIOS[name], requests, args.concurrency
+                )
+                print(name, json.dumps(results[name]), flush=True)
+    finally:
+        app.dependency_overrides.pop(get_leaderboard)
+        await cache.close()
+        await shutdown_password_executor()
+        await dispose_engines()
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--seed', action='store_true', help='seed the dataset first')
+    parser.add_argument('--users', type=int, default=1_000)
+    parser.add_argument('--posts', type=int, default=10_000)
+    parser.add_argument('--likes', type=int, default=100_000)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=2_000)
+    # bcrypt makes every login take a few hundred milliseconds of CPU.
+    parser.add_argument('--token-requests', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--hot-posts', type=int, default=100)
+    parser.add_argument('--random-seed', type=int, default=0)
+    parser.add_argument('--redis', action='store_true', help='cache in Redis')
+    parser.add_argument('--output', help='also write the results to this file')
+    args = parser.parse_args()
+
+    report = {
+        'commit': git_commit(),
+        'options': {
+            key: value for key, value in vars(args).items()
+            if key not in ('seed', 'output')
+        },
+        'scenarios': asyncio.run(run(args)),
+    }
+    body = json.dumps(report, indent=2)
+    print(body)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(body + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''Cost of building the GET /posts/{post_id}/likes body for a popular post.
+
+Compares the previous pydantic and stdlib json path with the orjson one,
+on a cache miss and on a cache hit, without the database.
+
+    python -m benchmarks.likes_serialization --likes 10000
+'''
+import argparse
+import json
+import timeit
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+from app.services.database.models.posts import Like
+from app.services.database.schemas.posts import LikeInDB
+
+
+def old_miss(likes: list[Like]) -> bytes:
+    likes = [LikeInDB.from_orm(like).dict() for like in likes]
+    json.dumps(likes)  # written to the cache
+    return JSONResponse(jsonable_encoder(likes)).body
+
+
+def old_hit(cached: str) -> bytes:
+    return JSONResponse(jsonable_encoder(json.loads(cached))).body
+
+
+def new_miss(rows: list[dict]) -> bytes:
+    return Response(orjson.dumps(rows), media_type='application/json').body
+
+
+def new_hit(cached: bytes) -> bytes:
+    return Response(cached, media_type='application/json').body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--likes', type=int, default=10_000)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    values = (Like.LikeValue.LIKE, Like.LikeValue.DISLIKE)
+    likes = [
+        Like(id=i, user_id=i, post_id=1, value=values[i % 2])
+        for i in range(1, args.likes + 1)
+    ]
+    # What LikeCrud.get_posts_likes returns now.
+    rows = [
+        {'user_id': like.user_id, 'post_id': like.post_id,
+         'value': like.value, 'id': like.id}
+        for like in likes
+    ]
+    old_cached = json.dumps([LikeInDB.from_orm(like).dict() for like in likes])
+    new_cached = orjson.dumps(rows)
+    cases = {
+        'old_miss': lambda: old_miss(likes),
+        'old_hit': lambda: old_hit(old_cached),
+        'new_miss': lambda: new_miss(rows),
+        'new_hit': lambda: new_hit(new_cached),
+    }
+    assert json.loads(cases['old_hit']()) == json.loads(cases['new_hit']())
+
+    results = {'likes': args.likes}
+    for name, case in cases.items():
+        seconds = min(timeit.repeat(case, number=args.number, repeat=5))
+        results[f'{name}_ms'] = round(seconds / args.number * 1e3, 3)
+    results['miss_speedup'] = round(results['old_miss_ms'] / results['new_miss_ms'], 1)
+    results['hit_speedup'] = round(results['old_hit_ms'] / results['new_hit_ms'], 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
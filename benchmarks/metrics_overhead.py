@@ -0,0 +1,92 @@
+'''Time added to every request by the Prometheus instrumentation.
+
+Calls a small FastAPI app straight through ASGI, with and without
+MetricsMiddleware, and times the SQL statement hooks on their own.
+
+    python -m benchmarks.metrics_overhead --requests 20000
+'''
+import argparse
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+
+from app.services.metrics import (MetricsMiddleware, _after_cursor_execute,
+                                  _before_cursor_execute)
+
+
+def make_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/posts/{post_id}/likes')
+    async def likes(post_id: int):
+        return {'post_id': post_id}
+
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def call(app, path: str) -> None:
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': b'', 'root_path': '', 'headers': [],
+        'client': ('127.0.0.1', 1), 'server': ('test', 80),
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def time_requests(app, requests: int) -> float:
+    for i in range(100):
+        await call(app, f'/posts/{i}/likes')
+    started = time.perf_counter()
+    for i in range(requests):
+        await call(app, f'/posts/{i}/likes')
+    return (time.perf_counter() - started) / requests
+
+
+def time_sql_hooks(statements: int) -> float:
+    conn = SimpleNamespace(info={})
+    started = time.perf_counter()
+    for _ in range(statements):
+        _before_cursor_execute(conn, None, 'SELECT 1', None, None, False)
+        _after_cursor_execute(conn, None, 'SELECT 1', None, None, False)
+    return (time.perf_counter() - started) / statements
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=20_000)
+    args = parser.parse_args()
+
+    plain, instrumented = make_app(False), make_app(True)
+    # Best of a few rounds, alternating, to even out noise.
+    plain_s, instrumented_s = float('inf'), float('inf')
+    for _ in range(3):
+        plain_s = min(plain_s, asyncio.run(time_requests(plain, args.requests)))
+        instrumented_s = min(
+            instrumented_s, asyncio.run(time_requests(instrumented, args.requests))
+        )
+    results = {
+        'requests': args.requests,
+        'plain_us': round(plain_s * 1e6, 1),
+        'instrumented_us': round(instrumented_s * 1e6, 1),
+        'request_overhead_us': round((instrumented_s - plain_s) * 1e6, 1),
+        'request_overhead_pct': round((instrumented_s / plain_s - 1) * 100, 1),
+        'sql_hooks_us': round(time_sql_hooks(args.requests) * 1e6, 2),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
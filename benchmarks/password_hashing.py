@@ -0,0 +1,99 @@
+'''Login throughput and latency of unrelated requests during logins.
+
+Compare bcrypt on the event loop with the process pool:
+
+    PASSWORD_HASH_WORKERS=0 python -m benchmarks.password_hashing
+    python -m benchmarks.password_hashing
+
+Uses the database from .env, run `alembic upgrade head` first.
+'''
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.main import app
+from app.services.database.models.user import User
+from app.services.database.session import async_session, get_engine
+from app.services.security.password_security import (
+    get_password_hash, shutdown_password_executor)
+
+USERNAME = 'bench_login'
+PASSWORD = 'bench_password'
+
+
+async def ensure_user() -> None:
+    get_engine()
+    async with async_session() as session:
+        user = await session.scalar(select(User).where(User.username == USERNAME))
+        if user is None:
+            session.add(User(
+                username=USERNAME,
+                email=f'{USERNAME}@example.com',
+                hashed_password=get_password_hash(PASSWORD),
+                is_active=True,
+            ))
+            await session.commit()
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def timed_requests(send, deadline: float, latencies: list[float]) -> None:
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await send()
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(duration: float, concurrency: int) -> dict:
+    await ensure_user()
+    logins, probes = [], []
+    async with httpx.AsyncClient(app=app, base_url='http://bench') as client:
+        def login():
+            return client.post(
+                '/token', data={'username': USERNAME, 'password': PASSWORD}
+            )
+
+        def probe():
+            return client.get('/posts', params={'limit': 1})
+
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(
+            timed_requests(probe, deadline, probes),
+            *(timed_requests(login, deadline, logins)
+              for _ in range(concurrency)),
+        )
+    await shutdown_password_executor()
+    return {
+        'password_hash_workers': settings.PASSWORD_HASH_WORKERS,
+        'bcrypt_rounds': settings.BCRYPT_ROUNDS,
+        'concurrency': concurrency,
+        'token_rps': round(len(logins) / duration, 1),
+        'token_p99_ms': round(percentile(logins, 0.99) * 1000, 1),
+        'probe_requests': len(probes),
+        'probe_p50_ms': round(percentile(probes, 0.5) * 1000, 1),
+        'probe_p99_ms': round(percentile(probes, 0.99) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+    result = asyncio.run(run(args.duration, args.concurrency))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
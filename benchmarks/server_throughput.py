@@ -0,0 +1,158 @@
+'''Throughput of the server modes of `python -m app.main`, over real sockets.
+
+Starts the server once per mode with the database and Redis from
+settings, loads one path from a few client processes over keep-alive
+connections, then stops it with SIGTERM and times the drain.
+
+- single: one process, asyncio loop and h11, what main() used to run.
+- production: --workers processes with uvloop and httptools.
+
+The access log is off in both, it costs as much as a cached read.
+
+    python -m benchmarks.server_throughput --path /posts/1 --workers 4
+'''
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+CONTENT_LENGTH = re.compile(rb'content-length: *(\d+)', re.IGNORECASE)
+
+
+def percentile(latencies: list[float], q: float) -> float:
+    return latencies[min(int(len(latencies) * q), len(latencies) - 1)]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def modes(workers: int) -> dict[str, dict[str, str]]:
+    return {
+        'single': {'WORKERS': '1', 'SERVER_LOOP': 'asyncio', 'SERVER_HTTP': 'h11'},
+        'production': {
+            'WORKERS': str(workers), 'SERVER_LOOP': 'uvloop', 'SERVER_HTTP': 'httptools',
+        },
+    }
+
+
+async def keep_alive(port: int, path: str, deadline: float, latencies: list) -> int:
+    '''Requests one after the other on one connection, returns the errors.'''
+    errors = 0
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    request = f'GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode()
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            writer.write(request)
+            head = await reader.readuntil(b'\r\n\r\n')
+            await reader.readexactly(int(CONTENT_LENGTH.search(head).group(1)))
+            latencies.append(time.perf_counter() - started)
+            if head[9:12] != b'200':
+                errors += 1
+    finally:
+        writer.close()
+    return errors
+
+
+def client(port: int, path: str, connections: int, duration: float) -> tuple[list, int]:
+    async def run():
+        latencies = []
+        deadline = time.perf_counter() + duration
+        errors = await asyncio.gather(*(
+            keep_alive(port, path, deadline, latencies) for _ in range(connections)
+        ))
+        return latencies, sum(errors)
+    return asyncio.run(run())
+
+
+def wait_until_up(port: int, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f'The server did not listen on {port}')
+
+
+def bench(mode: dict[str, str], args) -> dict:
+    env = {
+        **os.environ, **mode,
+        'HOST': '127.0.0.1', 'PORT': str(args.port), 'SERVER_ACCESS_LOG': 'false',
+    }
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'app.main'], env=env, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_up(args.port)
+        # Fills pools and caches, and waits for the other workers to start.
+        client(args.port, args.path, args.connections, args.warmup)
+        with multiprocessing.Pool(args.clients) as pool:
+            results = pool.starmap(client, [
+                (args.port, args.path, args.connections, args.duration)
+            ] * args.clients)
+    finally:
+        started = time.perf_counter()
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    shutdown = time.perf_counter() - started
+    latencies = sorted(latency for result in results for latency in result[0])
+    return {
+        'requests': len(latencies),
+        'errors': sum(result[1] for result in results),
+        'throughput_rps': round(len(latencies) / args.duration, 1),
+        **{
+            f'p{int(q * 100)}_ms': round(percentile(latencies, q) * 1e3, 2)
+            for q in (0.5, 0.99)
+        },
+        'shutdown_ms': round(shutdown * 1e3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--path', default='/posts')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--clients', type=int, default=2, help='client processes')
+    parser.add_argument('--connections', type=int, default=20,
+                        help='keep-alive connections per client')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', help='also write the results to this file')
+    args = parser.parse_args()
+
+    report = {
+        'commit': git_commit(),
+        'cpus': os.cpu_count(),
+        'options': {key: value for key, value in vars(args).items() if key != 'output'},
+        'modes': {},
+    }
+    for name, mode in modes(args.workers).items():
+        report['modes'][name] = bench(mode, args)
+        print(name, json.dumps(report['modes'][name]), flush=True)
+    body = json.dumps(report, indent=2)
+    print(body)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(body + '\n')
+
+
+if __name__ == '__main__':
+    main()
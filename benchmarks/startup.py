@@ -0,0 +1,84 @@
+'''Import and startup time of the app, and what warming the pool buys.
+
+Imports app.main in fresh interpreters, then runs the lifespan against
+the database and Redis from settings, with and without pool warm-up,
+timing a burst of concurrent sessions right after each startup and
+another one once the pool is full.
+
+    python -m benchmarks.startup --imports 5 --burst 10
+'''
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+IMPORT = (
+    'import time; started = time.perf_counter(); import app.main; '
+    'print(time.perf_counter() - started)'
+)
+
+
+def time_import(runs: int) -> float:
+    return statistics.median(
+        float(subprocess.check_output([sys.executable, '-c', IMPORT], text=True))
+        for _ in range(runs)
+    )
+
+
+async def time_startup(warmup: int, burst: int) -> dict:
+    from sqlalchemy import text
+
+    from app.core.config import settings
+    from app.main import create_app
+    from app.services.database.session import get_session
+
+    async def query() -> float:
+        started = time.perf_counter()
+        async for session in get_session():
+            await session.execute(text('SELECT 1'))
+        return time.perf_counter() - started
+
+    settings.DB_POOL_WARMUP = warmup
+    app = create_app()
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        startup = time.perf_counter() - started
+        first = await asyncio.gather(*(query() for _ in range(burst)))
+        then = await asyncio.gather(*(query() for _ in range(burst)))
+        started = time.perf_counter()
+    shutdown = time.perf_counter() - started
+    return {
+        'startup_ms': round(startup * 1e3, 1),
+        'first_burst_max_ms': round(max(first) * 1e3, 2),
+        'next_burst_max_ms': round(max(then) * 1e3, 2),
+        'shutdown_ms': round(shutdown * 1e3, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--imports', type=int, default=5)
+    parser.add_argument('--burst', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=10,
+                        help='connections opened by the warmed-up run')
+    parser.add_argument('--only', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.only is not None:
+        print(json.dumps(asyncio.run(time_startup(args.only, args.burst))))
+        return
+
+    results = {'import_ms': round(time_import(args.imports) * 1e3, 1)}
+    # Each run in a fresh interpreter, so none starts with warm imports.
+    for warmup in (0, args.warmup):
+        results[f'warmup_{warmup}'] = json.loads(subprocess.check_output([
+            sys.executable, '-m', 'benchmarks.startup',
+            '--only', str(warmup), '--burst', str(args.burst),
+        ], text=True).splitlines()[-1])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+'''Per-request cost of bearer token verification, cached and uncached.
+
+    python -m benchmarks.token_cache
+'''
+import argparse
+import json
+import timeit
+
+from jose import jwt
+
+from app.core.config import settings
+from app.services.database.schemas.tokens import TokenPayload
+from app.services.security.jwt import (ALGORITHM, create_access_token,
+                                       decode_access_token)
+
+
+def uncached(token: str) -> TokenPayload:
+    payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
+    return TokenPayload(**payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20_000)
+    args = parser.parse_args()
+
+    token = create_access_token(data={'user_id': 1})
+    decode_access_token(token)
+    results = {}
+    for name, func in (('uncached', uncached), ('cached', decode_access_token)):
+        seconds = min(timeit.repeat(
+            lambda: func(token), number=args.number, repeat=5
+        ))
+        results[f'{name}_us'] = round(seconds / args.number * 1e6, 2)
+    results['speedup'] = round(results['uncached_us'] / results['cached_us'], 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,14 @@ import string
 from datetime import timedelta
 from typing import AsyncGenerator
 
+import aioredis
 import pytest
 from fastapi.testclient import TestClient
 from fastapi_cache import caches
 from fastapi_cache.backends.memory import CACHE_KEY, InMemoryCacheBackend
+from fastapi_cache.backends.redis import CACHE_KEY as REDIS_CACHE_KEY
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
@@ -19,6 +23,9 @@ from app.services.database.models.posts import Post
 from app.services.database.models.user import User
 from app.services.database.repositories.users import UserCrud
 from app.services.database.session import get_session
+from app.services.email_verification import EmailQueue, get_email_queue
+from app.services.leaderboard import Leaderboard, get_leaderboard
+from app.services.rate_limit import RateLimiter, get_rate_limiter
 from app.services.security.jwt import create_access_token
 from app.services.security.password_security import get_password_hash
 from app.utils.cache import redis_cache
@@ -40,25 +47,83 @@ async_session_maker = sessionmaker(
 metadata.bind = engine_test
 
 
+@pytest.fixture(scope='session')
+def database_url() -> str:
+    return DATABASE_URL_TEST
+
+
 async def override_get_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session
 
 
+# QUERY BUDGETS
+@pytest.fixture(autouse=True, scope='session')
+def strict_query_budgets():
+    settings.DB_QUERY_COUNTER = True
+    settings.DB_QUERY_COUNTER_STRICT = True
+
+
 # CACHE
 @pytest.fixture(autouse=True, scope='session')
 def mock_cache():
     mc = InMemoryCacheBackend()
     caches.set(CACHE_KEY, mc)
+    # Code outside of request handlers looks the Redis cache up directly.
+    caches.set(REDIS_CACHE_KEY, mc)
 
 
 def memory_cache():
     return caches.get(CACHE_KEY)
 
 
+# EMAIL VERIFICATION
+test_email_queue = EmailQueue()
+
+
+@pytest.fixture(scope='session')
+def email_queue() -> EmailQueue:
+    return test_email_queue
+
+
+# LEADERBOARD
+@pytest.fixture
+def leaderboard() -> Leaderboard:
+    board = Leaderboard()
+    app.dependency_overrides[get_leaderboard] = lambda: board
+    yield board
+    del app.dependency_overrides[get_leaderboard]
+
+
+# RATE LIMITS
+@pytest.fixture
+def rate_limiter() -> RateLimiter:
+    limiter = RateLimiter()
+    app.dependency_overrides[get_rate_limiter] = lambda: limiter
+    yield limiter
+    del app.dependency_overrides[get_rate_limiter]
+
+
+# REDIS
+@pytest.fixture
+async def redis_url() -> str:
+    '''An emptied test Redis, for the Redis implementations of services.'''
+    if not settings.TEST_REDIS_HOST:
+        pytest.skip('TEST_REDIS_HOST is not set')
+    password = settings.TEST_REDIS_PASSWORD
+    url = (f'redis://{f":{password}@" if password else ""}'
+           f'{settings.TEST_REDIS_HOST}:{settings.TEST_REDIS_PORT}')
+    client = await aioredis.create_redis(url)
+    await client.flushdb()
+    client.close()
+    await client.wait_closed()
+    return url
+
+
 # DI
 app.dependency_overrides[get_session] = override_get_session
 app.dependency_overrides[redis_cache] = memory_cache
+app.dependency_overrides[get_email_queue] = lambda: test_email_queue
 
 
 @pytest.fixture(autouse=True, scope='session')
@@ -133,6 +198,20 @@ async def user_2_post(user_2):
         return post
 
 
+@pytest.fixture(scope='function')
+async def user_2_new_post(user_2):
+    async with async_session_maker() as session:
+        post = Post(
+            title='new',
+            text='new_text',
+            owner_id=user_2.id,
+        )
+        session.add(post)
+        await session.commit()
+        await session.refresh(post)
+        return post
+
+
 @pytest.fixture(scope='session')
 def event_loop(request):
     '''Create an instance of the default event loop for each test case.'''
@@ -160,7 +239,25 @@ def auth_client(user) -> TestClient:
     yield TestClient(app, headers=headers)
 
 
+@pytest.fixture(scope='session')
+def session_maker() -> sessionmaker:
+    return async_session_maker
+
+
 @pytest.fixture(scope='function')
 async def user_crud() -> UserCrud:
     async with async_session_maker() as session:
         yield UserCrud(session)
+
+
+@pytest.fixture(scope='function')
+def queries() -> list[str]:
+    '''SQL statements run by any engine during the test.'''
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(Engine, 'before_cursor_execute', record)
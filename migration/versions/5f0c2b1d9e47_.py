@@ -0,0 +1,43 @@
+"""post like counters
+
+Revision ID: 5f0c2b1d9e47
+Revises: 3a58c87737d7
+Create Date: 2026-10-18 19:20:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5f0c2b1d9e47'
+down_revision = '3a58c87737d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('likes_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('posts', sa.Column('dislikes_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('posts', sa.Column('score', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        """
+        UPDATE posts
+        SET likes_count = counts.likes,
+            dislikes_count = counts.dislikes,
+            score = counts.likes - counts.dislikes
+        FROM (
+            SELECT post_id,
+                   count(*) FILTER (WHERE value = 'LIKE') AS likes,
+                   count(*) FILTER (WHERE value = 'DISLIKE') AS dislikes
+            FROM likes
+            GROUP BY post_id
+        ) AS counts
+        WHERE posts.id = counts.post_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('posts', 'score')
+    op.drop_column('posts', 'dislikes_count')
+    op.drop_column('posts', 'likes_count')
@@ -0,0 +1,38 @@
+"""post full text search
+
+Revision ID: 8d3e6a4f1c20
+Revises: 5f0c2b1d9e47
+Create Date: 2026-10-18 21:40:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '8d3e6a4f1c20'
+down_revision = '5f0c2b1d9e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed(
+            "setweight(to_tsvector('english', title), 'A') || "
+            "setweight(to_tsvector('english', text), 'B')",
+            persisted=True,
+        ),
+        nullable=True,
+    ))
+    op.create_index(
+        'ix_posts_search_vector', 'posts', ['search_vector'],
+        unique=False, postgresql_using='gin',
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_posts_search_vector', table_name='posts', postgresql_using='gin')
+    op.drop_column('posts', 'search_vector')
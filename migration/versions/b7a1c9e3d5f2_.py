@@ -0,0 +1,37 @@
+"""index foreign keys of posts and likes
+
+Revision ID: b7a1c9e3d5f2
+Revises: 8d3e6a4f1c20
+Create Date: 2026-10-18 22:30:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b7a1c9e3d5f2'
+down_revision = '8d3e6a4f1c20'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('ix_posts_owner_id', 'posts', 'owner_id'),
+    ('ix_likes_post_id', 'likes', 'post_id'),
+)
+
+
+def upgrade() -> None:
+    # CONCURRENTLY keeps the tables writable while the indexes are built,
+    # but cannot run inside the migration transaction. IF NOT EXISTS lets
+    # an interrupted run be repeated, after dropping an index left INVALID.
+    with op.get_context().autocommit_block():
+        for name, table, column in INDEXES:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} '
+                f'ON {table} ({column})'
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, _, _ in INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
@@ -0,0 +1,134 @@
+import os
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from app.core.config import settings
+from app.services.database.replicas import ReplicaSet
+from app.services.database.repositories.posts import PostCrud
+from app.services.database import session
+from app.services.database.session import create_engine, warm_up_pool
+
+
+async def test_pool_metrics(database_url):
+    engine = create_engine(database_url)
+    async with engine.connect() as conn:
+        await conn.execute(text('SELECT 1'))
+        stats = engine.pool.stats()
+        assert 1 == stats['in_use']
+        assert settings.DB_POOL_SIZE == stats['size']
+    stats = engine.pool.stats()
+    assert 0 == stats['in_use']
+    assert stats['checkouts'] >= 1
+    # The connection was opened by the checkout, but it did not wait.
+    assert 1 == stats['connects']
+    assert stats['checkout_wait_seconds'] < stats['connect_seconds']
+    await engine.dispose()
+
+
+async def test_pool_metrics_per_engine(database_url):
+    unreachable_url = database_url.replace(
+        f':{settings.TEST_POSTGRES_PORT}/', ':1/'
+    )
+    engine, unreachable = create_engine(database_url), create_engine(unreachable_url)
+    async with engine.connect() as conn:
+        await conn.execute(text('SELECT 1'))
+    with pytest.raises(OSError):
+        async with unreachable.connect():
+            pass
+
+    assert 1 == engine.pool.stats()['checkouts']
+    # Failing to connect is not waiting for the pool.
+    assert 0 == unreachable.pool.stats()['checkouts']
+    assert 0 == unreachable.pool.stats()['checkout_timeouts']
+    await engine.dispose()
+    await unreachable.dispose()
+
+
+async def test_warm_up_pool(database_url):
+    engine = create_engine(database_url)
+    await warm_up_pool(engine, 3)
+    stats = engine.pool.stats()
+    assert 0 == stats['in_use']
+    assert 3 == engine.pool.checkedin()
+    await engine.dispose()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_forked_child_creates_its_own_engine(database_url, monkeypatch):
+    monkeypatch.setattr(session, 'engine', create_engine(database_url))
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if session.engine is None else 1)
+    _, status = os.waitpid(pid, 0)
+    assert 0 == os.waitstatus_to_exitcode(status)
+    assert session.engine is not None
+
+
+async def test_pgbouncer_mode(database_url, monkeypatch):
+    monkeypatch.setattr(settings, 'DB_PGBOUNCER', True)
+    engine = create_engine(database_url)
+    async with engine.connect() as conn:
+        for _ in range(3):
+            assert 1 == await conn.scalar(text('SELECT 1'))
+        raw = await conn.get_raw_connection()
+        assert 0 == raw.driver_connection._stmt_cache.get_max_size()
+    await engine.dispose()
+
+
+async def test_replicas_round_robin(database_url):
+    replica_set = ReplicaSet(
+        [create_engine(database_url), create_engine(database_url)],
+        retry_after=60,
+    )
+    first, second = replica_set.replicas
+    assert [first, second, first] == [replica_set.choose() for _ in range(3)]
+
+    first.mark_unhealthy()
+    assert [second, second] == [replica_set.choose() for _ in range(2)]
+    second.mark_unhealthy()
+    assert replica_set.choose() is None
+    await replica_set.dispose()
+
+
+async def test_read_falls_back_to_primary(database_url, session_maker, user_2_post):
+    unreachable_url = database_url.replace(
+        f':{settings.TEST_POSTGRES_PORT}/', ':1/'
+    )
+    replica_set = ReplicaSet([create_engine(unreachable_url)], retry_after=60)
+    replica = replica_set.choose()
+    async with session_maker() as session, replica.session_maker() as replica_session:
+        replica_session.info['replica'] = replica
+        post = await PostCrud(session, replica_session).get_by_id(user_2_post.id)
+
+    assert user_2_post.id == post.id
+    assert replica_set.choose() is None
+    await replica_set.dispose()
+
+
+async def test_stream_in_batches(session_maker, user_2_post, user_2_new_post):
+    async with session_maker() as session:
+        batches = [rows async for rows in PostCrud(session).stream(fetch_size=2)]
+        ids = [post.id for post in await PostCrud(session).get_list(limit=1_000)]
+
+    assert all(len(rows) <= 2 for rows in batches)
+    assert ids == [post.id for rows in batches for post in rows]
+
+
+async def test_statement_metrics(database_url):
+    def sample(name: str) -> float:
+        return REGISTRY.get_sample_value(name, {'operation': 'SELECT'}) or 0
+
+    selects = sample('db_statement_duration_seconds_count')
+    errors = sample('db_statement_errors_total')
+    engine = create_engine(database_url)
+    async with engine.connect() as conn:
+        await conn.execute(text('SELECT 1'))
+        with pytest.raises(ProgrammingError):
+            await conn.execute(text('SELECT * FROM missing_table'))
+    await engine.dispose()
+
+    assert selects + 1 == sample('db_statement_duration_seconds_count')
+    assert errors + 1 == sample('db_statement_errors_total')
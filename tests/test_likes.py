@@ -0,0 +1,355 @@
+import asyncio
+
+import pytest
+from fastapi import status
+from fastapi_cache import caches
+from fastapi_cache.backends.memory import CACHE_KEY
+from httpx import AsyncClient
+from sqlalchemy import func, select
+
+from app.main import app
+from app.services.database.models.posts import Like, Post
+from app.services.database.repositories.posts import LikeCrud, UpsertStatus
+from app.services.leaderboard import (Leaderboard, RedisLeaderboard,
+                                     reconcile_leaderboard)
+from app.services.likes_buffer import (LikeBuffer, LikeFlusher,
+                                      RedisLikeBuffer, get_like_flusher)
+from app.utils.cache import cache_lock, get_or_load
+
+
+async def upsert(session_maker, user_id, post_id, value):
+    async with session_maker() as session:
+        return await LikeCrud(session).upsert(user_id, post_id, value)
+
+
+async def test_upsert_reports_status(session_maker, user, user_2_new_post):
+    post_id = user_2_new_post.id
+    assert UpsertStatus.INSERTED == await upsert(session_maker, user.id, post_id, 1)
+    assert UpsertStatus.UNCHANGED == await upsert(session_maker, user.id, post_id, 1)
+    assert UpsertStatus.UPDATED == await upsert(session_maker, user.id, post_id, -1)
+
+
+async def test_concurrent_upserts(session_maker, user, user_2, user_2_new_post):
+    post_id = user_2_new_post.id
+    votes = [
+        upsert(session_maker, voter.id, post_id, value)
+        for _ in range(10)
+        for voter in (user, user_2)
+        for value in (1, -1)
+    ]
+    await asyncio.gather(*votes)
+
+    async with session_maker() as session:
+        likes = await session.scalar(
+            select(func.count())
+            .where(Like.post_id == post_id,
+                   Like.value == Like.LikeValue.LIKE))
+        dislikes = await session.scalar(
+            select(func.count())
+            .where(Like.post_id == post_id,
+                   Like.value == Like.LikeValue.DISLIKE))
+        post = await session.get(Post, post_id)
+
+    assert likes + dislikes == 2
+    assert post.likes_count == likes
+    assert post.dislikes_count == dislikes
+    assert post.score == likes - dislikes
+
+
+@pytest.fixture
+def like_flusher(session_maker):
+    flusher = LikeFlusher(
+        LikeBuffer(),
+        batch_size=2,
+        session_maker=session_maker,
+        cache=caches.get(CACHE_KEY),
+    )
+    app.dependency_overrides[get_like_flusher] = lambda: flusher
+    yield flusher
+    app.dependency_overrides.pop(get_like_flusher)
+
+
+async def test_write_behind_likes(auth_client, user, user_2_new_post, like_flusher):
+    url = f'/posts/{user_2_new_post.id}'
+
+    response = auth_client.post(f'{url}/likes', json={'value': -1})
+    assert 'pending' == response.json().get('status')
+    likes = auth_client.get(f'{url}/likes').json()
+    assert [(user.id, -1)] == [(like['user_id'], like['value']) for like in likes]
+    assert 0 == auth_client.get(f'{url}/score').json().get('dislikes_count')
+
+    assert 1 == await like_flusher.flush()
+    assert 1 == auth_client.get(f'{url}/score').json().get('dislikes_count')
+    likes = auth_client.get(f'{url}/likes').json()
+    assert likes[0]['id'] is not None
+
+    response = auth_client.delete(f'{url}/likes')
+    assert status.HTTP_204_NO_CONTENT == response.status_code
+    assert [] == auth_client.get(f'{url}/likes').json()
+
+    await like_flusher.stop()
+    assert 0 == auth_client.get(f'{url}/score').json().get('dislikes_count')
+    assert {} == await like_flusher.buffer.get_pending(user_2_new_post.id)
+
+
+async def test_flush_requeues_on_failure(mocker, user, user_2_new_post, like_flusher):
+    await like_flusher.add(user_2_new_post.id, user.id, 1)
+    mocker.patch.object(LikeCrud, 'apply_votes', side_effect=RuntimeError)
+
+    with pytest.raises(RuntimeError):
+        await like_flusher.flush()
+
+    assert {user.id: 1} == await like_flusher.buffer.get_pending(user_2_new_post.id)
+    assert [(user_2_new_post.id, user.id, 1)] == await like_flusher.buffer.drain(10)
+
+
+async def stored_votes(session_maker, post_id):
+    async with session_maker() as session:
+        likes = await session.scalars(select(Like).where(Like.post_id == post_id))
+        return {(like.user_id, like.value) for like in likes}
+
+
+@pytest.fixture
+def slow_apply_votes(monkeypatch):
+    '''Holds every LikeCrud.apply_votes until `release` is set.'''
+    started, release = asyncio.Event(), asyncio.Event()
+    apply_votes = LikeCrud.apply_votes
+
+    async def slow(self, votes):
+        started.set()
+        await release.wait()
+        return await apply_votes(self, votes)
+
+    monkeypatch.setattr(LikeCrud, 'apply_votes', slow)
+    return started, release
+
+
+async def test_cancelled_flush_requeues(
+    session_maker, user, user_2, user_2_new_post, like_flusher, slow_apply_votes
+):
+    started, release = slow_apply_votes
+    post_id = user_2_new_post.id
+    await like_flusher.add(post_id, user.id, 1)
+    flush = asyncio.create_task(like_flusher.flush())
+    await started.wait()
+    flush.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await flush
+    await like_flusher.add(post_id, user_2.id, -1)
+
+    release.set()
+    await like_flusher.stop()
+    assert {(user.id, 1), (user_2.id, -1)} == await stored_votes(session_maker, post_id)
+
+
+async def test_stop_waits_for_running_flush(
+    session_maker, user, user_2, user_2_new_post, like_flusher, slow_apply_votes
+):
+    started, release = slow_apply_votes
+    post_id = user_2_new_post.id
+    like_flusher.start()
+    await like_flusher.add(post_id, user.id, 1)
+    await like_flusher.add(post_id, user_2.id, 1)
+    await started.wait()
+    # Made during the flush, so left for the one after it.
+    await like_flusher.add(post_id, user.id, -1)
+
+    stop = asyncio.create_task(like_flusher.stop())
+    await asyncio.sleep(0.05)
+    assert not stop.done()
+    release.set()
+    await stop
+    assert {(user.id, -1), (user_2.id, 1)} == await stored_votes(session_maker, post_id)
+
+
+@pytest.fixture
+async def redis_like_buffer(redis_url):
+    buffer = RedisLikeBuffer(redis_url)
+    yield buffer
+    await buffer.close()
+
+
+async def test_redis_like_buffer(redis_like_buffer):
+    buffer = redis_like_buffer
+    await buffer.add(1, 10, 1)
+    await buffer.add(1, 11, -1)
+    await buffer.add(1, 10, 0)
+    await buffer.add(2, 10, 1)
+    assert {10: 0, 11: -1} == await buffer.get_pending(1)
+
+    # Whole posts are taken, even past the limit.
+    votes = await buffer.drain(1)
+    assert votes in (
+        [(1, 10, 0), (1, 11, -1)], [(1, 11, -1), (1, 10, 0)], [(2, 10, 1)]
+    )
+    drained = {post_id for post_id, _, _ in votes}
+    [other] = {1, 2} - drained
+    # A post being flushed stays pending until acknowledged.
+    await buffer.add(*drained, 12, 1)
+    assert {other} == {post_id for post_id, _, _ in await buffer.drain(10)}
+
+    await buffer.ack(drained)
+    assert {12: 1} == await buffer.get_pending(*drained)
+    assert [(*drained, 12, 1)] == await buffer.drain(10)
+
+
+async def test_redis_like_buffer_drains_past_flushing_posts(redis_like_buffer):
+    buffer = redis_like_buffer
+    for post_id in range(1, 51):
+        await buffer.add(post_id, 10, 1)
+    assert 50 == len(await buffer.drain(100))
+    for post_id in range(1, 52):
+        await buffer.add(post_id, 11, 1)
+
+    assert [(51, 11, 1)] == await buffer.drain(1)
+    assert 50 == await buffer.pending_posts()
+    assert [] == await buffer.drain(100)
+
+
+async def test_redis_like_buffer_requeue(redis_like_buffer):
+    buffer = redis_like_buffer
+    await buffer.add(1, 10, 1)
+    await buffer.add(1, 11, 1)
+    await buffer.add(2, 10, -1)
+    assert 3 == len(await buffer.drain(10))
+    # Votes made during the flush win over the flushed ones.
+    await buffer.add(1, 10, -1)
+
+    await buffer.requeue({1})
+    assert {10: -1, 11: 1} == await buffer.get_pending(1)
+    assert {(1, 10, -1), (1, 11, 1)} == set(await buffer.drain(10))
+
+
+async def test_redis_like_buffer_recovers_expired_batches(redis_url):
+    worker, other_worker = RedisLikeBuffer(redis_url), RedisLikeBuffer(redis_url)
+    await worker.add(1, 10, 1)
+    assert [(1, 10, 1)] == await worker.drain(10)
+    await worker.add(1, 10, -1)
+
+    # Another worker starting leaves a batch that is being flushed alone.
+    await other_worker.recover(60)
+    assert [] == await other_worker.drain(10)
+
+    # Its flusher died, the lease is over.
+    await other_worker.recover(0)
+    assert [(1, 10, -1)] == await other_worker.drain(10)
+    await worker.close()
+    await other_worker.close()
+
+
+async def test_flush_updates_leaderboard(session_maker, user, user_2, user_2_new_post):
+    leaderboard = Leaderboard()
+    flusher = LikeFlusher(
+        LikeBuffer(),
+        session_maker=session_maker,
+        cache=caches.get(CACHE_KEY),
+        leaderboard=leaderboard,
+    )
+    post_id = user_2_new_post.id
+    await flusher.add(post_id, user.id, 1)
+    await flusher.add(post_id, user_2.id, 1)
+    await flusher.flush()
+    await flusher.add(post_id, user.id, -1)
+    await flusher.add(post_id, user_2.id, 0)
+    await flusher.flush()
+
+    assert [(post_id, -1)] == await leaderboard.top(None, 10)
+
+
+async def test_leaderboard_windows():
+    now = 1_000 * 3600
+    leaderboard = Leaderboard(clock=lambda: now)
+    await leaderboard.incr(1, 3)
+    now += 2 * 3600
+    await leaderboard.incr(2, 2)
+    await leaderboard.incr(1, -1)
+
+    # Ties are ranked by id, descending, like ZREVRANGE does.
+    assert [(2, 2), (1, 2)] == await leaderboard.top(None, 10)
+    assert [(2, 2), (1, -1)] == await leaderboard.top('hour', 10)
+    assert [(2, 2), (1, 2)] == await leaderboard.top('day', 10)
+    now += 24 * 3600
+    assert [] == await leaderboard.top('day', 10)
+    assert [(2, 2), (1, 2)] == await leaderboard.top('week', 10)
+
+
+async def test_reconcile_leaderboard(session_maker, user, user_2_new_post):
+    post_id = user_2_new_post.id
+    await upsert(session_maker, user.id, post_id, 1)
+    leaderboard = Leaderboard()
+    await leaderboard.incr(post_id, 5)
+    await leaderboard.incr(0, 1)
+
+    await reconcile_leaderboard(leaderboard, session_maker)
+
+    scores = dict(await leaderboard.top(None, 10_000))
+    assert 1 == scores[post_id]
+    assert 0 not in scores
+    assert 0 not in scores.values()
+
+
+async def test_redis_leaderboard_concurrent_rebuilds(redis_url):
+    async def batches(first_id):
+        for start in range(first_id, first_id + 30, 10):
+            await asyncio.sleep(0)
+            yield [(post_id, post_id) for post_id in range(start, start + 10)]
+
+    leaderboard = RedisLeaderboard(redis_url)
+    await leaderboard.incr(1_000, 1)
+    await asyncio.gather(leaderboard.rebuild(batches(1)), leaderboard.rebuild(batches(101)))
+
+    ranked = await leaderboard.top(None, 100)
+    # One of the runs, whole, and nothing of the other.
+    assert [post_id for post_id, _ in ranked] in (
+        list(range(30, 0, -1)), list(range(130, 100, -1))
+    )
+    client = await leaderboard._client()
+    assert -1 == await client.ttl('leaderboard')
+    assert [] == await client.keys('leaderboard:rebuild:*')
+    await leaderboard.close()
+
+
+async def test_redis_leaderboard_claims_reconcile_once(redis_url):
+    leaderboards = [RedisLeaderboard(redis_url) for _ in range(5)]
+    claims = await asyncio.gather(
+        *(leaderboard.claim_reconcile(60) for leaderboard in leaderboards)
+    )
+    assert 1 == sum(claims)
+    for leaderboard in leaderboards:
+        await leaderboard.close()
+
+
+async def test_get_likes_recomputed_once(user_2_new_post, queries):
+    url = f'/posts/{user_2_new_post.id}/likes'
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        responses = await asyncio.gather(*(client.get(url) for _ in range(300)))
+
+    assert {status.HTTP_200_OK} == {response.status_code for response in responses}
+    assert 1 == len(queries)
+
+
+async def test_get_likes_caches_missing_post(queries):
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        for _ in range(3):
+            response = await client.get('/posts/0/likes')
+            assert status.HTTP_404_NOT_FOUND == response.status_code
+
+    assert 1 == len(queries)
+
+
+async def test_get_or_load_waits_for_lock_holder():
+    cache = caches.get(CACHE_KEY)
+    loads = []
+
+    async def load():
+        loads.append(1)
+        return b'loaded'
+
+    async with cache_lock(cache, 'locked', timeout=5) as acquired:
+        assert acquired
+        waiting = asyncio.create_task(get_or_load(cache, 'locked', load))
+        await asyncio.sleep(0.1)
+        await cache.set('locked', b'from other worker')
+
+    assert b'from other worker' == await waiting
+    assert [] == loads
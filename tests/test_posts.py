@@ -1,9 +1,23 @@
+import json
+
 import pytest
 from fastapi import status
+from fastapi_cache import caches
+from fastapi_cache.backends.memory import CACHE_KEY
+from httpx import AsyncClient
+from sqlalchemy import select, update
+
+from app.core.config import settings
+from app.main import app
+from app.services.database.models.posts import Post
+from app.services.database.schemas.posts import PostInDB
+from app.services.security.permissions import get_current_active_superuser
+from app.utils.cache import TaggedCache, post_tag, redis_cache
+from app.utils.layered_cache import LayeredCacheBackend
 
 
 def test_get_post(client, user_2_post):
-    response = client.get('/posts/1')
+    response = client.get(f'/posts/{user_2_post.id}')
     assert status.HTTP_200_OK == response.status_code
     data = response.json()
     assert user_2_post.title == data.get('title')
@@ -81,6 +95,8 @@ def test_update_post(auth_client):
     response = auth_client.post('/posts', json=data)
     assert status.HTTP_201_CREATED == response.status_code
     response_data = response.json()
+    response = auth_client.get(f'/posts/{response_data.get("id")}')
+    assert 'test_1' == response.json().get('text')
     response = auth_client.patch(
         f'/posts/{response_data.get("id")}',
         json={'text': 'new'}
@@ -89,3 +105,317 @@ def test_update_post(auth_client):
     response = auth_client.get(f'/posts/{response_data.get("id")}')
     assert response.status_code == status.HTTP_200_OK
     assert 'new' == response.json().get('text')
+
+
+def test_get_posts_list_pagination(auth_client):
+    created_ids = []
+    for i in range(3):
+        response = auth_client.post(
+            '/posts',
+            json={'text': f'page_{i}', 'title': 'title_page'}
+        )
+        assert status.HTTP_201_CREATED == response.status_code
+        created_ids.append(response.json().get('id'))
+
+    seen_ids = []
+    params = {'limit': 2}
+    while True:
+        response = auth_client.get('/posts', params=params)
+        assert status.HTTP_200_OK == response.status_code
+        data = response.json()
+        assert len(data['items']) <= 2
+        seen_ids.extend(post['id'] for post in data['items'])
+        if data['next_cursor'] is None:
+            break
+        params['after'] = data['next_cursor']
+
+    assert seen_ids == sorted(set(seen_ids))
+    assert set(created_ids) <= set(seen_ids)
+
+
+def test_get_posts_list_bad_cursor(client):
+    response = client.get('/posts', params={'after': '!!!'})
+    assert status.HTTP_400_BAD_REQUEST == response.status_code
+
+
+def test_like_counters(auth_client, user_2_new_post):
+    url = f'/posts/{user_2_new_post.id}'
+
+    auth_client.post(f'{url}/likes', json={'value': 1})
+    score = auth_client.get(f'{url}/score').json()
+    assert score == {'likes_count': 1, 'dislikes_count': 0, 'score': 1}
+
+    auth_client.post(f'{url}/likes', json={'value': 1})
+    score = auth_client.get(f'{url}/score').json()
+    assert score == {'likes_count': 1, 'dislikes_count': 0, 'score': 1}
+
+    auth_client.post(f'{url}/likes', json={'value': -1})
+    score = auth_client.get(f'{url}/score').json()
+    assert score == {'likes_count': 0, 'dislikes_count': 1, 'score': -1}
+
+    response = auth_client.get(url)
+    assert -1 == response.json().get('score')
+
+    auth_client.delete(f'{url}/likes')
+    score = auth_client.get(f'{url}/score').json()
+    assert score == {'likes_count': 0, 'dislikes_count': 0, 'score': 0}
+
+
+def test_get_likes_only_for_post(auth_client, user_2_post, user_2_new_post):
+    auth_client.post(f'/posts/{user_2_post.id}/likes', json={'value': 1})
+    response = auth_client.get(f'/posts/{user_2_new_post.id}/likes')
+    assert status.HTTP_200_OK == response.status_code
+    assert [] == response.json()
+
+
+def test_get_score_not_found(client):
+    response = client.get('/posts/0/score')
+    assert status.HTTP_404_NOT_FOUND == response.status_code
+
+
+async def test_get_post_served_from_cache(session_maker, user_2_new_post):
+    url = f'/posts/{user_2_new_post.id}'
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        assert 'new' == (await client.get(url)).json().get('title')
+
+        async with session_maker() as session:
+            await session.execute(
+                update(Post)
+                .where(Post.id == user_2_new_post.id)
+                .values(title='changed')
+            )
+            await session.commit()
+        assert 'new' == (await client.get(url)).json().get('title')
+
+        await TaggedCache(caches.get(CACHE_KEY)).invalidate(post_tag(user_2_new_post.id))
+        assert 'changed' == (await client.get(url)).json().get('title')
+
+
+def test_likes_invalidate_post_cache(auth_client, user, user_2_new_post):
+    url = f'/posts/{user_2_new_post.id}'
+    assert [] == auth_client.get(url).json().get('likes')
+
+    auth_client.post(f'{url}/likes', json={'value': 1})
+    likes = auth_client.get(url).json().get('likes')
+    assert [(user.id, 1)] == [(like['user_id'], like['value']) for like in likes]
+
+    auth_client.delete(f'{url}/likes')
+    assert [] == auth_client.get(url).json().get('likes')
+
+
+def test_delete_post(auth_client):
+    response = auth_client.post('/posts', json={'text': 'text', 'title': 'gone'})
+    url = f'/posts/{response.json().get("id")}'
+    assert status.HTTP_200_OK == auth_client.get(url).status_code
+    assert [] == auth_client.get(f'{url}/likes').json()
+
+    response = auth_client.delete(url)
+    assert status.HTTP_200_OK == response.status_code
+    assert 'gone' == response.json().get('title')
+    assert status.HTTP_404_NOT_FOUND == auth_client.get(url).status_code
+    assert status.HTTP_404_NOT_FOUND == auth_client.get(f'{url}/likes').status_code
+
+
+def test_likes_with_layered_cache(auth_client, user, user_2_new_post):
+    cache = LayeredCacheBackend(caches.get(CACHE_KEY))
+    previous = app.dependency_overrides[redis_cache]
+    app.dependency_overrides[redis_cache] = lambda: cache
+    try:
+        url = f'/posts/{user_2_new_post.id}/likes'
+        assert [] == auth_client.get(url).json()
+        assert [] == auth_client.get(url).json()
+        auth_client.post(url, json={'value': 1})
+        assert [user.id] == [like['user_id'] for like in auth_client.get(url).json()]
+    finally:
+        app.dependency_overrides[redis_cache] = previous
+    assert 1 <= cache.stats['local_hits']
+
+
+def test_get_likes_body(auth_client, user, user_2_new_post):
+    url = f'/posts/{user_2_new_post.id}/likes'
+    auth_client.post(url, json={'value': -1})
+    response = auth_client.get(url)
+    assert 'application/json' == response.headers['content-type']
+    [like] = response.json()
+    assert {'user_id': user.id, 'post_id': user_2_new_post.id, 'value': -1} == {
+        key: like[key] for key in ('user_id', 'post_id', 'value')
+    }
+    assert isinstance(like['id'], int)
+
+
+def test_get_posts_by_ids(auth_client, user_2_post, user_2_new_post, queries):
+    ids = [user_2_new_post.id, 0, user_2_post.id, user_2_new_post.id]
+    params = {'ids': ','.join(map(str, ids))}
+
+    response = auth_client.get('/posts', params=params)
+    assert status.HTTP_200_OK == response.status_code
+    data = response.json()
+    assert [user_2_new_post.id, user_2_post.id] == [
+        post['id'] for post in data['items']
+    ]
+    assert data['next_cursor'] is None
+    assert 1 == len([query for query in queries if 'ANY' in query])
+
+    # Only the liked post is read again, the other one comes from the cache.
+    auth_client.post(f'/posts/{user_2_new_post.id}/likes', json={'value': 1})
+    queries.clear()
+    data = auth_client.get('/posts', params=params).json()
+    assert 1 == data['items'][0]['likes_count']
+    assert 1 == len([query for query in queries if 'ANY' in query])
+
+
+@pytest.mark.parametrize('ids', ('', '1,a', '1,,2'))
+def test_get_posts_by_ids_invalid(client, ids):
+    response = client.get('/posts', params={'ids': ids})
+    assert status.HTTP_422_UNPROCESSABLE_ENTITY == response.status_code
+
+
+def test_create_posts_batch(auth_client, user):
+    posts = [{'title': f'batch_{i}', 'text': 'text'} for i in range(3)]
+    response = auth_client.post('/posts/batch', json=posts)
+    assert status.HTTP_201_CREATED == response.status_code
+    created = response.json()
+    assert [post['title'] for post in posts] == [post['title'] for post in created]
+    assert {user.id} == {post['owner_id'] for post in created}
+
+    ids = ','.join(str(post['id']) for post in created)
+    data = auth_client.get('/posts', params={'ids': ids}).json()
+    assert created == data['items']
+
+
+@pytest.mark.parametrize('size', (0, settings.POST_BATCH_MAX_SIZE + 1))
+def test_create_posts_batch_size(auth_client, size):
+    posts = [{'title': 'batch', 'text': 'text'}] * size
+    response = auth_client.post('/posts/batch', json=posts)
+    assert status.HTTP_422_UNPROCESSABLE_ENTITY == response.status_code
+
+
+def test_search_posts(auth_client):
+    posts = [
+        {'title': 'Aardvark feeding', 'text': 'what they eat'},
+        {'title': 'Zoo visit', 'text': 'we saw an aardvark sleeping'},
+        {'title': 'Aardvarks', 'text': 'an aardvark digs, aardvarks dig'},
+    ]
+    created = auth_client.post('/posts/batch', json=posts).json()
+
+    found = []
+    params = {'q': 'aardvark', 'limit': 1}
+    while True:
+        response = auth_client.get('/posts/search', params=params)
+        assert status.HTTP_200_OK == response.status_code
+        data = response.json()
+        found.extend(data['items'])
+        if data['next_cursor'] is None:
+            break
+        params['after'] = data['next_cursor']
+
+    assert {post['id'] for post in created} == {post['id'] for post in found}
+    ranks = [post['rank'] for post in found]
+    assert ranks == sorted(ranks, reverse=True)
+    # Title matches rank above matches in the text only.
+    assert 'Zoo visit' == found[-1]['title']
+
+
+def test_search_posts_no_match(client):
+    response = client.get('/posts/search', params={'q': 'xylophonist'})
+    assert {'items': [], 'next_cursor': None} == response.json()
+
+
+@pytest.mark.parametrize(
+    ('params', 'status_code'),
+    (
+        ({}, status.HTTP_422_UNPROCESSABLE_ENTITY),
+        ({'q': ''}, status.HTTP_422_UNPROCESSABLE_ENTITY),
+        ({'q': 'a' * (settings.SEARCH_QUERY_MAX_LENGTH + 1)},
+         status.HTTP_422_UNPROCESSABLE_ENTITY),
+        ({'q': 'a', 'after': '!!!'}, status.HTTP_400_BAD_REQUEST),
+    ),
+)
+def test_search_posts_bad_request(client, params, status_code):
+    response = client.get('/posts/search', params=params)
+    assert status_code == response.status_code
+
+
+async def test_top_posts(auth_client, user_2_post, user_2_new_post, leaderboard):
+    post_id = user_2_new_post.id
+    await leaderboard.incr(user_2_post.id, 1)
+    auth_client.post(f'/posts/{post_id}/likes', json={'value': 1})
+    auth_client.post(f'/posts/{post_id}/likes', json={'value': 1})
+
+    response = auth_client.get('/posts/top')
+    assert status.HTTP_200_OK == response.status_code
+    top = [(post['id'], post['window_score']) for post in response.json()]
+    assert [(post_id, 1), (user_2_post.id, 1)] == top
+
+    auth_client.post(f'/posts/{post_id}/likes', json={'value': -1})
+    top = auth_client.get('/posts/top', params={'window': 'hour'}).json()
+    assert [(user_2_post.id, 1), (post_id, -1)] == [
+        (post['id'], post['window_score']) for post in top
+    ]
+    auth_client.delete(f'/posts/{post_id}/likes')
+    top = auth_client.get('/posts/top', params={'limit': 1}).json()
+    assert [user_2_post.id] == [post['id'] for post in top]
+    assert [(user_2_post.id, 1), (post_id, 0)] == await leaderboard.top(None, 10)
+
+
+async def test_top_posts_skips_deleted(auth_client, leaderboard):
+    post_id = auth_client.post('/posts', json={'text': 't', 'title': 't'}).json()['id']
+    await leaderboard.incr(post_id, 5)
+    assert [post_id] == [post['id'] for post in auth_client.get('/posts/top').json()]
+
+    auth_client.delete(f'/posts/{post_id}')
+    assert [] == await leaderboard.top(None, 10)
+
+
+@pytest.mark.parametrize('params', ({'window': 'year'}, {'limit': 0}))
+def test_top_posts_bad_request(client, leaderboard, params):
+    response = client.get('/posts/top', params=params)
+    assert status.HTTP_422_UNPROCESSABLE_ENTITY == response.status_code
+
+
+def test_likes_rate_limit(auth_client, user, user_2_new_post, rate_limiter, mocker):
+    url = f'/posts/{user_2_new_post.id}/likes'
+    limit, _ = settings.RATE_LIMIT_LIKES
+    mocker.patch.object(rate_limiter, 'hit', side_effect=[None, None, 30.5])
+    assert status.HTTP_200_OK == auth_client.post(url, json={'value': 1}).status_code
+    assert status.HTTP_204_NO_CONTENT == auth_client.delete(url).status_code
+
+    response = auth_client.post(url, json={'value': 1})
+    assert status.HTTP_429_TOO_MANY_REQUESTS == response.status_code
+    assert '31' == response.headers['Retry-After']
+    key, hit_limit, _ = rate_limiter.hit.call_args.args
+    assert (f'rate_limit:likes:{user.id}', limit) == (key, hit_limit)
+
+
+@pytest.fixture
+def superuser_client(auth_client, user):
+    app.dependency_overrides[get_current_active_superuser] = lambda: user
+    yield auth_client
+    del app.dependency_overrides[get_current_active_superuser]
+
+
+async def test_export_posts(superuser_client, session_maker, user_2_new_post):
+    async with session_maker() as session:
+        ids = list(await session.scalars(select(Post.id).order_by(Post.id)))
+
+    response = superuser_client.get('/export/posts')
+    assert status.HTTP_200_OK == response.status_code
+    assert 'application/x-ndjson' == response.headers['content-type']
+    posts = [json.loads(line) for line in response.text.splitlines()]
+    assert ids == [post['id'] for post in posts]
+    assert set(PostInDB.__fields__) == set(posts[-1])
+
+
+def test_export_likes(superuser_client, user, user_2_new_post):
+    superuser_client.post(f'/posts/{user_2_new_post.id}/likes', json={'value': -1})
+
+    lines = superuser_client.get('/export/likes').text.splitlines()
+    likes = [json.loads(line) for line in lines]
+    assert {'user_id': user.id, 'post_id': user_2_new_post.id, 'value': -1} == {
+        key: likes[-1][key] for key in ('user_id', 'post_id', 'value')
+    }
+
+
+def test_export_requires_superuser(auth_client):
+    response = auth_client.get('/export/posts')
+    assert status.HTTP_400_BAD_REQUEST == response.status_code
@@ -0,0 +1,158 @@
+import hashlib
+import json
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.services.database.repositories.posts import LikeCrud, PostCrud
+from app.services.database.repositories.users import UserCrud
+from app.services.database.schemas.posts import PostBase, PostUpdate
+from app.services.database.schemas.users import UserCreate
+
+# Tables that grow with traffic, a seq scan on them is a missing index.
+HOT_TABLES = {'users', 'posts', 'likes'}
+USERS = 2_000
+POSTS = 50_000
+
+SEED = (
+    f'''
+    INSERT INTO users (username, hashed_password, email, is_active, is_superuser)
+    SELECT 'plan_' || g, 'x', 'plan_' || g || '@example.com', true, false
+    FROM generate_series(1, {USERS}) AS g
+    ''',
+    f'''
+    INSERT INTO posts (title, text, owner_id)
+    SELECT 'title ' || g, 'text ' || md5(g::text), first_user.id + g % {USERS}
+    FROM generate_series(1, {POSTS}) AS g,
+         (SELECT min(id) AS id FROM users WHERE username LIKE 'plan\\_%') AS first_user
+    ''',
+    f'''
+    INSERT INTO likes (user_id, post_id, value)
+    SELECT first_user.id + (posts.id * 7 + shift) % {USERS}, posts.id, 'LIKE'
+    FROM posts, generate_series(0, 1) AS shift,
+         (SELECT min(id) AS id FROM users WHERE username LIKE 'plan\\_%') AS first_user
+    ''',
+    'ANALYZE users, posts, likes',
+)
+
+SAVEPOINTS = ('SAVEPOINT', 'RELEASE', 'ROLLBACK')
+
+# What the ON DELETE CASCADE foreign keys run for every deleted row.
+CASCADES = (
+    ('SELECT 1 FROM posts WHERE owner_id = $1', 'user_id'),
+    ('SELECT 1 FROM likes WHERE user_id = $1', 'user_id'),
+    ('SELECT 1 FROM likes WHERE post_id = $1', 'post_id'),
+)
+
+
+def seq_scans(plan: dict) -> list[str]:
+    tables = []
+    if plan['Node Type'] == 'Seq Scan' and plan['Relation Name'] in HOT_TABLES:
+        tables.append(plan['Relation Name'])
+    for child in plan.get('Plans', ()):
+        tables.extend(seq_scans(child))
+    return tables
+
+
+async def run_crud_queries(session: AsyncSession, post_id: int, user) -> None:
+    posts, likes, users = PostCrud(session), LikeCrud(session), UserCrud(session)
+
+    await posts.get_list(limit=51)
+    await posts.get_list(after_id=post_id, limit=51)
+    await posts.get_by_id(post_id)
+    await posts.get_with_likes(post_id)
+    await posts.get_score(post_id)
+    await posts.get_last_id()
+    await posts.get_scores(post_id, post_id + 1_000)
+    await posts.get_many([post_id, post_id + 1, post_id + 2])
+    term = hashlib.md5(str(POSTS // 2).encode()).hexdigest()
+    await posts.search(term)
+    await posts.search(term, after=(0.1, post_id))
+    await posts.create_many([PostBase(title='t', text='t', owner_id=user.id)] * 2)
+    await posts.update(post_id, PostUpdate(title='new'))
+    await posts.delete(post_id + 3)
+
+    await likes.get_posts_likes(post_id)
+    await likes.upsert(user.id, post_id, 1)
+    await likes.upsert(user.id, post_id, -1)
+    await likes.delete(user.id, post_id)
+    await likes.apply_votes([(user.id, post_id, 1), (user.id, post_id + 1, 0)])
+
+    await users.get_list(limit=51)
+    await users.get_by_id(user.id)
+    await users.get_by_username(user.username)
+    await users.activate_user(user.email)
+    await users.create_user(
+        UserCreate(username='plan_new', email='plan_new@example.com', password='x')
+    )
+
+
+@pytest.fixture(scope='module')
+async def query_plans(database_url) -> list[tuple[str, dict]]:
+    '''Plans of every query the CRUD classes ran against a seeded database.
+
+    Everything happens in one transaction that is rolled back, CRUD
+    commits only release savepoints.
+    '''
+    engine = create_async_engine(database_url, poolclass=NullPool)
+    async with engine.connect() as conn:
+        transaction = await conn.begin()
+        for statement in SEED:
+            await conn.execute(text(statement))
+        post_id = await conn.scalar(text('SELECT min(id) + 100 FROM posts'))
+        user_id = await conn.scalar(text(
+            "SELECT min(id) + 100 FROM users WHERE username LIKE 'plan\\_%'"
+        ))
+        session = AsyncSession(
+            bind=conn,
+            join_transaction_mode='create_savepoint',
+            expire_on_commit=False,
+        )
+        user = await UserCrud(session).get_by_id(user_id)
+
+        queries = []
+
+        def record(conn, cursor, statement, parameters, *args):
+            if not statement.lstrip().upper().startswith(SAVEPOINTS):
+                queries.append((statement, parameters))
+
+        event.listen(engine.sync_engine, 'before_cursor_execute', record)
+        try:
+            await run_crud_queries(session, post_id, user)
+        finally:
+            event.remove(engine.sync_engine, 'before_cursor_execute', record)
+        queries.extend(
+            (statement, (post_id if key == 'post_id' else user_id,))
+            for statement, key in CASCADES
+        )
+
+        plans = []
+        for statement, parameters in queries:
+            result = await conn.exec_driver_sql(
+                f'EXPLAIN (FORMAT JSON) {statement}', parameters
+            )
+            plan = result.scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            plans.append((statement, plan[0]['Plan']))
+        await transaction.rollback()
+    await engine.dispose()
+    return plans
+
+
+def test_every_crud_query_is_explained(query_plans):
+    statements = ' '.join(statement for statement, _ in query_plans)
+    assert 'ANY' in statements
+    assert '@@' in statements
+    assert 'ON CONFLICT' in statements
+
+
+def test_hot_queries_use_indexes(query_plans):
+    seq_scanned = {
+        statement: tables
+        for statement, plan in query_plans
+        if (tables := seq_scans(plan))
+    }
+    assert {} == seq_scanned
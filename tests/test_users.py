@@ -1,5 +1,12 @@
 import pytest
 from fastapi import status
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.main import app
+from app.services.database.repositories.users import UserCrud
+from app.services.security.jwt import create_access_token
+from app.services.user_cache import user_cache
 
 
 @pytest.mark.parametrize(
@@ -52,3 +59,83 @@ def test_get_users_list_without_auth(client):
 def test_get_users_list_with_auth(auth_client):
     response = auth_client.get('/users')
     assert status.HTTP_200_OK == response.status_code
+
+
+def test_get_users_list_pagination(auth_client, user, user_2):
+    response = auth_client.get('/users', params={'limit': 1})
+    assert status.HTTP_200_OK == response.status_code
+    first_page = response.json()
+    assert len(first_page['items']) == 1
+    assert first_page['next_cursor'] is not None
+
+    response = auth_client.get(
+        '/users',
+        params={'limit': 1, 'after': first_page['next_cursor']},
+    )
+    assert status.HTTP_200_OK == response.status_code
+    second_page = response.json()
+    assert second_page['items'][0]['id'] > first_page['items'][0]['id']
+
+
+def test_current_user_is_cached(auth_client, user):
+    user_cache.stats.clear()
+    for _ in range(3):
+        response = auth_client.get('/users')
+        assert status.HTTP_200_OK == response.status_code
+    assert user_cache.stats['misses'] <= 1
+    assert user_cache.stats['local_hits'] >= 2
+
+
+async def test_activate_user_invalidates_cache(user_crud, not_active_user):
+    token = create_access_token(data={'user_id': not_active_user.id})
+    client = TestClient(app, headers={'Authorization': f'Bearer {token}'})
+
+    response = client.get('/users')
+    assert status.HTTP_400_BAD_REQUEST == response.status_code
+
+    await user_crud.activate_user(not_active_user.email)
+    response = client.get('/users')
+    assert status.HTTP_200_OK == response.status_code
+
+
+def test_cached_user_is_read_from_primary(mocker, not_active_user):
+    get_by_id = mocker.spy(UserCrud, 'get_by_id')
+    token = create_access_token(data={'user_id': not_active_user.id})
+    client = TestClient(app, headers={'Authorization': f'Bearer {token}'})
+
+    client.get('/users')
+    get_by_id.assert_called_once_with(mocker.ANY, not_active_user.id, primary=True)
+
+
+def test_cache_stats_requires_superuser(auth_client):
+    response = auth_client.get('/users/cache-stats')
+    assert status.HTTP_400_BAD_REQUEST == response.status_code
+
+
+async def test_sign_up_queues_email_check(client, email_queue):
+    response = client.post(
+        '/sign-up',
+        json={
+            'username': 'queued',
+            'email': 'queued@test.org',
+            'password': 'queuedpass',
+        },
+    )
+    assert status.HTTP_201_CREATED == response.status_code
+    queued = []
+    while item := await email_queue.get(timeout=0.01):
+        queued.append(item[0].email)
+    assert 'queued@test.org' in queued
+
+
+def test_token_rate_limit(client, rate_limiter):
+    limit, window = settings.RATE_LIMIT_TOKEN
+    data = {'username': 'bad_user', 'password': 'user'}
+    for _ in range(limit):
+        assert 400 == client.post('/token', data=data).status_code
+
+    response = client.post('/token', data=data)
+    assert 429 == response.status_code
+    assert 0 < int(response.headers['Retry-After']) <= window
+    # Other routes are counted separately.
+    assert 401 == client.get('/users').status_code
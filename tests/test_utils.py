@@ -1,6 +1,34 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.responses import JSONResponse
+from fastapi_cache.backends.memory import InMemoryCacheBackend
+from fastapi_cache.backends.redis import CACHE_KEY as REDIS_CACHE_KEY
+from fastapi_cache.registry import CacheRegistry
 from httpx import AsyncClient, Response
+from jose import JWTError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 
+from app import main
+from app.core.config import settings
+from app.services.database import session
+from app.services.email_verification import (HEARTBEAT_KEY, EmailJob,
+                                              EmailQueue,
+                                              EmailVerificationWorker,
+                                              RedisEmailQueue, consumer_key)
+from app.services.query_counter import (QueryBudgetExceeded,
+                                        QueryCounterMiddleware, query_budget)
+from app.services.rate_limit import RateLimiter, check_rate_limit
+from app.services.security.jwt import (create_access_token,
+                                       decode_access_token, revoke_token)
+from app.services.security.password_security import (
+    get_password_hash_async, shutdown_password_executor, verify_password_async)
 from app.utils.check_email import check_email
+from app.utils.layered_cache import FLUSH_ALL, LayeredCacheBackend
 
 
 async def test_check_activate_user_if_valid_email(mocker, user_crud, not_active_user):
@@ -33,3 +61,284 @@ async def test_check_activate_user_if_invalid_email(mocker, user_crud, not_activ
     await check_email(not_active_user.email, user_crud)
     user = await user_crud.get_by_id(not_active_user.id)
     assert not user.is_active
+
+
+async def test_password_hashing_in_pool():
+    hashed_password = await get_password_hash_async('password')
+    assert await verify_password_async('password', hashed_password)
+    assert not await verify_password_async('wrong', hashed_password)
+
+
+async def test_password_executor_shutdown_keeps_loop_running():
+    hashing = asyncio.gather(*(get_password_hash_async('password') for _ in range(4)))
+    await asyncio.sleep(0)
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.001)
+
+    ticker = asyncio.create_task(tick())
+    await shutdown_password_executor()
+    ticker.cancel()
+    assert ticks
+    await asyncio.gather(hashing, return_exceptions=True)
+
+
+def test_decode_access_token_is_cached():
+    token = create_access_token(data={'user_id': 1})
+    token_data = decode_access_token(token)
+    assert 1 == token_data.user_id
+    assert token_data is decode_access_token(token)
+
+    revoke_token(token)
+    assert token_data is not decode_access_token(token)
+
+
+def test_expired_token_is_rejected():
+    token = create_access_token(
+        data={'user_id': 1}, expires_delta=timedelta(seconds=-1)
+    )
+    with pytest.raises(JWTError):
+        decode_access_token(token)
+
+
+def stub_verifier(answers):
+    '''Local verifier that replies with (status_code, email_status) in order.'''
+    stub = FastAPI()
+    stub.calls = []
+
+    @stub.get('/v2/email-verifier')
+    async def verify(email: str):
+        status_code, email_status = answers[min(len(stub.calls), len(answers) - 1)]
+        stub.calls.append(email)
+        return JSONResponse({'data': {'status': email_status}}, status_code=status_code)
+
+    return stub
+
+
+async def test_worker_retries_with_backoff(user_crud, session_maker, not_active_user):
+    verifier = stub_verifier([(500, None), (200, 'unknown'), (200, 'valid')])
+    queue = EmailQueue()
+    worker = EmailVerificationWorker(
+        queue,
+        concurrency=2,
+        backoff=0.01,
+        session_maker=session_maker,
+        client=AsyncClient(app=verifier),
+    )
+    await worker.start()
+    await queue.put(EmailJob(email=not_active_user.email))
+    for _ in range(100):
+        if len(verifier.calls) == 3:
+            break
+        await asyncio.sleep(0.02)
+    await worker.stop()
+
+    assert [not_active_user.email] * 3 == verifier.calls
+    user = await user_crud.get_by_id(not_active_user.id)
+    assert user.is_active
+
+
+async def test_worker_gives_up(session_maker, not_active_user):
+    verifier = stub_verifier([(503, None)])
+    queue = EmailQueue()
+    worker = EmailVerificationWorker(
+        queue,
+        max_attempts=2,
+        backoff=0.01,
+        session_maker=session_maker,
+        client=AsyncClient(app=verifier),
+    )
+    await worker.start()
+    await queue.put(EmailJob(email=not_active_user.email))
+    await asyncio.sleep(0.3)
+    await worker.stop()
+
+    assert 2 == len(verifier.calls)
+    assert 0 == await queue.size()
+
+
+async def test_redis_queue_requeues_only_dead_workers(redis_url, session_maker):
+    checked, release = [], asyncio.Event()
+
+    async def slow_handle(job):
+        checked.append(job.email)
+        await release.wait()
+
+    workers = [
+        EmailVerificationWorker(
+            RedisEmailQueue(redis_url, pool_size=3),
+            concurrency=1,
+            session_maker=session_maker,
+        )
+        for _ in range(2)
+    ]
+    for worker in workers:
+        worker.handle = slow_handle
+    await workers[0].start()
+    await workers[0].queue.put(EmailJob(email='first@example.com'))
+    while not checked:
+        await asyncio.sleep(0.01)
+
+    # Starting, the other worker leaves the running check alone.
+    await workers[1].start()
+    await asyncio.sleep(0.2)
+    assert 0 == await workers[1].queue.size()
+    release.set()
+    for worker in workers:
+        await worker.stop()
+    assert ['first@example.com'] == checked
+
+    # A job taken by a worker that died goes back once its heartbeat expires.
+    dead, alive = workers[0].queue, workers[1].queue
+    await dead.heartbeat()
+    await dead.put(EmailJob(email='second@example.com'))
+    assert await dead.get(1)
+    await alive.requeue_unacked()
+    assert 0 == await alive.size()
+    client = await dead._client()
+    await client.delete(consumer_key(HEARTBEAT_KEY, dead.consumer))
+    await alive.requeue_unacked()
+    assert 1 == await alive.size()
+    for queue in (dead, alive):
+        await queue.close()
+
+
+async def test_layered_cache_serves_local_tier_until_evicted():
+    remote = InMemoryCacheBackend()
+    cache = LayeredCacheBackend(remote, local_ttl=60, local_maxsize=10)
+    await cache.set('key', 'value')
+    # Written by another worker, which also publishes the key.
+    await remote.set('key', 'changed')
+
+    assert 'value' == await cache.get('key')
+    cache.evict('key')
+    assert 'changed' == await cache.get('key')
+    assert 'changed' == await cache.get('key')
+    assert await cache.get('absent') is None
+
+    assert {'local': 0.5, 'remote': 0.5} == cache.hit_ratios()
+    cache.evict(FLUSH_ALL)
+    await remote.delete('key')
+    assert await cache.get('key') is None
+
+
+async def test_layered_cache_ttl():
+    cache = LayeredCacheBackend(InMemoryCacheBackend(), local_ttl=60, local_maxsize=10)
+    await cache.set('key', 'value', ttl=1)
+    await cache.delete('key')
+    assert await cache.get('key') is None
+    assert await cache.add('key', 'value', ttl=1)
+    assert not await cache.add('key', 'other', ttl=1)
+
+
+async def test_rate_limiter_sliding_window():
+    now = 1000.0
+    limiter = RateLimiter(clock=lambda: now)
+    assert None is await limiter.hit('key', 2, 10)
+    now += 6
+    assert None is await limiter.hit('key', 2, 10)
+    assert 4 == await limiter.hit('key', 2, 10)
+    assert None is await limiter.hit('other', 2, 10)
+    now += 4
+    # The first request left the window, the rejected one was not counted.
+    assert None is await limiter.hit('key', 2, 10)
+    assert 6 == await limiter.hit('key', 2, 10)
+
+
+async def test_rate_limiter_forgets_idle_clients():
+    now = 1000.0
+    limiter = RateLimiter(clock=lambda: now)
+    for client in range(100):
+        await limiter.hit(f'client:{client}', 2, 10)
+    now += 10
+    await limiter.hit('client:0', 2, 10)
+    assert ['client:0'] == list(limiter._log)
+
+
+async def test_rate_limit_fails_open(mocker):
+    limiter = RateLimiter()
+    mocker.patch.object(limiter, 'hit', side_effect=ConnectionError)
+    assert None is await check_rate_limit(limiter, 'token', '127.0.0.1', (1, 60))
+
+
+def test_metrics_endpoint(client, user_2_post):
+    url = f'/posts/{user_2_post.id}/likes'
+    client.get(url)
+    client.get(url)
+    client.get('/no-such-page')
+
+    response = client.get('/metrics')
+    assert response.headers['content-type'].startswith('text/plain')
+    lines = response.text.splitlines()
+    for sample in (
+        'http_request_duration_seconds_count{method="GET",'
+        'route="/posts/{post_id}/likes",status="200"}',
+        'http_request_duration_seconds_count{method="GET",'
+        'route="unmatched",status="404"}',
+        'cache_requests_total{cache="likes",result="hit"}',
+    ):
+        assert any(line.startswith(sample) for line in lines), sample
+
+
+def query_app(database_url, queries: int, budget: int) -> FastAPI:
+    engine = create_async_engine(database_url, poolclass=NullPool)
+    app = FastAPI()
+    app.add_middleware(QueryCounterMiddleware)
+
+    @app.get('/', dependencies=[Depends(query_budget(budget))])
+    async def n_plus_one():
+        async with engine.connect() as conn:
+            for _ in range(queries):
+                await conn.execute(text('SELECT 1'))
+
+    return app
+
+
+async def test_query_counter_headers(database_url, caplog):
+    app = query_app(database_url, 3, 3)
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        response = await client.get('/')
+    assert '3' == response.headers['X-DB-Queries']
+    assert 0 < float(response.headers['X-DB-Time-Ms'])
+    assert 'N+1 suspect in GET /, sent 3 times: SELECT 1' in caplog.text
+
+
+async def test_query_budget(database_url, caplog, monkeypatch):
+    app = query_app(database_url, 2, 1)
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        with pytest.raises(QueryBudgetExceeded):
+            await client.get('/')
+
+        monkeypatch.setattr(settings, 'DB_QUERY_COUNTER_STRICT', False)
+        assert 200 == (await client.get('/')).status_code
+    assert 'GET / sent 2 statements, its budget is 1' in caplog.text
+
+
+async def test_lifespan_cleans_up_after_failed_step(redis_url, monkeypatch, caplog):
+    async def stop_leaderboard():
+        await main.stop_leaderboard()
+        raise RuntimeError
+
+    monkeypatch.setattr(CacheRegistry, '_caches', {})
+    monkeypatch.setattr(settings, 'REDIS_URI', redis_url)
+    monkeypatch.setattr(settings, 'DB_POOL_WARMUP', 1)
+    monkeypatch.setattr(settings, 'EMAIL_VERIFICATION_WORKER', False)
+    monkeypatch.setattr(main, 'stop_leaderboard', stop_leaderboard)
+    app = main.create_app()
+    async with app.router.lifespan_context(app):
+        assert session.engine is not None
+        assert CacheRegistry.get(REDIS_CACHE_KEY) is not None
+
+    assert 'stop_leaderboard failed at shutdown' in caplog.text
+    # The steps after the failed one still ran.
+    assert app.state.http_client.is_closed
+    assert CacheRegistry.get(REDIS_CACHE_KEY) is None
+    assert session.engine is None
+
+
+def test_query_budget_skips_threadpool():
+    assert asyncio.iscoroutinefunction(query_budget(1))